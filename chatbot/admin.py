@@ -1,7 +1,13 @@
 from django.contrib import admin
-from .models import Article
+from .models import Article, Conversation
 
 
 @admin.register(Article)
 class ArticleAdmin(admin.ModelAdmin):
-    search_fields = ["title", "text"]
+    search_fields = ["title", "url"]
+
+
+@admin.register(Conversation)
+class ConversationAdmin(admin.ModelAdmin):
+    list_display = ["session_key", "updated_at"]
+    search_fields = ["session_key"]
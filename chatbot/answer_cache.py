@@ -0,0 +1,172 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+from .versions import current_version
+
+load_dotenv()
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def normalize_question(question):
+    """
+    Lowercase, collapse whitespace and drop trailing punctuation.
+    """
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+def vectorstore_version(path):
+    """
+    Return a token that changes whenever the vector store at ``path`` is rewritten.
+    """
+    # Versioned stores are immutable once published; the directory name is the version
+    version = current_version(path)
+    if version is not None:
+        return version
+    # Sharded stores rewrite their manifest after every ingestion run
+    index_path = Path(path) / "manifest.json"
+    if not index_path.exists():
+        index_path = Path(path) / "index.faiss"
+    try:
+        stat = index_path.stat()
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+class AnswerCache:
+    """
+    Two-layer cache of chatbot answers.
+
+    The first layer is an exact match on the normalized question. The second
+    embeds the question and looks up past questions in a small inner-product
+    FAISS index, returning the stored answer when cosine similarity reaches
+    ``similarity_threshold``. Entries expire after ``ttl`` seconds, the least
+    recently used ones are evicted past ``max_entries``, and the whole cache is
+    dropped when ``version_fn`` reports a new vector store version.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        version_fn=lambda: None,
+        ttl=ANSWER_CACHE_TTL,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        similarity_threshold=ANSWER_CACHE_SIMILARITY,
+    ):
+        self.embeddings = embeddings
+        self.version_fn = version_fn
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._version = version_fn()
+        self.clear()
+
+    def clear(self):
+        # normalized question -> (vector id, answer, expires_at)
+        self._entries = OrderedDict()
+        self._questions = {}
+        self._index = None
+        self._next_id = 0
+
+    def _embed(self, question):
+        vector = np.asarray([self.embeddings.embed_query(question)], dtype=np.float32)
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _check_version(self):
+        version = self.version_fn()
+        if version != self._version:
+            self._version = version
+            self.clear()
+
+    def _remove(self, key):
+        vector_id, _, _ = self._entries.pop(key)
+        self._questions.pop(vector_id, None)
+        if self._index is not None and vector_id is not None:
+            self._index.remove_ids(np.array([vector_id], dtype=np.int64))
+
+    def _fresh_answer(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def get(self, question, semantic=True):
+        """
+        Return a cached answer for ``question`` or None.
+
+        The question is embedded without holding the lock, so concurrent misses
+        reach the embedder together and can share a batched call. With
+        ``semantic=False`` only the exact layer is consulted and nothing is embedded.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._check_version()
+            answer = self._fresh_answer(key)
+            if answer is not None:
+                self.hits += 1
+                return answer
+            searchable = semantic and self._index is not None and self._index.ntotal
+        vector = self._embed(question) if searchable else None
+        with self._lock:
+            # The cache may have been cleared for a new store version while embedding
+            if vector is not None and self._index is not None and self._index.ntotal:
+                scores, ids = self._index.search(vector, 1)
+                if ids[0][0] != -1 and scores[0][0] >= self.similarity_threshold:
+                    answer = self._fresh_answer(self._questions[int(ids[0][0])])
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return answer
+
+    def set(self, question, answer, semantic=True):
+        """
+        Store ``answer`` for ``question`` in both cache layers, or only the exact one with ``semantic=False``.
+        """
+        key = normalize_question(question)
+        vector = self._embed(question) if semantic else None
+        with self._lock:
+            self._check_version()
+            if key in self._entries:
+                self._remove(key)
+            vector_id = None
+            if vector is not None:
+                if self._index is None:
+                    self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+                vector_id = self._next_id
+                self._next_id += 1
+                self._index.add_with_ids(vector, np.array([vector_id], dtype=np.int64))
+                self._questions[vector_id] = key
+            self._entries[key] = (vector_id, answer, time.monotonic() + self.ttl)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
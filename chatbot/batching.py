@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+
+from .metrics import Histogram
+
+load_dotenv()
+
+# Query embeddings arriving within this window share one API call. Batching is opt-in (0 disables it) and
+# is not a latency win: every query waits up to the window, which cut throughput on the benchmark. It only
+# helps when the embedding provider enforces a per-request rate limit, by spending fewer requests per query
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "0"))
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "64"))
+# Batched calls allowed in flight at once
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))
+
+BATCH_SIZE = Histogram(
+    "chatbot_embedding_batch_size", "Query texts per batched embedding call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+BATCH_WAIT = Histogram(
+    "chatbot_embedding_batch_wait_seconds", "Time a query embedding waited for its batch to be sent.",
+    buckets=(0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Coalesce concurrent ``embed_query`` calls into batched ``embed_documents`` calls.
+
+    A dispatcher thread takes the first waiting query, collects whatever else
+    arrives within ``window`` seconds (up to ``max_batch`` texts) and sends them
+    as one request, so concurrent users cost one API call instead of many. Each
+    query pays up to ``window`` of extra latency for that.
+    Document embedding is already batched by the caller and passes straight through.
+    A failed call fails every query in its batch. ``close`` sends what is queued
+    and stops the dispatcher; later queries raise RuntimeError.
+    """
+
+    def __init__(self, embedder, window=EMBEDDING_BATCH_WINDOW_MS / 1000, max_batch=EMBEDDING_BATCH_MAX_SIZE,
+                 concurrency=EMBEDDING_BATCH_CONCURRENCY):
+        self.embedder = embedder
+        # The embedding cache keys vectors by model name
+        self.model = getattr(embedder, "model", type(embedder).__name__)
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embedding-batch")
+        self._dispatcher = None
+        self._closed = False
+        # Guards starting and closing, so no query is queued behind the stop marker
+        self._start_lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        return self.embedder.embed_documents(texts)
+
+    def embed_query(self, text):
+        future = Future()
+        with self._start_lock:
+            if self._closed:
+                raise RuntimeError("The embedding batcher is closed.")
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="embedding-batcher", daemon=True)
+                self._dispatcher.start()
+            self._queue.put((text, future, time.monotonic()))
+        return future.result()
+
+    def close(self):
+        """
+        Send the queries already queued, wait for every batch in flight and stop the dispatcher.
+        """
+        with self._start_lock:
+            if self._closed:
+                return
+            self._closed = True
+            dispatcher = self._dispatcher
+            self._queue.put(None)
+        if dispatcher is not None:
+            dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def _dispatch(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._executor.submit(self._embed_batch, batch)
+
+    def _embed_batch(self, batch):
+        now = time.monotonic()
+        for _, _, queued in batch:
+            BATCH_WAIT.observe(now - queued)
+        # Identical questions asked at the same moment are embedded once
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        BATCH_SIZE.observe(len(texts))
+        try:
+            vectors = self.embedder.embed_documents(texts)
+            if len(vectors) != len(texts):
+                raise ValueError(f"Expected {len(texts)} embeddings, got {len(vectors)}.")
+            vectors = dict(zip(texts, vectors))
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for text, future, _ in batch:
+            future.set_result(vectors[text])
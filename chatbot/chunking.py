@@ -0,0 +1,139 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from dotenv import load_dotenv
+from langchain.text_splitter import CharacterTextSplitter, RecursiveCharacterTextSplitter
+
+load_dotenv()
+
+# name -> (default chunk size, default overlap); sizes are in tokens for "token", characters otherwise
+SPLITTERS = {
+    "character": (600, 100),
+    "paragraph": (600, 100),
+    "token": (150, 25),
+}
+DEFAULT_SPLITTER = "character"
+# Windows of articles with less text than this are split in-process even when workers are configured:
+# sending the text to the pool and the spans back costs more than splitting it
+CHUNK_PARALLEL_MIN_CHARS = int(os.getenv("CHUNK_PARALLEL_MIN_CHARS", "4000000"))
+
+_splitter = None
+
+
+def make_splitter(name=DEFAULT_SPLITTER, chunk_size=None, chunk_overlap=None):
+    """
+    Build a text splitter by name.
+
+    ``character`` splits on blank lines only, ``paragraph`` falls back to line,
+    sentence and word boundaries, and ``token`` measures chunks with the local tokenizer.
+    Separators are kept and whitespace is not stripped, so every chunk is a
+    verbatim slice of the text; ``split_spans`` trims the whitespace off its span.
+    """
+    default_size, default_overlap = SPLITTERS[name]
+    chunk_size = chunk_size or default_size
+    chunk_overlap = default_overlap if chunk_overlap is None else chunk_overlap
+    verbatim = {"keep_separator": True, "strip_whitespace": False}
+    if name == "character":
+        return CharacterTextSplitter(separator="\n\n", chunk_size=chunk_size, chunk_overlap=chunk_overlap, **verbatim)
+    separators = ["\n\n", "\n", ". ", " ", ""]
+    if name == "paragraph":
+        return RecursiveCharacterTextSplitter(
+            separators=separators, chunk_size=chunk_size, chunk_overlap=chunk_overlap, **verbatim
+        )
+    from .context import count_tokens
+    return RecursiveCharacterTextSplitter(
+        separators=separators, chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=count_tokens,
+        **verbatim
+    )
+
+
+def split_spans(splitter, text):
+    """
+    Split ``text`` and return (start, length) spans instead of chunk strings.
+
+    The splitters from ``make_splitter`` return verbatim slices of ``text`` in
+    order, so each is searched for from just after the start of the previous
+    one; overlapping chunks may start inside it. When a chunk's text occurs more
+    than once, any occurrence reads back the same text. Spans are trimmed of
+    surrounding whitespace, and chunks of only whitespace are skipped.
+    """
+    spans = []
+    start = 0
+    for chunk in splitter.split_text(text):
+        index = text.find(chunk, start)
+        if index < 0:
+            raise ValueError(f"The splitter returned a chunk that is not in the text: {chunk[:80]!r}")
+        start = index + 1
+        stripped = chunk.strip()
+        if stripped:
+            spans.append((index + len(chunk) - len(chunk.lstrip()), len(stripped)))
+    return spans
+
+
+def _init_worker(name, chunk_size, chunk_overlap):
+    global _splitter
+    _splitter = make_splitter(name, chunk_size, chunk_overlap)
+
+
+def _chunk_article(fields):
+    """
+    Return [(field, start, length), ...] for one article's (title, text) pair.
+    """
+    title, text = fields
+    try:
+        return [("title", start, length) for start, length in split_spans(_splitter, title)] + [
+            ("text", start, length) for start, length in split_spans(_splitter, text)
+        ]
+    except ValueError as e:
+        raise ValueError(f"Cannot chunk {title!r}: {e}") from e
+
+
+def iter_chunk_spans(articles, name=DEFAULT_SPLITTER, chunk_size=None, chunk_overlap=None, workers=4,
+                     window=256, min_parallel_chars=CHUNK_PARALLEL_MIN_CHARS):
+    """
+    Yield (article, spans) for each article, chunking windows of articles on a process pool.
+
+    Only titles and texts are sent to the workers and only offsets come back.
+    The next window is submitted before the current one is yielded, so splitting
+    overlaps with whatever the caller does with the results. ``workers`` of 0 or
+    1 splits in this process, as does any window with fewer than
+    ``min_parallel_chars`` characters; the pool is only started for a window
+    large enough to pay for it.
+    """
+    articles = iter(articles)
+    _init_worker(name, chunk_size, chunk_overlap)
+    if workers <= 1:
+        for article in articles:
+            yield article, _chunk_article((article.title, article.text))
+        return
+
+    executor = None
+
+    def submit():
+        nonlocal executor
+        batch = list(islice(articles, window))
+        fields = [(article.title, article.text) for article in batch]
+        if sum(len(title) + len(text) for title, text in fields) < min_parallel_chars:
+            return batch, fields, None
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(name, chunk_size, chunk_overlap)
+            )
+        chunksize = max(1, len(batch) // (workers * 4))
+        return batch, fields, executor.map(_chunk_article, fields, chunksize=chunksize)
+
+    try:
+        pending = submit()
+        while pending[0]:
+            batch, fields, results = pending
+            pending = submit()
+            yield from zip(batch, map(_chunk_article, fields) if results is None else results)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def chunk_text(article, field, start, length):
+    source = article.title if field == "title" else article.text
+    return source[start:start + length]
@@ -0,0 +1,206 @@
+import os
+import re
+from functools import lru_cache
+from typing import Any
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .fakes import fake_backends_enabled
+from .metrics import Histogram, timed_stage
+
+load_dotenv()
+
+CONTEXT_ASSEMBLY = os.getenv("CONTEXT_ASSEMBLY", "true").lower() in ("1", "true", "yes")
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Candidates fetched from the underlying retriever before merging and packing
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "12"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))
+CONTEXT_DUPLICATE_THRESHOLD = float(os.getenv("CONTEXT_DUPLICATE_THRESHOLD", "0.8"))
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "cl100k_base")
+
+# The splitter drops its "\n\n" separator between consecutive chunks
+_MERGE_GAP = 2
+# Don't bother truncating a chunk into less room than this
+_MIN_TRUNCATED_TOKENS = 64
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+
+CONTEXT_TOKENS = Histogram(
+    "chatbot_context_tokens", "Tokens of retrieved context passed to the LLM.",
+    buckets=(100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000),
+)
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    """
+    Return the tiktoken encoding, or None to fall back to a word-and-punctuation estimate.
+    """
+    if fake_backends_enabled():
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(CONTEXT_TOKENIZER)
+    except Exception:
+        return None  # tiktoken fetches its tables on first use; stay usable offline
+
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        return len(_TOKEN.findall(text))
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text, limit):
+    encoding = _encoding()
+    if encoding is None:
+        matches = list(_TOKEN.finditer(text))
+        return text if len(matches) <= limit else text[:matches[limit].start()].rstrip()
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= limit else encoding.decode(tokens[:limit])
+
+
+def _words(text):
+    return set(_TOKEN.findall(text.lower()))
+
+
+def _shingles(text, size=3):
+    words = _TOKEN.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def merge_chunks(documents):
+    """
+    Merge overlapping or adjacent chunks of the same article field into single documents.
+
+    Documents come in relevance order; each merged document keeps the rank of its
+    best chunk. Bare title chunks are dropped when text from the same article is present.
+    """
+    groups = {}
+    for rank, document in enumerate(documents):
+        metadata = document.metadata
+        if not document.page_content or metadata.get("missing"):
+            continue
+        if metadata.get("article_id") is None or "start" not in metadata:
+            key = ("rank", rank)
+        else:
+            key = (metadata["article_id"], metadata.get("field"))
+        groups.setdefault(key, []).append((rank, document))
+
+    articles_with_text = {key[0] for key in groups if key[1] == "text"}
+    merged = []
+    for key, members in groups.items():
+        if key[1] == "title" and key[0] in articles_with_text:
+            continue
+        members.sort(key=lambda member: member[1].metadata.get("start", 0))
+        best_rank, first = min(members, key=lambda member: member[0])[0], members[0][1]
+        start, text = first.metadata.get("start", 0), first.page_content
+        vector_ids = [first.metadata.get("vector_id")]
+        spans = []
+        for _, document in members[1:]:
+            end = start + len(text)
+            chunk_start = document.metadata["start"]
+            if chunk_start <= end + _MERGE_GAP:
+                separator = "\n\n" if chunk_start > end else ""
+                text += separator + document.page_content[max(0, end - chunk_start):]
+                vector_ids.append(document.metadata.get("vector_id"))
+            else:
+                spans.append((start, text, vector_ids))
+                start, text, vector_ids = chunk_start, document.page_content, [document.metadata.get("vector_id")]
+        spans.append((start, text, vector_ids))
+        for span_start, span_text, span_ids in spans:
+            metadata = {**first.metadata, "start": span_start, "vector_ids": span_ids}
+            merged.append((best_rank, Document(page_content=span_text, metadata=metadata)))
+    merged.sort(key=lambda item: item[0])
+    return [document for _, document in merged]
+
+
+def drop_near_duplicates(documents, threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """
+    Drop documents whose word shingles overlap a better-ranked document's by ``threshold`` or more.
+    """
+    kept, kept_shingles = [], []
+    for document in documents:
+        shingles = _shingles(document.page_content)
+        if any(_jaccard(shingles, other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(document)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def mmr_order(documents, mmr_lambda=CONTEXT_MMR_LAMBDA):
+    """
+    Reorder by maximal marginal relevance.
+
+    Relevance is taken from the retriever's ranking and redundancy from word
+    overlap, so no extra embedding calls are needed.
+    """
+    remaining = list(range(len(documents)))
+    words = [_words(document.page_content) for document in documents]
+    relevance = [1.0 - rank / len(documents) for rank in remaining]
+    selected = []
+    while remaining:
+        def score(i):
+            redundancy = max((_jaccard(words[i], words[j]) for j in selected), default=0.0)
+            return mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+
+        best = max(remaining, key=score)
+        selected.append(best)
+        remaining.remove(best)
+    return [documents[i] for i in selected]
+
+
+def pack_documents(documents, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Take documents in order while they fit in ``token_budget``, truncating the one that overflows.
+    """
+    packed, used = [], 0
+    for document in documents:
+        tokens = count_tokens(document.page_content)
+        remaining = token_budget - used
+        if tokens <= remaining:
+            packed.append(document)
+            used += tokens
+        elif remaining >= _MIN_TRUNCATED_TOKENS:
+            text = truncate_tokens(document.page_content, remaining)
+            packed.append(Document(page_content=text, metadata={**document.metadata, "truncated": True}))
+            used += count_tokens(text)
+            break
+    return packed, used
+
+
+def assemble_context(documents, token_budget=CONTEXT_TOKEN_BUDGET, mmr_lambda=CONTEXT_MMR_LAMBDA,
+                     duplicate_threshold=CONTEXT_DUPLICATE_THRESHOLD):
+    """
+    Merge, deduplicate, diversify and pack retrieved chunks into a prompt-sized context.
+    """
+    documents = drop_near_duplicates(merge_chunks(documents), duplicate_threshold)
+    packed, used = pack_documents(mmr_order(documents, mmr_lambda), token_budget)
+    CONTEXT_TOKENS.observe(used)
+    return packed
+
+
+class ContextAssemblingRetriever(BaseRetriever):
+    """
+    Wrap a retriever and hand the LLM a merged, deduplicated context within a token budget.
+    """
+
+    retriever: Any
+    token_budget: int = CONTEXT_TOKEN_BUDGET
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA
+    duplicate_threshold: float = CONTEXT_DUPLICATE_THRESHOLD
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        documents = self.retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        with timed_stage("context_assembly"):
+            return assemble_context(documents, self.token_budget, self.mmr_lambda, self.duplicate_threshold)
@@ -0,0 +1,53 @@
+from itertools import islice
+from pathlib import Path
+
+from .hashing import content_hash
+from .textstore import encode_blocks
+
+
+def open_dataset(subset, path=None):
+    """
+    Return an iterable over Wikipedia rows without materializing the split.
+
+    With ``path``, rows come from a local directory: either one written by
+    ``Dataset.save_to_disk`` (memory-mapped Arrow) or plain data files such as
+    parquet or JSON, so loading can run offline.
+    """
+    from datasets import load_dataset, load_from_disk
+
+    if path is None:
+        return load_dataset("wikipedia", subset, split="train", streaming=True)
+    path = Path(path)
+    if (path / "state.json").exists() or (path / "dataset_dict.json").exists():
+        dataset = load_from_disk(str(path))
+        return dataset["train"] if hasattr(dataset, "keys") else dataset
+    return load_dataset(str(path), split="train", streaming=True)
+
+
+def iter_batches(rows, size, limit=None):
+    """
+    Yield lists of at most ``size`` rows, stopping after ``limit`` rows if given.
+    """
+    rows = iter(rows) if not limit else islice(rows, limit)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def convert_row(row):
+    """
+    Turn a dataset row into an (title, url, text blocks, content_hash) tuple, or None for a malformed row.
+
+    Kept free of Django imports so it can run in worker processes; the text is
+    compressed here too, so the main process only writes bytes. A row without a
+    title or text is returned as None so one bad row does not abort the load.
+    """
+    try:
+        title = row["title"][:255]
+        url = row.get("url") or ""
+        text = row["text"]
+        return title, url, encode_blocks(text), content_hash(title, url, text)
+    except (KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,158 @@
+import os
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "true").lower() in ("1", "true", "yes")
+# Estimated Jaccard similarity of word shingles above which a chunk counts as a near-duplicate
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+DEDUP_NUM_PERM = int(os.getenv("DEDUP_NUM_PERM", "64"))
+DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "3"))
+# Boilerplate headings followed by fewer than this many other words are trimmed off chunks
+DEDUP_BOILERPLATE_WORDS = int(os.getenv("DEDUP_BOILERPLATE_WORDS", "12"))
+
+# Section headings Wikipedia articles end with that carry no content of their own
+BOILERPLATE_HEADINGS = frozenset({
+    "related pages", "other websites", "references", "sources", "notes", "further reading", "external links",
+    "see also", "books", "other pages", "gallery", "footnotes", "bibliography",
+})
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD = re.compile(r"\w+")
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def is_boilerplate(text, max_words=DEDUP_BOILERPLATE_WORDS):
+    """
+    True for a chunk that is mostly boilerplate section headings ("Related pages", "Other websites", ...).
+    """
+    lines = [line.strip().rstrip(":").lower() for line in text.splitlines() if line.strip()]
+    content = [line for line in lines if line not in BOILERPLATE_HEADINGS]
+    return len(content) < len(lines) and len(_words(" ".join(content))) < max_words
+
+
+def content_length(text, max_words=DEDUP_BOILERPLATE_WORDS):
+    """
+    Return the length of ``text`` without a trailing run of boilerplate sections.
+
+    The run starts at the earliest boilerplate heading line after which fewer
+    than ``max_words`` words are not headings, so "Related pages" followed by a
+    couple of links is cut while a "References" section with real text is kept.
+    A chunk that is all boilerplate has length 0.
+    """
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        if line.strip().rstrip(":").lower() in BOILERPLATE_HEADINGS and is_boilerplate(text[offset:], max_words):
+            return len(text[:offset].rstrip())
+        offset += len(line)
+    return len(text)
+
+
+def lsh_bands(threshold, num_perm):
+    """
+    Pick (bands, rows) with ``bands * rows == num_perm`` whose LSH threshold is closest to ``threshold`` from below.
+
+    Candidates are verified against the estimated similarity, so a lower band
+    threshold only costs extra comparisons, while a higher one misses duplicates.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows == 0 and (rows / num_perm) ** (1 / rows) <= threshold:
+            best = (num_perm // rows, rows)
+    return best
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles.
+
+    Shingles are hashed with CRC32 so signatures are stable across processes and
+    can be stored with the chunk. Signature values are truncated to 16 bits to
+    keep stored signatures small; collisions only nudge the similarity estimate.
+    """
+
+    def __init__(self, num_perm=DEDUP_NUM_PERM, shingle_words=DEDUP_SHINGLE_WORDS, seed=1):
+        generator = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self._a = generator.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = generator.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text):
+        words = _words(text)
+        n = min(self.shingle_words, len(words)) or 1
+        return {" ".join(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))}
+
+    def signature(self, text):
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in self.shingles(text)], dtype=np.uint64)
+        permuted = (np.outer(hashes, self._a) + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint16)
+
+
+class ChunkDeduplicator:
+    """
+    LSH index of MinHash signatures for dropping near-duplicate chunks before they are embedded.
+
+    Signatures are keyed by vector id so chunks can be removed again when their
+    article changes. ``duplicate_of`` returns the key of an indexed chunk whose
+    estimated similarity reaches ``threshold``.
+    """
+
+    def __init__(self, threshold=DEDUP_THRESHOLD, num_perm=DEDUP_NUM_PERM, shingle_words=DEDUP_SHINGLE_WORDS):
+        self.threshold = threshold
+        self.hasher = MinHasher(num_perm, shingle_words)
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self._buckets = [defaultdict(set) for _ in range(self.bands)]
+        self._signatures = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, text):
+        return self.hasher.signature(text)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, key, signature):
+        if key in self._signatures:
+            self.remove(key)
+        self._signatures[key] = signature
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            bucket[band].add(key)
+
+    def remove(self, key):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            keys = bucket[band]
+            keys.discard(key)
+            if not keys:
+                del bucket[band]
+
+    def duplicate_of(self, signature):
+        candidates = set()
+        for bucket, band in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(band, ()))
+        for key in candidates:
+            if np.mean(self._signatures[key] == signature) >= self.threshold:
+                return key
+        return None
+
+
+def signature_bytes(signature):
+    return signature.astype("<u2").tobytes()
+
+
+def signature_from_bytes(data):
+    return np.frombuffer(bytes(data), dtype="<u2").astype(np.uint16)
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from .batching import EMBEDDING_BATCH_WINDOW_MS, BatchingEmbeddings
+from .fakes import FakeEmbeddings, fake_backends_enabled
+from .metrics import timed_stage
+
+load_dotenv()
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Empty keeps the cache in a file beside the vector store it serves (see embedding_cache_path)
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "")
+EMBEDDING_CACHE_SUFFIX = ".embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "1000000"))
+
+# SQLite limits the number of bound parameters per statement.
+_LOOKUP_BATCH = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wrap an embedder with a disk-backed, size-bounded vector cache.
+
+    Entries are keyed by model name plus a SHA-256 of the text and stored as
+    float32 blobs in a SQLite file. When the cache grows past ``max_entries`` the
+    least recently used tenth is evicted.
+    """
+
+    # Live caches, so metrics can report an aggregate hit rate
+    instances = weakref.WeakSet()
+
+    def __init__(self, embedder, path, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.embedder = embedder
+        self.model_name = getattr(embedder, "model", type(embedder).__name__)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        CachedEmbeddings.instances.add(self)
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH):
+                window = keys[start:start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(window))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", window
+                ).fetchall()
+                found.update((key, np.frombuffer(blob, dtype=np.float32).tolist()) for key, blob in rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+        return found
+
+    def _store(self, items):
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.execute("COMMIT")
+            self._entries += len(rows)
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def _evict(self):
+        """
+        Drop the least recently used entries down to 90% of ``max_entries``.
+        """
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._entries - int(self.max_entries * 0.9)
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._entries -= excess
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self._count(len(texts) - len(missing), len(missing))
+
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self._store(new_items)
+            found.update(new_items)
+        return [found[key] for key in keys]
+
+    def _count(self, hits, misses):
+        # Requests embed queries from many threads; unlocked += would drop updates
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def embed_query(self, text):
+        with timed_stage("embed_query"):
+            return self._embed_query(text)
+
+    def _embed_query(self, text):
+        key = self._key(text)
+        found = self._lookup([key])
+        if key in found:
+            self._count(1, 0)
+            return found[key]
+
+        self._count(0, 1)
+        vector = self.embedder.embed_query(text)
+        self._store([(key, vector)])
+        return vector
+
+    def stats(self):
+        """
+        Return hit/miss counters and the current number of cached vectors.
+        """
+        with self._lock:
+            hits, misses, entries = self.hits, self.misses, self._entries
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+
+def embedding_cache_path(store_path):
+    """
+    Return ``EMBEDDING_CACHE_PATH`` if set, else a file beside the vector store directory ``store_path``.
+
+    The file sits next to the directory rather than in it, so it survives ``ingest_embeddings --delete``.
+    """
+    configured = os.getenv("EMBEDDING_CACHE_PATH", EMBEDDING_CACHE_PATH)
+    if configured:
+        return configured
+    store_path = Path(store_path).absolute()
+    store_path.parent.mkdir(parents=True, exist_ok=True)
+    return str(store_path.with_name(store_path.name + EMBEDDING_CACHE_SUFFIX))
+
+
+def get_embeddings(store_path=None):
+    """
+    Return the OpenAI embedder, or its offline stand-in, wrapped in the on-disk cache of a vector store.
+
+    ``store_path`` defaults to ``VECTORSTORE_PATH``. With ``EMBEDDING_BATCH_WINDOW_MS``
+    set, cache misses for single queries are micro-batched across concurrent callers,
+    which only pays off under a per-request rate limit.
+    """
+    if fake_backends_enabled():
+        embedder = FakeEmbeddings(
+            dimension=int(os.getenv("FAKE_EMBEDDING_DIMENSION", "256")),
+            latency=float(os.getenv("FAKE_EMBEDDING_LATENCY", "0")),
+        )
+    else:
+        embedder = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
+    if EMBEDDING_BATCH_WINDOW_MS > 0:
+        embedder = BatchingEmbeddings(embedder)
+    store_path = store_path or os.getenv("VECTORSTORE_PATH", "./wiki_embeddings")
+    return CachedEmbeddings(embedder, path=embedding_cache_path(store_path))
@@ -0,0 +1,101 @@
+import os
+import re
+import time
+import zlib
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+def fake_backends_enabled():
+    """
+    True when ``CHATBOT_FAKE_BACKENDS`` asks for the offline stand-ins instead of OpenAI.
+    """
+    return os.getenv("CHATBOT_FAKE_BACKENDS", "").lower() in ("1", "true", "yes")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic offline stand-in for ``OpenAIEmbeddings``.
+
+    Texts are embedded with the hashing trick over lowercase word tokens, so texts
+    sharing words land near each other and retrieval results stay meaningful.
+    ``latency`` seconds are slept per call to mimic an API round trip.
+    """
+
+    model = "fake-embedding"
+
+    def __init__(self, dimension=256, latency=0.0):
+        self.dimension = dimension
+        self.latency = latency
+        self.calls = 0
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            digest = zlib.crc32(token.encode("utf-8"))
+            vector[digest % self.dimension] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic offline stand-in for ``ChatOpenAI``.
+
+    Replies echo the start of the last message, streamed word by word, after
+    ``latency`` seconds. Token counts are whitespace word counts.
+    """
+
+    latency: float = 0.0
+    model_name: str = "fake-chat"
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _reply(self, messages):
+        if self.latency:
+            time.sleep(self.latency)
+        words = messages[-1].content.split()
+        return "Offline answer: " + " ".join(words[:40])
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        for index, word in enumerate(self._reply(messages).split(" ")):
+            token = word if index == 0 else f" {word}"
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def get_num_tokens(self, text):
+        return len(text.split())
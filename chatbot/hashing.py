@@ -0,0 +1,12 @@
+import hashlib
+
+
+def content_hash(*parts):
+    """
+    Return a stable SHA-256 hex digest over the given text parts.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
@@ -0,0 +1,238 @@
+import os
+import re
+from typing import Any
+
+from django.db import connection
+from django.db.models.functions import Lower
+from dotenv import load_dotenv
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+from .metrics import timed_stage
+from .models import Article, ArticleChunk, VectorStore
+from .vectorstore import ArticleDocstore
+
+load_dotenv()
+
+FTS_TABLE = "chatbot_chunk_fts"
+
+# "hybrid" fuses BM25 and vector results; "vector" uses the FAISS retriever alone
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid")
+
+# Question templates (see get_topic_suggestions) whose remainder is likely an article title
+_TITLE_QUESTION = re.compile(
+    r"^(?:what (?:is|are|was|were)(?: the main points about)?|who (?:is|was)|can you explain|tell me about|"
+    r"why is)\s+(?P<title>.+?)(?:\s+important)?\s*[?.!]*$",
+    re.IGNORECASE,
+)
+
+
+def fts_available():
+    if connection.vendor != "sqlite":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def index_chunks(rows):
+    """
+    Add (chunk pk, title, body) rows to the full-text index.
+
+    The index is contentless, so rows cannot be deleted or updated in place.
+    Rows of deleted chunks are skipped by joining every match to its chunk row
+    (chunk pks are never reused), and ``rebuild_index`` reclaims their space.
+    """
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, title, body) VALUES (%s, %s, %s)", rows)
+
+
+def delete_all():
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('delete-all')")
+
+
+def _match_expression(query, column=None):
+    terms = re.findall(r"\w+", query.lower())
+    if not terms:
+        return None
+    prefix = f"{column} : " if column else ""
+    return " OR ".join(f'{prefix}"{term}"' for term in terms)
+
+
+def _chunk_join(store):
+    """
+    Return the SQL joining ``matches`` to live chunk rows, of the store keyed ``store`` unless it is None, and params.
+    """
+    join = f"JOIN {ArticleChunk._meta.db_table} chunk ON chunk.id = matches.rowid AND chunk.retired_in = ''"
+    if store is None:
+        return join, []
+    return (
+        f"{join} JOIN {VectorStore._meta.db_table} store ON store.id = chunk.store_id AND store.key = %s",
+        [store],
+    )
+
+
+def search(query, k=20, store=None):
+    """
+    Return up to ``k`` (chunk pk, bm25 score) pairs of the store keyed ``store``, best first.
+
+    The matches are materialized before they are joined to the chunk rows, so
+    SQLite reads them from the full-text index instead of probing it once per chunk.
+    """
+    expression = _match_expression(query)
+    if expression is None:
+        return []
+    join, params = _chunk_join(store)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"WITH matches AS MATERIALIZED ("
+            f"SELECT rowid, bm25({FTS_TABLE}) AS score FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s) "
+            f"SELECT matches.rowid, matches.score FROM matches {join} ORDER BY matches.score LIMIT %s",
+            [expression, *params, k],
+        )
+        return cursor.fetchall()
+
+
+def title_candidate(query):
+    """
+    Extract the probable article title from a question such as "What is August?".
+    """
+    match = _TITLE_QUESTION.match(query.strip())
+    title = match.group("title") if match else query.strip().rstrip("?.!")
+    return title.strip().lower()
+
+
+def title_matches(title, store=None):
+    """
+    Return the chunk pks of the store keyed ``store`` whose article title is ``title`` ignoring case, in reading order.
+
+    Articles are found through the index on ``LOWER(title)``. SQLite only lowers
+    ASCII letters, so the title is also tried with a capital first letter, and
+    the matches are compared again in Python.
+    """
+    if not title:
+        return []
+    candidates = {title, title[:1].upper() + title[1:]}
+    articles = Article.objects.alias(title_lower=Lower("title")).filter(title_lower__in=candidates)
+    article_ids = [pk for pk, article_title in articles.values_list("pk", "title") if article_title.lower() == title]
+    if not article_ids:
+        return []
+    chunks = ArticleChunk.objects.filter(article_id__in=article_ids, duplicate_of__isnull=True, retired_in="")
+    if store is not None:
+        chunks = chunks.filter(store__key=store)
+    return list(chunks.order_by("article_id", "chunk_index").values_list("pk", flat=True))
+
+
+def rebuild_index(batch_size=500):
+    """
+    Repopulate the full-text index from every live embedded ``ArticleChunk`` row, dropping rows of dropped chunks.
+    """
+    docstore = ArticleDocstore(cache_size=0)
+    delete_all()
+    rows = []
+    count = 0
+    chunks = ArticleChunk.objects.filter(duplicate_of__isnull=True, retired_in="")
+    for pk, vector_id in chunks.values_list("pk", "vector_id").iterator(chunk_size=batch_size):
+        document = docstore.search(vector_id)
+        rows.append((pk, document.metadata.get("title", ""), document.page_content))
+        if len(rows) >= batch_size:
+            index_chunks(rows)
+            count += len(rows)
+            rows = []
+    index_chunks(rows)
+    return count + len(rows)
+
+
+def found(documents):
+    """
+    Drop the placeholders of chunks whose row was gone when they were fetched, so a race costs recall, not context.
+    """
+    return [document for document in documents if not document.metadata.get("missing")]
+
+
+class FoundRetriever(BaseRetriever):
+    """
+    Wrap the vector-only retriever to drop chunks without a row.
+    """
+
+    retriever: Any
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        return found(self.retriever.invoke(query, config={"callbacks": run_manager.get_child()}))
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun):
+        return found(await self.retriever.ainvoke(query, config={"callbacks": run_manager.get_child()}))
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuse BM25 and vector results with reciprocal rank fusion.
+
+    A question that names an article title exactly ("What is August?") is
+    answered from the lexical index alone, without embedding the query.
+    """
+
+    vectorstore: Any
+    docstore: Any  # Shared with the vector store where it has an ArticleDocstore, so both use one LRU
+    store: Any = None  # Key of the store whose chunks lexical matches are limited to
+    k: int = 4
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _documents(self, pks):
+        vector_ids = dict(ArticleChunk.objects.filter(pk__in=pks).values_list("pk", "vector_id"))
+        documents = {pk: self.docstore.search(vector_ids[pk]) for pk in pks if pk in vector_ids}
+        return {pk: document for pk, document in documents.items() if not document.metadata.get("missing")}
+
+    def title_pks(self, query):
+        """
+        Return the chunk pks of the article ``query`` names exactly, which answer it without embedding it.
+        """
+        return title_matches(title_candidate(query), self.store)
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        # A caller that already looked the title up passes the result in the run metadata
+        if run_manager.metadata.get("title_query") == query:
+            title_pks = run_manager.metadata["title_pks"]
+        else:
+            title_pks = self.title_pks(query)
+        if title_pks:
+            return list(self._documents(title_pks[:self.k]).values())
+
+        with timed_stage("lexical_search"):
+            lexical_pks = [pk for pk, _ in search(query, self.fetch_k, self.store)]
+            lexical_documents = self._documents(lexical_pks)
+        with timed_stage("vector_search"):
+            hits = self.vectorstore.similarity_search_with_score(query, k=self.fetch_k)
+            vector_hits = [(document, score) for document, score in hits if not document.metadata.get("missing")]
+
+        scores, documents = {}, {}
+        for rank, pk in enumerate(lexical_pks):
+            document = lexical_documents.get(pk)
+            if document is None:
+                continue
+            key = document.metadata.get("vector_id", f"pk:{pk}")
+            scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            documents[key] = document
+        for rank, (document, _) in enumerate(vector_hits):
+            key = document.metadata.get("vector_id", id(document))
+            scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            documents.setdefault(key, document)
+
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [documents[key] for key in ranked]
+
+
+def build_retriever(vectorstore, k=4, store=None):
+    """
+    Return the retriever selected by ``RETRIEVER_MODE``, falling back to vector search without FTS5.
+
+    ``store`` is the key of the vector store's chunk rows, so lexical matches come from the same store.
+    """
+    if RETRIEVER_MODE == "hybrid" and fts_available():
+        docstore = getattr(vectorstore, "docstore", None)
+        if not isinstance(docstore, ArticleDocstore):
+            docstore = ArticleDocstore()
+        return HybridRetriever(vectorstore=vectorstore, docstore=docstore, k=k, fetch_k=max(20, k), store=store)
+    return FoundRetriever(retriever=vectorstore.as_retriever(search_kwargs={"k": k}))
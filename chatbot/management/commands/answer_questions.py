@@ -0,0 +1,167 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from langchain.chains import ConversationalRetrievalChain
+
+from ... import runtime
+from ...context import CONTEXT_TOKEN_BUDGET, count_tokens
+from ...hashing import content_hash
+from ...ratelimit import RateLimiter, backoff_delay, retry_after
+
+# Answer tokens assumed per question when reserving tokens-per-minute capacity
+EXPECTED_ANSWER_TOKENS = 256
+
+
+class Command(BaseCommand):
+    help = "Answer a file of questions concurrently, checkpointing results to JSONL."
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", type=str, help="Questions, one per line, or JSONL with a 'question' field.")
+        parser.add_argument("--output", type=str, default="answers.jsonl", help="JSONL file to append results to.")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent questions in flight.")
+        parser.add_argument("--rpm", type=int, default=0, help="Requests-per-minute limit (0 = unlimited).")
+        parser.add_argument("--tpm", type=int, default=0, help="Tokens-per-minute limit (0 = unlimited).")
+        parser.add_argument("--max-retries", type=int, default=5, help="Retries per question before giving up.")
+        parser.add_argument("--limit", type=int, default=0, help="Stop after this many questions (0 = all).")
+        parser.add_argument("--resume", action="store_true", help="Skip questions already in --output.")
+        parser.add_argument("--no-cache", action="store_true", help="Don't store answers in the answer cache.")
+
+    def handle(self, *args, **options):
+        if not Path(options["input"]).exists():
+            raise CommandError(f"{options['input']} does not exist.")
+        output = Path(options["output"])
+        if output.exists() and not options["resume"]:
+            raise CommandError(f"{output} already exists; pass --resume to continue it.")
+        done = self._load_done(output) if options["resume"] else set()
+        if done:
+            self.stdout.write(f"Resuming: {len(done)} questions already answered.")
+
+        # Build shared components here; the ORM can't be touched from the event loop thread
+        self.retriever = runtime.get_retriever()
+        self.llm = runtime.get_llm()
+        self.answer_cache = None if options["no_cache"] else runtime.get_answer_cache()
+        self.limiter = RateLimiter(options["rpm"], options["tpm"])
+        self.stats = {"answered": 0, "failed": 0, "retries": 0, "tokens": 0}
+        self.latencies = []
+
+        started = time.monotonic()
+        with open(output, "a", encoding="utf-8") as out:
+            asyncio.run(self._run(self._iter_questions(options["input"], done, options["limit"]), out, options))
+        self._report(time.monotonic() - started)
+
+    def _load_done(self, output):
+        """Return the ids of questions already answered in a previous run."""
+        done = set()
+        with open(output, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["id"])
+                except (ValueError, KeyError):
+                    continue  # A line cut short by an interrupted run
+        return done
+
+    def _iter_questions(self, path, done, limit):
+        """Yield (id, question) pairs from a text or JSONL file, skipping finished ones."""
+        jsonl = path.endswith(".jsonl")
+        count = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if jsonl:
+                    record = json.loads(line)
+                    question = record["question"]
+                    question_id = str(record.get("id") or content_hash(question))
+                else:
+                    question, question_id = line, content_hash(line)
+                if question_id in done:
+                    continue
+                done.add(question_id)  # Also drops repeated questions within the file
+                yield question_id, question
+                count += 1
+                if limit and count >= limit:
+                    return
+
+    async def _run(self, questions, out, options):
+        queue = asyncio.Queue(maxsize=options["workers"] * 2)
+        workers = [
+            asyncio.create_task(self._worker(queue, out, options["max_retries"])) for _ in range(options["workers"])
+        ]
+        for item in questions:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    async def _worker(self, queue, out, max_retries):
+        # Questions are answered independently, so no conversation memory is attached
+        chain = ConversationalRetrievalChain.from_llm(
+            llm=self.llm, retriever=self.retriever, return_source_documents=True
+        )
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            question_id, question = item
+            result = await self._answer(chain, question, max_retries)
+            if result is None:
+                self.stats["failed"] += 1
+                continue
+            out.write(json.dumps({"id": question_id, "question": question, **result}) + "\n")
+            out.flush()
+            self.stats["answered"] += 1
+            if self.stats["answered"] % 100 == 0:
+                self.stdout.write(f"Answered {self.stats['answered']} questions...")
+
+    async def _answer(self, chain, question, max_retries):
+        """Answer one question, backing off on rate limits and transient errors."""
+        tokens = count_tokens(question) + CONTEXT_TOKEN_BUDGET + EXPECTED_ANSWER_TOKENS
+        for attempt in range(max_retries + 1):
+            await self.limiter.acquire(tokens)
+            started = time.monotonic()
+            try:
+                result = await chain.ainvoke({"question": question, "chat_history": []})
+            except Exception as e:
+                if attempt == max_retries:
+                    self.stderr.write(f"Giving up on {question!r}: {e}")
+                    return None
+                self.stats["retries"] += 1
+                delay = retry_after(e)
+                if delay is not None:
+                    # Rate limited: hold back every worker, not just this one
+                    self.limiter.pause(delay or backoff_delay(attempt))
+                else:
+                    await asyncio.sleep(backoff_delay(attempt))
+                continue
+
+            seconds = time.monotonic() - started
+            self.latencies.append(seconds)
+            answer = result.get("answer", "")
+            self.stats["tokens"] += tokens - EXPECTED_ANSWER_TOKENS + count_tokens(answer)
+            if self.answer_cache is not None and answer:
+                await asyncio.to_thread(self.answer_cache.set, question, answer)
+            return {
+                "answer": answer,
+                "sources": [doc.metadata.get("source") for doc in result.get("source_documents", [])],
+                "seconds": round(seconds, 3),
+            }
+
+    def _report(self, elapsed):
+        stats = self.stats
+        self.stdout.write(self.style.SUCCESS(
+            f"Answered {stats['answered']} questions in {elapsed:.1f}s "
+            f"({stats['answered'] / elapsed if elapsed else 0:.2f} questions/s, "
+            f"{stats['tokens'] / elapsed * 60 if elapsed else 0:.0f} tokens/min); "
+            f"{stats['failed']} failed, {stats['retries']} retries."
+        ))
+        if self.latencies:
+            values = np.asarray(self.latencies)
+            self.stdout.write(
+                f"Latency p50 {np.percentile(values, 50):.2f}s, p95 {np.percentile(values, 95):.2f}s, "
+                f"max {values.max():.2f}s."
+            )
@@ -0,0 +1,280 @@
+import io
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import faiss
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from ... import runtime
+from ...batching import EMBEDDING_BATCH_WINDOW_MS, BatchingEmbeddings
+from ...chunking import SPLITTERS, iter_chunk_spans
+from ...fakes import FakeEmbeddings
+from ...faiss_index import build_index, index_params, needs_training
+from ...models import Article, ArticleChunk
+from ...versions import resolve_store_path
+
+BENCHMARK_INDEX_TYPES = ("flat", "hnsw", "ivf-flat", "ivf-pq", "sq8")
+# 256 PQ centroids per sub-quantizer need about 39 points each to train sensibly
+PQ_MIN_TRAINING_POINTS = 256 * 39
+
+
+def _percentiles(samples):
+    if not samples:
+        return {}
+    values = np.asarray(samples) * 1000
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+    }
+
+
+class Command(BaseCommand):
+    help = "Run an offline end-to-end benchmark with deterministic fake embedding and chat backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--articles", type=int, default=1000, help="Number of synthetic articles.")
+        parser.add_argument("--paragraphs", type=int, default=8, help="Paragraphs per synthetic article.")
+        parser.add_argument("--queries", type=int, default=200, help="Retrieval queries to time.")
+        parser.add_argument("--requests", type=int, default=200, help="chat_view requests to time.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Concurrent chat_view clients.")
+        parser.add_argument("--dimension", type=int, default=256, help="Fake embedding dimension.")
+        parser.add_argument("--embed-latency-ms", type=float, default=0, help="Simulated latency per embedding call.")
+        parser.add_argument("--llm-latency-ms", type=float, default=0, help="Simulated latency per LLM call.")
+        parser.add_argument("--chunk-workers", type=int, default=4, help="Processes for the splitter benchmark.")
+        parser.add_argument(
+            "--batch-window-ms", type=float, default=EMBEDDING_BATCH_WINDOW_MS or 5,
+            help="Micro-batching window for the query embedding benchmark (default: EMBEDDING_BATCH_WINDOW_MS, "
+            "or 5 while batching is off).",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for the synthetic corpus.")
+        parser.add_argument("--output", type=str, default="benchmark_results.json", help="Where to write results.")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix="chatbot-bench-") as workdir:
+            os.environ.update(
+                CHATBOT_FAKE_BACKENDS="1",
+                FAKE_EMBEDDING_DIMENSION=str(options["dimension"]),
+                FAKE_EMBEDDING_LATENCY=str(options["embed_latency_ms"] / 1000),
+                FAKE_LLM_LATENCY=str(options["llm_latency_ms"] / 1000),
+                EMBEDDING_CACHE_PATH=str(Path(workdir) / "embedding_cache.sqlite3"),
+            )
+            # Everything runs against a throwaway test database, never the real one
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                results = self._run(Path(workdir), options)
+            finally:
+                runtime.reset()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        results["peak_rss_mb"] = {
+            "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        }
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(json.dumps(results, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+
+    def _run(self, workdir, options):
+        results = {"config": {key: options[key] for key in (
+            "articles", "paragraphs", "queries", "requests", "concurrency", "dimension",
+            "embed_latency_ms", "llm_latency_ms", "chunk_workers", "batch_window_ms", "seed",
+        )}}
+        rng = random.Random(options["seed"])
+        corpus_path = workdir / "corpus"
+        store_path = workdir / "wiki_embeddings"
+        titles = self._write_corpus(corpus_path, options["articles"], options["paragraphs"], rng)
+
+        self.stdout.write("Loading synthetic corpus...")
+        started = time.perf_counter()
+        call_command("load_wikipedia_articles", dataset_path=str(corpus_path), limit=0, stdout=io.StringIO())
+        elapsed = time.perf_counter() - started
+        articles = Article.objects.count()
+        results["load"] = {"articles": articles, "seconds": round(elapsed, 3), "rows_per_s": round(articles / elapsed, 1)}
+
+        self.stdout.write("Timing splitters...")
+        results["splitters"] = self._time_splitters(options["chunk_workers"])
+
+        self.stdout.write("Ingesting embeddings...")
+        started = time.perf_counter()
+        call_command("ingest_embeddings", path=str(store_path), limit=articles, stdout=io.StringIO())
+        elapsed = time.perf_counter() - started
+        chunks = ArticleChunk.objects.filter(duplicate_of__isnull=True, retired_in="").count()
+        results["ingest"] = {
+            "chunks": chunks,
+            "seconds": round(elapsed, 3),
+            "articles_per_s": round(articles / elapsed, 1),
+            "chunks_per_s": round(chunks / elapsed, 1),
+        }
+
+        self.stdout.write("Building index types...")
+        results["index_build"] = self._time_index_builds(store_path)
+
+        self.stdout.write("Timing retrieval...")
+        runtime.reset(str(store_path))
+        runtime.warmup()
+        queries = self._queries(titles, options["queries"], rng)
+        results["retrieval"] = {
+            "default": {"retriever": type(runtime.get_retriever()).__name__,
+                        **self._time_calls(runtime.get_retriever().invoke, queries)},
+            "vector": self._time_calls(runtime.get_vectorstore().as_retriever().invoke, queries),
+        }
+
+        self.stdout.write("Timing chat_view under concurrent load...")
+        results["chat_view"] = self._time_chat_view(
+            self._queries(titles, options["requests"], rng), options["concurrency"]
+        )
+        results["answer_cache"] = runtime.get_answer_cache().stats()
+
+        self.stdout.write("Timing concurrent query embedding with and without micro-batching...")
+        results["query_embedding"] = self._time_query_embedding(
+            self._queries(titles, options["requests"], rng), options["concurrency"],
+            options["dimension"], max(options["embed_latency_ms"], 20) / 1000, options["batch_window_ms"] / 1000,
+        )
+        return results
+
+    def _write_corpus(self, path, count, paragraphs, rng):
+        """
+        Write ``count`` synthetic articles as JSON lines and return their titles.
+        """
+        syllables = ["ka", "lo", "mi", "ren", "tas", "vo", "ul", "pe", "dor", "shi", "an", "ber", "qui", "zo"]
+        vocabulary = sorted({"".join(rng.choices(syllables, k=rng.randint(2, 4))) for _ in range(5000)})
+        path.mkdir(parents=True)
+        titles = []
+        with open(path / "train.jsonl", "w") as f:
+            for n in range(count):
+                title = f"{' '.join(rng.choices(vocabulary, k=2)).title()} {n}"
+                body = "\n\n".join(
+                    " ".join(rng.choices(vocabulary, k=rng.randint(40, 120))) + "."
+                    for _ in range(paragraphs)
+                )
+                f.write(json.dumps({"id": str(n), "title": title, "url": f"https://example.org/{n}", "text": body}))
+                f.write("\n")
+                titles.append(title)
+        return titles
+
+    def _queries(self, titles, count, rng):
+        templates = ["What is {}?", "Can you explain {}?", "Tell me about {}", "{} history and uses"]
+        return [rng.choice(templates).format(rng.choice(titles)) for _ in range(count)]
+
+    def _time_calls(self, fn, args):
+        samples = []
+        for arg in args:
+            started = time.perf_counter()
+            fn(arg)
+            samples.append(time.perf_counter() - started)
+        return _percentiles(samples)
+
+    def _time_splitters(self, workers):
+        """
+        Chunk every article with each splitter, in this process and on a process pool.
+        """
+        timings = {}
+        for name in SPLITTERS:
+            timings[name] = {}
+            for label, n in (("serial", 0), (f"{workers}_workers", workers)):
+                chunks = characters = articles = 0
+                started = time.perf_counter()
+                articles_qs = Article.objects.prefetch_related("text_blocks").iterator(chunk_size=1000)
+                # The pool is forced on so the two timings show what it costs or saves on this corpus
+                for _, spans in iter_chunk_spans(articles_qs, name, workers=n, min_parallel_chars=0):
+                    articles += 1
+                    chunks += len(spans)
+                    characters += sum(length for _, _, length in spans)
+                elapsed = time.perf_counter() - started
+                timings[name][label] = {
+                    "seconds": round(elapsed, 3),
+                    "articles_per_s": round(articles / elapsed, 1),
+                    "chunks": chunks,
+                    "mean_chunk_chars": round(characters / chunks, 1) if chunks else 0,
+                }
+        return timings
+
+    def _time_index_builds(self, store_path):
+        """
+        Time training and adding the ingested vectors for each supported index type.
+        """
+        flat = faiss.read_index(str(resolve_store_path(store_path) / "index.faiss"))
+        vectors = flat.reconstruct_n(0, flat.ntotal)
+        dimension = vectors.shape[1]
+        timings = {}
+        for index_type in BENCHMARK_INDEX_TYPES:
+            if index_type == "ivf-pq" and len(vectors) < PQ_MIN_TRAINING_POINTS:
+                timings[index_type] = {"skipped": f"needs at least {PQ_MIN_TRAINING_POINTS} vectors to train"}
+                continue
+            params = index_params(index_type, len(vectors), pq_m=max(1, dimension // 16))
+            started = time.perf_counter()
+            index = build_index(index_type, dimension, params)
+            if needs_training(index_type):
+                index.train(vectors)
+            index.add(vectors)
+            timings[index_type] = {"params": params, "seconds": round(time.perf_counter() - started, 3)}
+        return timings
+
+    def _time_query_embedding(self, queries, concurrency, dimension, latency, window):
+        """
+        Embed ``queries`` from ``concurrency`` threads against a fake endpoint with ``latency`` per call.
+        """
+        timings = {}
+        for label, batched in (("unbatched", False), ("batched", True)):
+            endpoint = FakeEmbeddings(dimension=dimension, latency=latency)
+            embedder = BatchingEmbeddings(endpoint, window=window) if batched else endpoint
+
+            def embed(query):
+                started = time.perf_counter()
+                embedder.embed_query(query)
+                return time.perf_counter() - started
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                samples = list(executor.map(embed, queries))
+            wall = time.perf_counter() - started
+            if batched:
+                embedder.close()
+            timings[label] = {
+                **_percentiles(samples),
+                "api_calls": endpoint.calls,
+                "queries_per_s": round(len(queries) / wall, 1),
+            }
+        return timings
+
+    def _time_chat_view(self, questions, concurrency):
+        """
+        POST ``questions`` to chat_view from ``concurrency`` threads, each with its own session.
+        """
+        local = threading.local()
+
+        def ask(question):
+            if not hasattr(local, "client"):
+                local.client = Client()
+            started = time.perf_counter()
+            response = local.client.post("/chatbot/", {"question": question})
+            elapsed = time.perf_counter() - started
+            connection.close()
+            return elapsed, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(ask, questions))
+        wall = time.perf_counter() - started
+        errors = sum(1 for _, status in outcomes if status != 200)
+        return {
+            **_percentiles([elapsed for elapsed, _ in outcomes]),
+            "errors": errors,
+            "requests_per_s": round(len(outcomes) / wall, 1),
+        }
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...models import VectorStore
+from ...topics import TOPICS_FILENAME, build_topic_index, write_topic_index
+from ...vectorstore import load_vectorstore
+from ...versions import (
+    JOURNAL_DIRNAME, create_version, prune_versions, publish_version, published_version, read_store_key,
+    staging_version,
+)
+
+
+class Command(BaseCommand):
+    help = "Cluster the stored vectors with k-means and save a topic index for instant suggestions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", type=str, default="./wiki_embeddings", help="Vector store directory.")
+        parser.add_argument("--clusters", type=int, default=50, help="Number of k-means clusters.")
+        parser.add_argument("--titles", type=int, default=5, help="Representative titles kept per cluster.")
+        parser.add_argument("--sample-size", type=int, default=100000, help="Vectors sampled to train k-means.")
+        parser.add_argument("--niter", type=int, default=20, help="k-means iterations.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed for sampling and k-means.")
+        parser.add_argument(
+            "--keep-versions", type=int, default=3, help="Published store versions to keep on disk."
+        )
+
+    def handle(self, *args, **options):
+        root = options["path"]
+        published, published_path = published_version(root)
+        if any(published_path.glob(f"**/{JOURNAL_DIRNAME}")):
+            raise CommandError(
+                f"The published version of {root} has chunk-mapping changes that are not applied yet; "
+                "run ingest_embeddings first."
+            )
+        try:
+            vectorstore = load_vectorstore(root, None)
+        except Exception as e:
+            raise CommandError(f"Could not load the vector store at {root}: {e}")
+
+        started = time.monotonic()
+        clusters = build_topic_index(
+            vectorstore,
+            n_clusters=options["clusters"],
+            titles_per_cluster=options["titles"],
+            sample_size=options["sample_size"],
+            niter=options["niter"],
+            seed=options["seed"],
+        )
+        if not clusters:
+            raise CommandError("The vector store has no local vectors to cluster.")
+
+        # Published versions are never modified, so the topics ship as a new version sharing every other file
+        path = create_version(root, stage=False)
+        write_topic_index(path, clusters)
+        publish_version(root, path)
+        # A version staged by an unfinished ingestion run would otherwise publish the old topics
+        staging = staging_version(root)
+        if staging is not None:
+            write_topic_index(staging, clusters)
+        # The chunk rows describe the new version exactly as they did the one it was copied from
+        VectorStore.objects.filter(key=read_store_key(root), version=published or "").update(version=path.name)
+        prune_versions(root, options["keep_versions"])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Saved {len(clusters)} topic clusters to {path / TOPICS_FILENAME} "
+            f"in {time.monotonic() - started:.1f}s and published version {path.name}."
+        ))
+        for cluster in clusters[:10]:
+            self.stdout.write(f"- {cluster['size']:>7} vectors: {', '.join(cluster['titles'])}")
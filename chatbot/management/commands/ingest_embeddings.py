@@ -1,17 +1,67 @@
+import argparse
+import json
 import os
+import shutil
+import time
+import uuid
+from collections import defaultdict
 from pathlib import Path
+import numpy as np
 from dotenv import load_dotenv
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, Max, Min, OuterRef
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
 from langchain.schema import Document
-from langchain.text_splitter import CharacterTextSplitter
-from ...models import Article
+from ... import lexical
+from ...chunking import DEFAULT_SPLITTER, SPLITTERS, chunk_text, iter_chunk_spans
+from ...context import count_tokens
+from ...dedup import (
+    DEDUP_CHUNKS, DEDUP_THRESHOLD, ChunkDeduplicator, content_length, signature_bytes, signature_from_bytes,
+)
+from ...embedding_cache import get_embeddings
+from ...faiss_index import (
+    INDEX_TYPES, build_index, index_params, needs_training, read_index_meta, recall_at_k, supports_remove,
+    write_index_meta,
+)
+from ...hashing import content_hash
+from ...models import Article, ArticleChunk, VectorStore
+from ...sharding import PARTITIONS, create_manifest, filter_shard, read_manifest, shard_path, write_manifest
+from ...vectorstore import (
+    COMPACT_DTYPES, VECTORS_FILENAME, VECTORSTORE_DTYPE, VECTORSTORE_MODE, ArticleDocstore, compact_recall,
+    export_mmap_store,
+)
+from ...versions import (
+    JOURNAL_DIRNAME, create_version, discard_staging, prune_versions, publish_version, published_version,
+    read_store_key, resolve_store_path, staging_version, version_names, write_store_key,
+)
 
 load_dotenv()
 
-# OpenAI API key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+CHECKPOINT_FILENAME = "ingest_checkpoint.json"
+# Chunk rows written before stores were keyed were migrated to this store (see migration 0009)
+UNKEYED_STORE_KEY = "default"
+# Above this many articles to re-embed after reconciling, every article is diffed instead of listing ids in SQL
+MAX_RECONCILED_ARTICLES = 10000
+
+CREATED_FIELDS = (
+    "article_id", "article_hash", "field", "chunk_index", "start", "length", "content_hash", "vector_id", "minhash",
+    "duplicate_of",
+)
+UPDATED_FIELDS = ["article_hash", "chunk_index", "start", "length", "minhash", "duplicate_of"]
+
+
+def _chunk_to_json(chunk, fields):
+    values = {field: getattr(chunk, field) for field in fields}
+    if values.get("minhash") is not None:
+        values["minhash"] = bytes(values["minhash"]).hex()
+    return values
+
+
+def _chunk_from_json(values):
+    if values.get("minhash") is not None:
+        values["minhash"] = bytes.fromhex(values["minhash"])
+    return values
 
 
 class Command(BaseCommand):
@@ -21,9 +71,80 @@ class Command(BaseCommand):
         parser.add_argument("--delete", action="store_true", help="Delete the existing vector database.")
         parser.add_argument("--limit", type=int, default=1, help="Number of articles to process.")
         parser.add_argument("--path", type=str, default="./wiki_embeddings", help="Path to save the vector database.")
+        parser.add_argument("--batch-size", type=int, default=256, help="Number of chunks to embed per request.")
+        parser.add_argument(
+            "--checkpoint-every", type=int, default=10, help="Save the vector store every N embedded batches."
+        )
+        parser.add_argument("--max-retries", type=int, default=3, help="Retries for a failed embedding batch.")
+        parser.add_argument(
+            "--resume", action="store_true", help="Continue from the last checkpointed article id."
+        )
+        parser.add_argument(
+            "--index-type", choices=INDEX_TYPES, default="flat",
+            help="FAISS index type for a new vector store. Existing stores keep their type. Only flat and sq8 "
+            "indexes can drop vectors, so hnsw and ivf stores must be rebuilt with --delete once articles change.",
+        )
+        parser.add_argument("--nlist", type=int, default=1024, help="Number of IVF lists.")
+        parser.add_argument(
+            "--nprobe", type=int,
+            help="IVF lists searched per query (default: 1/16 of --nlist, at least 8). Higher values raise recall "
+            "and query latency; a single list misses roughly half of the true neighbours. FAISS_NPROBE overrides "
+            "it at query time.",
+        )
+        parser.add_argument("--pq-m", type=int, default=64, help="Number of PQ sub-quantizers for ivf-pq.")
+        parser.add_argument("--hnsw-m", type=int, default=32, help="Neighbours per node for hnsw.")
+        parser.add_argument(
+            "--train-size", type=int, default=20000, help="Chunks sampled at random to train ivf/sq8 indexes."
+        )
+        parser.add_argument(
+            "--report-recall", action="store_true", help="Report recall@k of the index against a flat baseline."
+        )
+        parser.add_argument("--recall-k", type=int, default=10, help="k for the recall report.")
+        parser.add_argument("--recall-queries", type=int, default=100, help="Number of queries for the recall report.")
+        parser.add_argument(
+            "--vector-dtype", choices=("float32",) + COMPACT_DTYPES, default=VECTORSTORE_DTYPE,
+            help="Also write a float16 or int8 FAISS scalar-quantized copy of flat vectors for compact search, which "
+            "serving uses with VECTORSTORE_MODE=mmap. Compact search re-ranks the best k * VECTORSTORE_RERANK "
+            "(default 4) candidates against the float32 vectors; keep re-ranking on, as int8 distances alone "
+            "lose a few percent of recall@10. Needs --store-mode mmap.",
+        )
+        parser.add_argument(
+            "--store-mode", choices=("pickle", "mmap"), default=VECTORSTORE_MODE,
+            help="Storage mode the store is served in (default: VECTORSTORE_MODE). Only mmap stores get the "
+            "vectors.npy and compact copies of flat vectors; pickle stores are read from index.faiss alone.",
+        )
+        parser.add_argument("--shards", type=int, default=1, help="Number of shards for a new vector store.")
+        parser.add_argument(
+            "--shard-by", choices=PARTITIONS, default="hash", help="Partition articles across shards by id hash or range."
+        )
+        parser.add_argument("--shard", type=int, help="Only rebuild this shard number.")
+        parser.add_argument(
+            "--splitter", choices=SPLITTERS, default=DEFAULT_SPLITTER,
+            help="Chunking strategy: blank-line character splits, paragraph/sentence-aware, or token-length-aware.",
+        )
+        parser.add_argument("--chunk-size", type=int, help="Chunk size (tokens for --splitter token).")
+        parser.add_argument("--chunk-overlap", type=int, help="Overlap between consecutive chunks.")
+        parser.add_argument(
+            "--chunk-workers", type=int, default=4,
+            help="Processes used for chunking (0 = chunk in this process). Batches with less text than "
+            "CHUNK_PARALLEL_MIN_CHARS are chunked in this process anyway.",
+        )
+        parser.add_argument(
+            "--keep-versions", type=int, default=3, help="Published store versions to keep on disk."
+        )
+        parser.add_argument(
+            "--dedup", action=argparse.BooleanOptionalAction, default=DEDUP_CHUNKS,
+            help="Drop boilerplate and near-duplicate text chunks before embedding them.",
+        )
+        parser.add_argument(
+            "--dedup-threshold", type=float, default=DEDUP_THRESHOLD,
+            help="Estimated Jaccard similarity above which a chunk is a near-duplicate.",
+        )
+        parser.add_argument(
+            "--rebuild-fts", action="store_true", help="Rebuild the full-text chunk index from the chunk table."
+        )
 
     def handle(self, *args, **options):
-        limit = options.get("limit")
         path = options.get("path")
 
         if options["delete"]:
@@ -33,59 +154,804 @@ class Command(BaseCommand):
                 self._prompt_delete_vector_database(path)
             return
 
-        # Fetch articles
-        article_qs = Article.objects.all()[:limit]
-        if not article_qs.exists():
+        self.batch_size = options["batch_size"]
+        self.checkpoint_every = options["checkpoint_every"]
+        self.max_retries = options["max_retries"]
+        self.fts = lexical.fts_available()
+        self.vector_dtype = options["vector_dtype"]
+        self.store_mode = options["store_mode"]
+        if self.vector_dtype in COMPACT_DTYPES and self.store_mode != "mmap":
+            raise CommandError(f"--vector-dtype {self.vector_dtype} needs --store-mode mmap.")
+        self.chunking = {
+            "name": options["splitter"],
+            "chunk_size": options["chunk_size"],
+            "chunk_overlap": options["chunk_overlap"],
+            "workers": options["chunk_workers"],
+        }
+
+        if options["rebuild_fts"]:
+            if not self.fts:
+                raise CommandError("The full-text index needs SQLite with FTS5; run migrate first.")
+            count = lexical.rebuild_index(self.batch_size)
+            self.stdout.write(self.style.SUCCESS(f"Indexed {count} chunks for full-text search."))
+            return
+
+        self.embeddings = get_embeddings(path)
+
+        # Work on an unpublished copy so serving processes never see a half-written store
+        root = path
+        self.store = self._vector_store(root)
+        self._apply_published_journal(root)
+        staged = staging_version(root)
+        if staged is not None and self.store.version == staged.name:
+            # A run finished and recorded its chunk mapping, but died before publishing its version
+            self.stdout.write(f"Publishing version {staged.name}, whose chunk mapping is already recorded...")
+            self._publish(root, staged, options)
+        path = staging_version(root) if options["resume"] else None
+        if path is None:
+            discard_staging(root)
+            path = create_version(root, exclude=(CHECKPOINT_FILENAME, JOURNAL_DIRNAME))
+        self.stdout.write(f"Writing version {path.name} of {root}.")
+        self.saved = False
+
+        self._ingest_version(path, options)
+
+        if not self.saved:
+            discard_staging(root)
+            self.stdout.write("Nothing changed; keeping the published version.")
+            return
+        # Rows the version adds are committed before servers can load it; rows it drops are only retired
+        self._apply_journal(path)
+        self._publish(root, path, options)
+
+    def _publish(self, root, path, options):
+        """
+        Publish the version ``path``, prune old versions and delete the chunk rows no kept version refers to.
+        """
+        publish_version(root, path)
+        removed = prune_versions(root, options["keep_versions"])
+        self._purge_retired(root)
+        self.stdout.write(self.style.SUCCESS(
+            f"Published version {path.name}" + (f"; removed {', '.join(removed)}." if removed else ".")
+        ))
+
+    def _purge_retired(self, root):
+        """
+        Delete chunk rows retired no later than the oldest version on disk.
+
+        A row retired by a version is only read by servers on an older one, so
+        it can go once no older version is kept.
+        """
+        retired = ArticleChunk.objects.filter(store=self.store).exclude(retired_in="")
+        versions = version_names(root)
+        if versions:
+            retired = retired.filter(retired_in__lte=versions[0])
+        retired.delete()
+
+    def _ingest_version(self, path, options):
+        """
+        Bring the (possibly sharded) store in the version directory ``path`` up to date.
+        """
+        manifest = read_manifest(path)
+        if manifest is None and options["shards"] > 1:
+            manifest = self._create_manifest(path, options["shards"], options["shard_by"])
+        elif manifest is not None and options["shards"] not in (1, manifest["shards"]):
+            self.stdout.write(self.style.WARNING(
+                f"Keeping the existing {manifest['shards']} shards; use --delete to re-shard."
+            ))
+
+        chunks = ArticleChunk.objects.filter(store=self.store, retired_in="")
+        if manifest is None:
+            self._ingest_store(path, Article.objects.all(), chunks, options)
+            return
+
+        shards = range(manifest["shards"]) if options["shard"] is None else [options["shard"]]
+        for shard in shards:
+            self.stdout.write(f"Ingesting shard {shard + 1} of {manifest['shards']}...")
+            self._ingest_store(
+                shard_path(path, shard),
+                filter_shard(Article.objects.all(), "id", manifest, shard),
+                filter_shard(chunks, "article_id", manifest, shard),
+                options,
+            )
+        write_manifest(path, {**manifest, "updated_at": time.time()})
+
+    def _create_manifest(self, path, shards, partition):
+        """
+        Fix the article-to-shard assignment for a new sharded store.
+        """
+        bounds = Article.objects.aggregate(min_id=Min("id"), max_id=Max("id"))
+        manifest = create_manifest(shards, partition, bounds["min_id"] or 0, bounds["max_id"] or 0)
+        Path(path).mkdir(parents=True, exist_ok=True)
+        write_manifest(path, manifest)
+        self.stdout.write(f"Created {shards} {partition}-partitioned shards in {path}.")
+        return manifest
+
+    def _ingest_store(self, path, articles, chunks, options):
+        """
+        Bring the single vector store at ``path`` up to date with ``articles``.
+
+        ``chunks`` holds the chunk rows owned by this store, so deletions and
+        stale-mapping cleanup never touch vectors that live in other stores or shards.
+        """
+        self.articles, self.chunks = articles, chunks
+        self.stats = defaultdict(int)
+        self.diffed, self.removed_vectors = set(), set()
+        self._reset_pending()
+        last_article_id = 0
+        if options["resume"]:
+            last_article_id = self._load_checkpoint(path)
+        else:
+            self._load_journal(path, 0)
+
+        # An existing store is refreshed in place: only new or changed articles are embedded.
+        vectorstore = self._load_vectorstore(path)
+        if vectorstore is None:
+            vectorstore = self._create_vectorstore(options)
+        else:
+            self.index_meta = read_index_meta(path)
+            if options["index_type"] != self.index_meta["index_type"]:
+                self.stdout.write(self.style.WARNING(
+                    f"Keeping the existing {self.index_meta['index_type']} index; use --delete to rebuild it."
+                ))
+        reconciled = self._reconcile(vectorstore)
+        self.dedup = self._load_deduplicator(options)
+        if options["resume"]:
+            self.stdout.write(f"Resuming after article id {last_article_id}.")
+
+        # Fetch articles; unchanged ones are filtered out before their text is read
+        articles = self.articles.filter(id__gt=last_article_id)
+        if not articles.exists() and not self.chunks.exists():
             self.stdout.write(self.style.ERROR("No articles found in the database."))
             return
+        if len(reconciled) > MAX_RECONCILED_ARTICLES:
+            changed = articles
+        else:
+            changed = self._changed_articles() | self.articles.filter(id__in=reconciled)
+            changed = changed.filter(id__gt=last_article_id)
+        self.stats["skipped"] = articles.count() - changed.count()
+        article_qs = changed.order_by("id")[:options["limit"]]
+        self._check_removable(vectorstore, article_qs)
 
         # Process and save embeddings
-        vectorstore = self._populate_vectorstore(article_qs)
-        self._save_vectorstore(path, vectorstore)
+        vectorstore = self._populate_vectorstore(article_qs, path, vectorstore, last_article_id)
+        if options["report_recall"]:
+            self._report_recall(vectorstore, options["recall_k"], options["recall_queries"])
+            if self.vector_dtype in COMPACT_DTYPES and (Path(path) / VECTORS_FILENAME).exists():
+                self._report_compact_recall(path, options["recall_k"], options["recall_queries"])
+
+    def _vector_store(self, root):
+        """
+        Return the ``VectorStore`` owning the chunk rows of the store directory ``root``, keying a new directory.
+        """
+        key = read_store_key(root)
+        if key is None:
+            key = uuid.uuid4().hex
+            write_store_key(root, key)
+            published = resolve_store_path(root)
+            if (published / "index.faiss").exists() or read_manifest(published) is not None:
+                # A store written before chunk rows were keyed owns the rows migrated without a key
+                VectorStore.objects.filter(key=UNKEYED_STORE_KEY).update(key=key)
+        return VectorStore.objects.get_or_create(key=key)[0]
 
     def _prompt_delete_vector_database(self, path):
         """
-        Delete the existing vector database directory.
+        Delete the existing vector database directory and its chunk mapping.
+
+        Only this store's chunk rows are deleted; other stores keep theirs.
         """
         db_path = Path(path)
+        store = self._vector_store(path) if db_path.is_dir() else None
         if db_path.exists() and db_path.is_dir():
-            for file in db_path.iterdir():
-                file.unlink()
-            db_path.rmdir()
+            shutil.rmtree(db_path)
             self.stdout.write(self.style.SUCCESS("Vector database deleted."))
         elif db_path.exists():
             db_path.unlink()
             self.stdout.write(self.style.SUCCESS("Vector database file deleted."))
         else:
             self.stdout.write(self.style.WARNING("Vector database not found."))
+        if store is not None:
+            # Full-text rows of the deleted chunks stop matching; --rebuild-fts reclaims their space
+            store.delete()
+
+    def _load_deduplicator(self, options):
+        """
+        Build the near-duplicate index from the MinHash signatures of the text chunks already in this store.
+        """
+        if not options["dedup"]:
+            return None
+        dedup = ChunkDeduplicator(options["dedup_threshold"])
+        for chunk in self._live_chunks():
+            if chunk.field != "text" or chunk.minhash is None or chunk.duplicate_of is not None:
+                continue
+            signature = signature_from_bytes(chunk.minhash)
+            # Signatures written with a different DEDUP_NUM_PERM cannot be compared
+            if len(signature) == dedup.hasher.num_perm:
+                dedup.add(chunk.vector_id, signature)
+        return dedup
+
+    def _reset_pending(self):
+        """
+        Clear chunk-mapping changes that are waiting for the next checkpoint.
+        """
+        self.pending_create = []
+        self.pending_update = []
+        self.pending_delete = []
+
+    def _live_chunks(self):
+        """
+        Yield this store's chunk rows as they will be once the journal staged so far is applied.
+
+        Rows created by this version have no pk yet.
+        """
+        updates = self.journal["update"]
+        for chunk in self.chunks.iterator(chunk_size=self.batch_size):
+            if chunk.pk in self.removed:
+                continue
+            for field, value in updates.get(chunk.pk, {}).items():
+                setattr(chunk, field, value)
+            yield chunk
+        for values in self.journal["create"]:
+            yield ArticleChunk(store=self.store, **values)
+
+    def _reconcile(self, vectorstore):
+        """
+        Make the chunk mapping agree with the loaded index before diffing against it.
 
-    def _populate_vectorstore(self, article_qs):
+        Rows whose vector is not in the index are queued for deletion, and their
+        article ids are returned so those articles are embedded again; vectors no
+        row points at are removed. Both happen when a run dies between saving the
+        index and staging its checkpoint, and for every row when the index is new.
         """
-        Generate embeddings and populate the FAISS vector store.
+        index_ids = set(vectorstore.index_to_docstore_id.values())
+        referenced, missing = set(), []
+        for chunk in self._live_chunks():
+            if chunk.duplicate_of is not None:
+                continue
+            referenced.add(chunk.vector_id)
+            if chunk.vector_id not in index_ids and chunk.pk is not None:
+                missing.append(chunk)
+        unreferenced = index_ids - referenced
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                f"Discarding {len(missing)} chunk rows whose vectors are not in the index."
+            ))
+            self.pending_delete.extend(chunk.pk for chunk in missing)
+            self.removed.update(chunk.pk for chunk in missing)
+        if unreferenced:
+            self.stdout.write(self.style.WARNING(f"Removing {len(unreferenced)} vectors without a chunk row."))
+            self._remove_vectors(list(unreferenced), vectorstore)
+        return {chunk.article_id for chunk in missing}
+
+    def _iter_article_chunks(self, article_qs):
+        """
+        Stream articles from the database and yield (article, spans) pairs.
+
+        Rows are read through ``QuerySet.iterator`` so only one fetch window of
+        articles is held in memory at a time, with the text blocks of the whole
+        window fetched in one query; each span is a (field, start, length)
+        record, computed on the chunking process pool for windows with enough text.
+        """
+        articles = article_qs.prefetch_related("text_blocks").iterator(chunk_size=self.batch_size)
+        try:
+            yield from iter_chunk_spans(articles, window=self.batch_size, **self.chunking)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def _diff_article(self, article, spans, vectorstore):
+        """
+        Compare an article's fresh chunks with the ones already indexed.
+
+        Returns the (document, vector_id) pairs that need embedding. Chunks whose
+        hash is unchanged keep their vector; stale chunks are removed from the store.
+        Chunks are recorded by offset into the article. With deduplication on,
+        trailing boilerplate sections are trimmed off text chunks, and new chunks
+        that are all boilerplate are dropped. A near-duplicate of an indexed chunk
+        is recorded against it instead of embedded, and is checked again, and
+        embedded if nothing else covers it, each time its article is diffed.
+        """
+        article_hash = article.content_hash
+        existing = defaultdict(list)
+        for chunk in self.chunks.filter(article_id=article.id):
+            if chunk.pk in self.removed:
+                continue
+            if chunk.duplicate_of is not None:
+                # Rows with a vector are reused first
+                existing[chunk.content_hash].insert(0, chunk)
+                continue
+            existing[chunk.content_hash].append(chunk)
+            if self.dedup is not None:
+                # Kept chunks are re-added below; a new chunk must not count as a duplicate of a stale one
+                self.dedup.remove(chunk.vector_id)
+        self.diffed.add(article.id)
+
+        to_embed, readmitted = [], []
+        for index, (field, start, length) in enumerate(spans):
+            text = chunk_text(article, field, start, length)
+            trimmed_tokens = 0
+            if self.dedup is not None and field == "text":
+                kept = content_length(text)
+                if kept < length:
+                    trimmed_tokens = count_tokens(text) - count_tokens(text[:kept])
+                    text, length = text[:kept], kept
+                if not length:
+                    self.stats["dropped_boilerplate"] += 1
+                    self.stats["saved_tokens"] += trimmed_tokens
+                    continue
+            chunk_hash = content_hash(field, text)
+            duplicate = bool(existing[chunk_hash]) and existing[chunk_hash][-1].duplicate_of is not None
+            if existing[chunk_hash] and not duplicate:
+                chunk = existing[chunk_hash].pop()
+                chunk.article_hash, chunk.chunk_index = article_hash, index
+                chunk.start, chunk.length = start, length
+                if self.dedup is not None and field == "text":
+                    if chunk.minhash is None:
+                        chunk.minhash = signature_bytes(self.dedup.signature(text))
+                    self.dedup.add(chunk.vector_id, signature_from_bytes(chunk.minhash))
+                self.pending_update.append(chunk)
+                self.stats["reused"] += 1
+                continue
+            signature = None
+            if self.dedup is not None and field == "text":
+                signature = self.dedup.signature(text)
+                representative = self.dedup.duplicate_of(signature)
+                if representative is not None:
+                    self.stats["dropped_duplicate"] += 1
+                    self.stats["saved_tokens"] += trimmed_tokens + count_tokens(text)
+                    if duplicate:
+                        chunk = existing[chunk_hash].pop()
+                        chunk.article_hash, chunk.chunk_index = article_hash, index
+                        chunk.start, chunk.length = start, length
+                        chunk.minhash, chunk.duplicate_of = signature_bytes(signature), representative
+                        self.pending_update.append(chunk)
+                        continue
+                    self.pending_create.append(ArticleChunk(
+                        store=self.store,
+                        article_id=article.id,
+                        article_hash=article_hash,
+                        field=field,
+                        chunk_index=index,
+                        start=start,
+                        length=length,
+                        content_hash=chunk_hash,
+                        vector_id=uuid.uuid4().hex,
+                        minhash=signature_bytes(signature),
+                        duplicate_of=representative,
+                    ))
+                    continue
+                if trimmed_tokens:
+                    self.stats["trimmed"] += 1
+                    self.stats["saved_tokens"] += trimmed_tokens
+            vector_id = uuid.uuid4().hex
+            document = Document(
+                page_content=text,
+                metadata={"source": article.url, "title": article.title, "field": field, "article_id": article.id},
+            )
+            to_embed.append((document, vector_id))
+            if duplicate:
+                # Nothing indexed covers it any more; a new row replaces it, so it is full-text indexed on creation
+                readmitted.append(existing[chunk_hash].pop())
+                self.stats["readmitted"] += 1
+            chunk = ArticleChunk(
+                store=self.store,
+                article_id=article.id,
+                article_hash=article_hash,
+                field=field,
+                chunk_index=index,
+                start=start,
+                length=length,
+                content_hash=chunk_hash,
+                vector_id=vector_id,
+                minhash=None if signature is None else signature_bytes(signature),
+            )
+            if signature is not None:
+                self.dedup.add(vector_id, signature)
+            self.pending_create.append(chunk)
+
+        stale = [chunk for chunks in existing.values() for chunk in chunks]
+        self._remove_chunks(stale + readmitted, vectorstore)
+        return to_embed
+
+    def _remove_chunks(self, chunks, vectorstore):
+        """
+        Drop the vectors of the given chunk rows and queue the rows for deletion.
         """
-        documents = []
-        for article in article_qs:
+        if not chunks:
+            return
+        vector_ids = [chunk.vector_id for chunk in chunks if chunk.duplicate_of is None]
+        if vector_ids:
+            self._remove_vectors(vector_ids, vectorstore)
+        self.removed_vectors.update(vector_ids)
+        if self.dedup is not None:
+            for vector_id in vector_ids:
+                self.dedup.remove(vector_id)
+        self.pending_delete.extend(chunk.pk for chunk in chunks)
+        self.removed.update(chunk.pk for chunk in chunks)
+        self.stats["removed"] += len(vector_ids)
+
+    def _check_removable(self, vectorstore, article_qs):
+        """
+        Fail before anything is embedded when the update needs vector removals the index cannot do.
+
+        Only flat-coded indexes compact on removal, so a changed or deleted article
+        with vectors in an hnsw or ivf index can only be handled by a rebuild.
+        """
+        if supports_remove(vectorstore.index) or not vectorstore.index.ntotal:
+            return
+        chunks = self.chunks.filter(duplicate_of__isnull=True)
+        changed = chunks.filter(article_id__in=article_qs.values("id"))
+        deleted = chunks.exclude(article_id__in=Article.objects.values("id"))
+        stale = {
+            article_id for queryset in (changed, deleted)
+            for pk, article_id in queryset.values_list("pk", "article_id").iterator(chunk_size=self.batch_size)
+            if pk not in self.removed
+        }
+        if stale:
+            raise CommandError(
+                f"{len(stale)} changed or deleted articles have vectors in this {self.index_meta['index_type']} "
+                "index, which cannot remove vectors; use --delete to rebuild it."
+            )
+
+    def _remove_vectors(self, vector_ids, vectorstore):
+        if not supports_remove(vectorstore.index):
+            raise CommandError(
+                f"A {self.index_meta['index_type']} index cannot remove vectors; use --delete to rebuild it."
+            )
+        vectorstore.delete(vector_ids)
+
+    def _changed_articles(self):
+        """
+        Return the articles whose indexed chunks are missing or were not built from their current content.
+
+        Articles with a near-duplicate chunk whose representative is gone are
+        included too, so the chunk is embedded again.
+        """
+        chunks = self.chunks.filter(article_id=OuterRef("id"))
+        representatives = self.chunks.filter(duplicate_of__isnull=True).values("vector_id")
+        return self.articles.filter(
+            ~Exists(chunks)
+            | Exists(chunks.exclude(article_hash=OuterRef("content_hash")))
+            # Rows recorded before chunk offsets existed have no length and must be refreshed
+            | Exists(chunks.filter(length=0))
+            | Exists(chunks.filter(duplicate_of__isnull=False).exclude(duplicate_of__in=representatives))
+        )
+
+    def _remove_deleted_articles(self, vectorstore):
+        """
+        Remove vectors whose article no longer exists in the database.
+        """
+        orphans = self.chunks.exclude(article_id__in=Article.objects.values("id"))
+        batch = []
+        for chunk in orphans.iterator(chunk_size=self.batch_size):
+            if chunk.pk in self.removed:
+                continue
+            batch.append(chunk)
+            if len(batch) >= self.batch_size:
+                self._remove_chunks(batch, vectorstore)
+                batch = []
+        self._remove_chunks(batch, vectorstore)
+
+    def _readmit_duplicates(self, vectorstore):
+        """
+        Diff the articles holding near-duplicates of chunks this run removed, so they are embedded again.
+
+        Articles already diffed by this version are picked up by ``_changed_articles`` on the next run.
+        """
+        if not self.removed_vectors:
+            return vectorstore
+        orphaned = self.chunks.filter(duplicate_of__isnull=False).values_list("pk", "article_id", "duplicate_of")
+        article_ids = {
+            article_id for pk, article_id, representative in orphaned.iterator(chunk_size=self.batch_size)
+            if representative in self.removed_vectors and article_id not in self.diffed
+            and pk not in self.removed and pk not in self.journal["update"]
+        }
+        batch = []
+        for article, spans in self._iter_article_chunks(self.articles.filter(id__in=article_ids).order_by("id")):
+            batch.extend(self._diff_article(article, spans, vectorstore))
+            if len(batch) >= self.batch_size:
+                vectorstore = self._embed_batch(batch, vectorstore)
+                batch = []
+        if batch:
+            vectorstore = self._embed_batch(batch, vectorstore)
+        return vectorstore
+
+    def _populate_vectorstore(self, article_qs, path, vectorstore, last_article_id):
+        """
+        Generate embeddings in fixed-size batches and add them to the FAISS vector store.
+
+        Batches are flushed on article boundaries, so the article id recorded in a
+        checkpoint is always fully embedded.
+        """
+        batch, batch_last_id = [], last_article_id
+        batches = 0
+        started = time.monotonic()
+
+        for article, spans in self._iter_article_chunks(article_qs):
+            batch_last_id = article.id
             self.stdout.write(f"Processing article: {article.title}")
-            try:
-                # Create title and text documents
-                title_doc = Document(
-                    page_content=article.title,
-                    metadata={"source": article.url, "title": article.title, "field": "title"}
-                )
-                text_doc = Document(
-                    page_content=article.text,
-                    metadata={"source": article.url, "title": article.title, "field": "text"}
+            batch.extend(self._diff_article(article, spans, vectorstore))
+            if len(batch) < self.batch_size:
+                continue
+
+            vectorstore = self._embed_batch(batch, vectorstore)
+            batches += 1
+            batch = []
+            if batches % self.checkpoint_every == 0:
+                self._save_checkpoint(path, vectorstore, batch_last_id)
+                rate = self.stats["embedded"] / max(time.monotonic() - started, 1e-9)
+                self.stdout.write(
+                    f"Checkpoint at article id {batch_last_id} ({self.stats['embedded']} chunks, {rate:.1f}/s)."
                 )
 
-                # Split text into smaller chunks
-                text_splitter = CharacterTextSplitter(separator="\n\n", chunk_size=600, chunk_overlap=100)
-                documents.extend(text_splitter.split_documents([title_doc, text_doc]))
+        if batch:
+            vectorstore = self._embed_batch(batch, vectorstore)
+        self._remove_deleted_articles(vectorstore)
+        vectorstore = self._readmit_duplicates(vectorstore)
+
+        if self.pending_create or self.pending_update or self.pending_delete:
+            self._save_checkpoint(path, vectorstore, batch_last_id)
+        if vectorstore.index.ntotal:
+            self.stdout.write(self.style.SUCCESS(
+                f"Embedded {self.stats['embedded']} chunks, reused {self.stats['reused']}, "
+                f"removed {self.stats['removed']}, skipped {self.stats['skipped']} unchanged articles "
+                f"(up to article id {batch_last_id})."
+            ))
+        if self.dedup is not None:
+            self.stdout.write(
+                f"Deduplication: dropped {self.stats['dropped_boilerplate']} boilerplate and "
+                f"{self.stats['dropped_duplicate']} near-duplicate chunks, re-embedded {self.stats['readmitted']} "
+                f"whose near-duplicate was removed, trimmed boilerplate from "
+                f"{self.stats['trimmed']}, saving ~{self.stats['saved_tokens']} embedding tokens "
+                f"({len(self.dedup)} chunk signatures indexed)."
+            )
+        cache = self.embeddings.stats()
+        self.stdout.write(f"Embedding cache: {cache['hits']} hits, {cache['misses']} misses, {cache['entries']} entries.")
+        return vectorstore
+
+    def _embed_batch(self, batch, vectorstore):
+        """
+        Embed one batch of (document, vector_id) pairs, retrying transient API failures with backoff.
+        """
+        documents = [document for document, _ in batch]
+        ids = [vector_id for _, vector_id in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                vectorstore.add_documents(documents, ids=ids)
+                self.stats["embedded"] += len(documents)
+                return vectorstore
             except Exception as err:
-                self.stdout.write(self.style.ERROR(f"Error processing {article.title}: {err}"))
+                if attempt == self.max_retries:
+                    raise CommandError(f"Embedding batch failed after {attempt + 1} attempts: {err}")
+                delay = 2 ** attempt
+                self.stdout.write(self.style.WARNING(f"Embedding batch failed ({err}); retrying in {delay}s..."))
+                time.sleep(delay)
+
+    def _create_vectorstore(self, options):
+        """
+        Create an empty vector store whose FAISS index matches ``--index-type``.
 
-        # Generate embeddings
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-        return FAISS.from_documents(documents, embeddings)
+        Trainable indexes are trained on chunks from randomly sampled articles. Their
+        embeddings land in the embedding cache, so the main pass reuses them.
+        """
+        index_type = options["index_type"]
+        training_vectors = None
+        if needs_training(index_type):
+            training_vectors = self._sample_training_vectors(options["train_size"])
+            dimension = training_vectors.shape[1]
+        else:
+            dimension = len(self.embeddings.embed_query("dimension probe"))
+
+        n_train = 0 if training_vectors is None else len(training_vectors)
+        params = index_params(
+            index_type, n_train, nlist=options["nlist"], pq_m=options["pq_m"], hnsw_m=options["hnsw_m"],
+            nprobe=options["nprobe"],
+        )
+        index = build_index(index_type, dimension, params)
+        if training_vectors is not None:
+            self.stdout.write(f"Training {index_type} index on {n_train} vectors with {params}...")
+            index.train(training_vectors)
+
+        self.index_meta = {
+            "index_type": index_type,
+            "params": params,
+            "dimension": dimension,
+            "metric": "l2",
+            "train_size": n_train,
+        }
+        return FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=ArticleDocstore(),
+            index_to_docstore_id={},
+        )
+
+    def _sample_training_vectors(self, train_size):
+        """
+        Embed up to ``train_size`` chunks drawn from randomly ordered articles.
+        """
+        texts = []
+        for article, spans in self._iter_article_chunks(self.articles.order_by("?")):
+            texts.extend(chunk_text(article, *span) for span in spans)
+            if len(texts) >= train_size:
+                break
+        if not texts:
+            raise CommandError("No articles available to train the index.")
+        texts = texts[:train_size]
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + self.batch_size]))
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _report_recall(self, vectorstore, k, n_queries):
+        """
+        Compare the index against an exact flat index over the same chunks.
+
+        Chunk vectors are re-read through the embedding cache, so this only calls
+        the API for vectors that have been evicted from it.
+        """
+        ids = list(vectorstore.index_to_docstore_id.values())
+        if not ids:
+            return
+        exact = build_index("flat", vectorstore.index.d, {})
+        queries = []
+        rng = np.random.default_rng(0)
+        query_positions = set(rng.choice(len(ids), size=min(n_queries, len(ids)), replace=False).tolist())
+        for start in range(0, len(ids), self.batch_size):
+            window = ids[start:start + self.batch_size]
+            texts = [vectorstore.docstore.search(doc_id).page_content for doc_id in window]
+            vectors = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+            exact.add(vectors)
+            queries.extend(vectors[i - start] for i in range(start, start + len(window)) if i in query_positions)
+
+        recall = recall_at_k(vectorstore.index, exact, np.asarray(queries), k=k)
+        self.stdout.write(self.style.SUCCESS(
+            f"recall@{k} of {self.index_meta['index_type']} vs flat over {len(queries)} queries: {recall:.3f}"
+        ))
+
+    def _report_compact_recall(self, path, k, n_queries):
+        """
+        Compare compact-vector search, with and without float32 re-ranking, against exact search.
+        """
+        report = compact_recall(path, self.vector_dtype, k=k, n_queries=n_queries)
+        self.stdout.write(self.style.SUCCESS(
+            f"recall@{k} of {self.vector_dtype} vectors: {report['recall']:.3f} re-ranked, "
+            f"{report['recall_without_rerank']:.3f} without; {report['bytes_per_vector']} bytes per vector "
+            f"vs {report['float32_bytes_per_vector']} for float32."
+        ))
+
+    def _load_vectorstore(self, path):
+        """
+        Load an existing vector store from ``path``, or return None if there is none yet.
+        """
+        if not (Path(path) / "index.faiss").exists():
+            return None
+        vectorstore = FAISS.load_local(path, self.embeddings, allow_dangerous_deserialization=True)
+        if not isinstance(vectorstore.docstore, ArticleDocstore):
+            # Stores written before chunk offsets carried a pickled copy of every chunk
+            vectorstore.docstore = ArticleDocstore()
+        return vectorstore
+
+    def _load_checkpoint(self, path):
+        """
+        Return the last checkpointed article id written by a previous run, loading the journal it staged.
+        """
+        checkpoint_path = Path(path) / CHECKPOINT_FILENAME
+        if not checkpoint_path.exists():
+            self.stdout.write(self.style.WARNING("No checkpoint found; starting from the beginning."))
+            self._load_journal(path, 0)
+            return 0
+
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        self._load_journal(path, checkpoint.get("segments", 0))
+        return checkpoint["last_article_id"]
+
+    def _load_journal(self, path, segments):
+        """
+        Read the first ``segments`` journal segments staged in ``path`` and delete any later ones.
+
+        Later segments were written by a run that died before recording their
+        checkpoint; their vectors are in the saved index but no row refers to them,
+        so ``_reconcile`` removes them again.
+        """
+        self.segments = segments
+        self.journal = {"update": {}, "create": []}
+        self.removed = set()
+        journal = Path(path) / JOURNAL_DIRNAME
+        for segment_path in sorted(journal.glob("*.json")):
+            if int(segment_path.stem) > segments:
+                segment_path.unlink()
+                continue
+            with open(segment_path) as f:
+                segment = json.load(f)
+            self.removed.update(segment["delete"])
+            for values in segment["update"]:
+                values = _chunk_from_json(values)
+                self.journal["update"][values.pop("pk")] = values
+            self.journal["create"].extend(_chunk_from_json(values) for values in segment["create"])
+
+    def _save_checkpoint(self, path, vectorstore, last_article_id):
+        """
+        Save the vector store, then stage the chunk-mapping changes and the last fully embedded article id.
+
+        Mapping changes go to a journal segment in the version directory rather than
+        the database, which keeps describing the published version until this one
+        is published; a version that is never published takes its journal with it.
+        """
+        self._save_vectorstore(path, vectorstore)
+        journal = Path(path) / JOURNAL_DIRNAME
+        journal.mkdir(exist_ok=True)
+        self.segments += 1
+        segment = {
+            "delete": self.pending_delete,
+            "update": [_chunk_to_json(chunk, ["pk", "article_id", *UPDATED_FIELDS]) for chunk in self.pending_update],
+            "create": [_chunk_to_json(chunk, CREATED_FIELDS) for chunk in self.pending_create],
+        }
+        segment_path = journal / f"{self.segments:08d}.json"
+        tmp_path = segment_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(segment, f)
+        os.replace(tmp_path, segment_path)
+        self._reset_pending()
+
+        checkpoint_path = Path(path) / CHECKPOINT_FILENAME
+        tmp_path = checkpoint_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"last_article_id": last_article_id, "segments": self.segments}, f)
+        os.replace(tmp_path, checkpoint_path)
+
+    def _apply_published_journal(self, root):
+        """
+        Apply a journal left in the published version by a run that died right after publishing it.
+        """
+        version, path = published_version(root)
+        if version is not None and any(path.glob(f"**/{JOURNAL_DIRNAME}")):
+            self.stdout.write(f"Applying the chunk mapping staged with published version {version}...")
+            self._apply_journal(path)
+
+    def _apply_journal(self, path):
+        """
+        Commit the chunk-mapping changes staged with the version ``path``, which is about to be published.
+
+        All shards' segments are applied in one transaction that also records the
+        version, so a journal whose version is already recorded was applied before
+        a crash and is only deleted. Rows the version drops are marked retired by it rather than deleted.
+        """
+        path = Path(path)
+        journals = sorted(path.glob(f"**/{JOURNAL_DIRNAME}"))
+        if self.store.version != path.name:
+            with transaction.atomic():
+                for journal in journals:
+                    for segment_path in sorted(journal.glob("*.json")):
+                        with open(segment_path) as f:
+                            self._apply_segment(json.load(f), path.name)
+                self.store.version = path.name
+                self.store.save(update_fields=["version"])
+        for journal in journals:
+            shutil.rmtree(journal)
+
+    def _apply_segment(self, segment, version):
+        deleted = segment["delete"]
+        updated = [ArticleChunk(**_chunk_from_json(values)) for values in segment["update"]]
+        created = [ArticleChunk(store=self.store, **_chunk_from_json(values)) for values in segment["create"]]
+        for start in range(0, len(deleted), self.batch_size):
+            ArticleChunk.objects.filter(pk__in=deleted[start:start + self.batch_size]).update(retired_in=version)
+        ArticleChunk.objects.bulk_update(updated, UPDATED_FIELDS, batch_size=self.batch_size)
+        created = ArticleChunk.objects.bulk_create(created, batch_size=self.batch_size)
+        if not self.fts:
+            return
+        # Retired and reused rows keep their full-text entries: retired ones stop matching once their chunk
+        # row is retired, and reused ones hold the same text (a renamed article's new title is indexed by
+        # --rebuild-fts). Near-duplicate rows are left out, like their vectors.
+        # The rows are committed with the text they were cut from, so the docstore can read them back
+        docstore = ArticleDocstore(cache_size=0)
+        rows = []
+        for chunk in created:
+            if chunk.duplicate_of is not None:
+                continue
+            document = docstore.search(chunk.vector_id)
+            rows.append((chunk.pk, document.metadata.get("title", ""), document.page_content))
+        lexical.index_chunks(rows)
 
     def _save_vectorstore(self, path: str, vectorstore):
         """
@@ -101,6 +967,7 @@ class Command(BaseCommand):
         # Save vector store
         self.stdout.write(f"Saving vector store to {path}...")
         vectorstore.save_local(path)
+        write_index_meta(path, self.index_meta)
+        export_mmap_store(path, vectorstore, dtype=self.vector_dtype, mode=self.store_mode)
+        self.saved = True
         self.stdout.write("Vector store successfully saved.")
-
-
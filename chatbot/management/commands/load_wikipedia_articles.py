@@ -1,73 +1,135 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
 from django.core.management.base import BaseCommand, CommandError
-from datasets import load_dataset
+from django.db import transaction
+from ...dataset import convert_row, iter_batches, open_dataset
 from ...models import Article
+from ...textstore import ARTICLE_TEXT_VACUUM_FRACTION, reclaim_space, write_blocks
 
 class Command(BaseCommand):
     help = "Manage Wikipedia articles: load, list, or delete articles."
 
     def add_arguments(self, parser):
-        parser.add_argument("--limit", type=int, default=10, help="Number of articles to load")
+        parser.add_argument("--limit", type=int, default=10, help="Number of articles to load (0 for all)")
         parser.add_argument("--subset", type=str, default="20220301.simple", help="Dataset subset to load")
+        parser.add_argument("--dataset-path", type=str, help="Load from a local dataset directory instead of the Hub")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Rows per conversion and write batch")
+        parser.add_argument("--workers", type=int, default=4, help="Worker processes converting rows")
         parser.add_argument("--list", action="store_true", help="List all articles in the database")
         parser.add_argument("--delete", action="store_true", help="Delete all articles from the database")
+        parser.add_argument(
+            "--vacuum", action="store_true",
+            help="Reclaim the space left by deleted and rewritten article text. Deletes and loads do this "
+            "automatically once ARTICLE_TEXT_VACUUM_FRACTION of the database is free.",
+        )
 
     def handle(self, *args, **options):
         if options["list"]:
             self._list_articles()
+        elif options["vacuum"]:
+            self._reclaim_space(0.0)
         elif options["delete"]:
             self._delete_articles()
-        elif options["limit"] and options["subset"]:
-            self._load_articles(options["limit"], options["subset"])
+            self._reclaim_space(0.0)
+        elif options["subset"] or options["dataset_path"]:
+            self._load_articles(
+                options["limit"], options["subset"], options["dataset_path"], options["batch_size"], options["workers"]
+            )
+            self._reclaim_space(ARTICLE_TEXT_VACUUM_FRACTION)
         else:
             self.stdout.write(self.style.ERROR("Invalid arguments. Use --help for guidance."))
 
+    def _reclaim_space(self, min_free_fraction):
+        """
+        Compact the database once enough of it is free space left by deleted or rewritten text blocks.
+        """
+        reclaimed = reclaim_space(min_free_fraction)
+        if reclaimed:
+            self.stdout.write(self.style.SUCCESS(f"Reclaimed {reclaimed / 2**20:.1f} MiB of free space."))
+
     def _list_articles(self):
-        articles = Article.objects.all()
-        if not articles:
+        articles = Article.objects.values_list("id", "title", "url")
+        if not articles.exists():
             self.stdout.write("No articles found in the database.")
-        for article in articles:
-            self.stdout.write(f"{article.id}: {article.title} ({article.url})")
+        for article_id, title, url in articles.iterator():
+            self.stdout.write(f"{article_id}: {title} ({url})")
 
     def _delete_articles(self):
         count, _ = Article.objects.all().delete()
         self.stdout.write(self.style.SUCCESS(f"Deleted {count} articles."))
 
-    def _load_articles(self, limit, subset):
+    def _load_articles(self, limit, subset, dataset_path, batch_size, workers):
+        """
+        Stream the dataset in batches, convert rows in a process pool and upsert each batch.
+        """
         try:
-            self.stdout.write(f"Loading dataset with subset '{subset}' and limit {limit}...")
-            wikipedia_data = load_dataset("wikipedia", subset, split=f"train[:{limit}]")
+            source = dataset_path or f"subset '{subset}'"
+            self.stdout.write(f"Streaming dataset from {source} with limit {limit or 'none'}...")
+            wikipedia_data = open_dataset(subset, dataset_path)
 
-            # Use _prepare_articles to prepare article objects
-            articles_to_create = self._prepare_articles(wikipedia_data)
-
-            # Save articles in bulk
-            self._save_articles(articles_to_create)
+            total = skipped = 0
+            started = time.monotonic()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for rows in iter_batches(wikipedia_data, batch_size, limit):
+                    chunksize = max(1, len(rows) // (workers * 4))
+                    articles_to_create, blocks, bad_rows = self._prepare_articles(
+                        executor.map(convert_row, rows, chunksize=chunksize)
+                    )
+                    skipped += bad_rows
+                    self._save_articles(articles_to_create, blocks, batch_size)
+                    total += len(articles_to_create)
+                    rate = total / max(time.monotonic() - started, 1e-9)
+                    self.stdout.write(f"Loaded {total} articles ({rate:.0f} rows/s)")
 
+            self.stdout.write(self.style.SUCCESS(f"Successfully saved {total} articles."))
+            if skipped:
+                self.stdout.write(self.style.WARNING(f"Skipped {skipped} rows missing a title or text."))
         except Exception as e:
             raise CommandError(f"An error occurred: {e}")
 
-    def _prepare_articles(self, wikipedia_data):
+    def _prepare_articles(self, converted_rows):
         """
-        Convert dataset rows into Article model instances.
+        Convert (title, url, text blocks, content_hash) tuples into Article model instances.
+
+        Returns the instances, their compressed text blocks keyed by (title, url) and
+        the number of malformed rows skipped.
         """
-        articles = []
-        for row in wikipedia_data:
-            try:
-                articles.append(Article(
-                    title=row.get("title", ""),
-                    url=row.get("url", ""),
-                    text=row.get("text", ""),
-                ))
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"Error processing row {row.get('id', 'unknown')}: {e}"))
-        return articles
+        # A batch may repeat a (title, url) pair; the last row wins as it would across batches
+        articles, blocks, skipped = {}, {}, 0
+        for converted in converted_rows:
+            if converted is None:
+                skipped += 1
+                continue
+            title, url, text_blocks, article_hash = converted
+            articles[title, url] = Article(title=title, url=url, content_hash=article_hash)
+            blocks[title, url] = text_blocks
+        return list(articles.values()), blocks, skipped
 
-    def _save_articles(self, articles):
+    def _save_articles(self, articles, blocks, batch_size):
         """
-        Bulk save Article instances to the database.
+        Upsert one batch of Article instances on (title, url) and their text in its own transaction.
+
+        Reruns update changed text in place, so article ids stay stable for ingestion.
+        Text is only rewritten for articles whose content hash changed.
         """
-        try:
-            Article.objects.bulk_create(articles)
-            self.stdout.write(self.style.SUCCESS(f"Successfully saved {len(articles)} articles."))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"An error occurred while saving articles: {e}"))
+        titles = {article.title for article in articles}
+        with transaction.atomic():
+            stored = {
+                (title, url): article_hash
+                for title, url, article_hash in Article.objects.filter(title__in=titles).values_list(
+                    "title", "url", "content_hash"
+                )
+            }
+            Article.objects.bulk_create(
+                articles,
+                batch_size=batch_size,
+                update_conflicts=True,
+                unique_fields=["title", "url"],
+                update_fields=["content_hash"],
+            )
+            changed = {
+                (article.title, article.url) for article in articles
+                if stored.get((article.title, article.url)) != article.content_hash
+            }
+            ids = Article.objects.filter(title__in=titles).values_list("title", "url", "id")
+            write_blocks({article_id: blocks[title, url] for title, url, article_id in ids if (title, url) in changed})
@@ -0,0 +1,60 @@
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ...vectorstore import load_vectorstore
+
+
+class Command(BaseCommand):
+    help = "Serve one vector store shard over HTTP for scatter-gather retrieval."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--path", type=str, required=True, help="Path of the shard directory to serve.")
+        parser.add_argument("--host", type=str, default="127.0.0.1", help="Interface to bind.")
+        parser.add_argument("--port", type=int, default=8101, help="Port to listen on.")
+
+    def handle(self, *args, **options):
+        # Queries arrive already embedded, so the shard needs no embedding model; a shard server
+        # shares its environment with the router, whose VECTORSTORE_SHARD_URLS point back at it
+        vectorstore = load_vectorstore(options["path"], None, sharded=False)
+        server = ThreadingHTTPServer((options["host"], options["port"]), self._handler(vectorstore))
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving {options['path']} on http://{options['host']}:{options['port']}/search"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+
+    def _handler(self, vectorstore):
+        """
+        Build a request handler answering ``POST /search`` with ``{"vector": [...], "k": n}``.
+        """
+        class ShardHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if self.path != "/search":
+                    self.send_error(404)
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                    hits = vectorstore.similarity_search_with_score_by_vector(body["vector"], k=int(body.get("k", 4)))
+                    payload = json.dumps({"results": [
+                        {"page_content": document.page_content, "metadata": document.metadata, "score": float(score)}
+                        for document, score in hits
+                    ]}).encode("utf-8")
+                except (KeyError, ValueError) as e:
+                    self.send_error(400, str(e))
+                    return
+                finally:
+                    # Each request runs in its own thread with its own database connection
+                    connection.close()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return ShardHandler
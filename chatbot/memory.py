@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from dotenv import load_dotenv
+from langchain.memory import ConversationSummaryBufferMemory
+from pydantic import PrivateAttr
+
+load_dotenv()
+
+SESSION_SUMMARY_WORKERS = int(os.getenv("SESSION_SUMMARY_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=SESSION_SUMMARY_WORKERS, thread_name_prefix="session-summary")
+
+
+class DeferredSummaryBufferMemory(ConversationSummaryBufferMemory):
+    """
+    Summary buffer memory that summarizes overflowing turns off the request path.
+
+    Once the buffer passes ``max_token_limit`` the oldest turns are handed to a
+    background worker and the turn returns at once. Until the worker finishes,
+    those turns stay in the buffer, so the next turn sees the latest summary plus
+    every raw turn since it. The summary is applied only if the summarized turns
+    are still at the front of the buffer. ``on_summarized`` is called after a
+    summary is applied.
+    """
+
+    _state_lock: Any = PrivateAttr(default_factory=threading.RLock)
+    _pending: Any = PrivateAttr(default=None)
+    _on_summarized: Any = PrivateAttr(default=None)
+
+    def __init__(self, on_summarized=None, **kwargs):
+        super().__init__(**kwargs)
+        self._on_summarized = on_summarized
+
+    def load_memory_variables(self, inputs):
+        with self._state_lock:
+            return super().load_memory_variables(inputs)
+
+    async def aload_memory_variables(self, inputs):
+        return self.load_memory_variables(inputs)
+
+    def save_context(self, inputs, outputs):
+        with self._state_lock:
+            super().save_context(inputs, outputs)
+
+    async def asave_context(self, inputs, outputs):
+        # prune only schedules work, so nothing here waits on the LLM
+        self.save_context(inputs, outputs)
+
+    def prune(self):
+        with self._state_lock:
+            if self._pending is not None and not self._pending.done():
+                return  # The next turn's prune picks up whatever this summary leaves over
+            messages = self.chat_memory.messages
+            count, length = 0, self.llm.get_num_tokens_from_messages(messages)
+            while length > self.max_token_limit and count < len(messages):
+                count += 1
+                length = self.llm.get_num_tokens_from_messages(messages[count:])
+            if count:
+                self._pending = _executor.submit(self._summarize, list(messages[:count]), self.moving_summary_buffer)
+
+    async def aprune(self):
+        self.prune()
+
+    def _summarize(self, pruned, summary):
+        try:
+            new_summary = self.predict_new_summary(pruned, summary)
+        except Exception:
+            return  # Keep the raw turns; the next turn schedules another attempt
+        with self._state_lock:
+            messages = self.chat_memory.messages
+            if len(messages) < len(pruned) or any(a is not b for a, b in zip(messages, pruned)):
+                return  # Cleared or replaced while summarizing
+            del messages[:len(pruned)]
+            self.moving_summary_buffer = new_summary
+        if self._on_summarized is not None:
+            self._on_summarized(self)
+
+    def snapshot(self):
+        """
+        Return (summary, messages) as a consistent pair.
+        """
+        with self._state_lock:
+            return self.moving_summary_buffer, list(self.chat_memory.messages)
+
+    def wait(self, timeout=None):
+        """
+        Block until a scheduled summary has been applied.
+        """
+        pending = self._pending
+        if pending is not None:
+            pending.result(timeout)
+
+    def clear(self):
+        with self._state_lock:
+            super().clear()
+            self._pending = None
@@ -0,0 +1,269 @@
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+from langchain_core.callbacks import BaseCallbackHandler
+
+load_dotenv()
+
+# Add a Server-Timing header with per-stage durations to chat responses
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_string(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = defaultdict(float)
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] += amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        return self.header() + [
+            f"{self.name}{_label_string(self.labelnames, labels)} {value}" for labels, value in sorted(values.items())
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Gauge whose value is set directly or read from ``callback`` at scrape time.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, callback=None):
+        super().__init__(name, documentation)
+        self.callback = callback
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1.0):
+        self.inc(-amount)
+
+    def collect(self):
+        value = self.value
+        if self.callback is not None:
+            try:
+                value = self.callback()
+            except Exception:
+                return []
+        if value is None:
+            return []
+        return self.header() + [f"{self.name} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts, total = self._series.get(labels, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._series[labels] = (counts, total + value)
+
+    def collect(self):
+        lines = self.header()
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else bound
+                label_string = _label_string(self.labelnames + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{label_string} {cumulative}")
+            label_string = _label_string(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_string} {total}")
+            lines.append(f"{self.name}_count{label_string} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram("chatbot_stage_seconds", "Time spent in each question-answering stage.", ["stage"])
+STAGE_TOKENS = Counter("chatbot_stage_tokens_total", "LLM tokens used per stage.", ["stage", "kind"])
+REQUEST_SECONDS = Histogram("chatbot_request_seconds", "End-to-end request latency.", ["view"])
+REQUESTS = Counter("chatbot_requests_total", "Requests served.", ["view", "status"])
+INFLIGHT = Gauge("chatbot_inflight_requests", "Requests currently being served.")
+
+# Per-request stage durations, used for the Server-Timing header
+_request_timings = ContextVar("chatbot_request_timings", default=None)
+
+
+def register_gauge(name, documentation, callback):
+    return Gauge(name, documentation, callback=callback)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] += seconds
+
+
+@contextmanager
+def timed_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def track_request(view):
+    """
+    Count an in-flight request and collect its stage timings; yields a dict of stage -> seconds.
+    """
+    INFLIGHT.inc()
+    timings = defaultdict(float)
+    token = _request_timings.set(timings)
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - started, view)
+        _request_timings.reset(token)
+        INFLIGHT.dec()
+
+
+def server_timing(timings):
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def render():
+    """
+    Return all metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+class StageCallbackHandler(BaseCallbackHandler):
+    """
+    Attribute chain, retriever and LLM runs to stages and record their timings and token counts.
+
+    The handler is attached both to each request's chain config and to the chat
+    models themselves. LLM calls whose parent chain it never saw come from the
+    summary memory and are recorded as ``summarize``.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._started = {}
+        self._streamed_tokens = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("id", [""])[-1]
+        with self._lock:
+            parent_stage = self._stages.get(parent_run_id)
+            if name == "StuffDocumentsChain" or parent_stage == "answer":
+                self._stages[run_id] = "answer"
+            elif name == "LLMChain":
+                self._stages[run_id] = "condense_question"
+            else:
+                self._stages[run_id] = parent_stage or "chain"
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            self._stages.pop(run_id, None)
+
+    on_chain_error = on_chain_end
+
+    def _start(self, run_id, stage):
+        with self._lock:
+            self._started[run_id] = (stage, time.perf_counter())
+
+    def _finish(self, run_id):
+        with self._lock:
+            stage, started = self._started.pop(run_id, (None, None))
+            streamed = self._streamed_tokens.pop(run_id, 0)
+        if stage is not None:
+            observe_stage(stage, time.perf_counter() - started)
+        return stage, streamed
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, **kwargs):
+        with self._lock:
+            nested = parent_run_id in self._started
+        if not nested:  # Wrapped retrievers are covered by the outer span
+            self._start(run_id, "retrieval")
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    on_retriever_error = on_retriever_end
+
+    def _llm_stage(self, parent_run_id):
+        with self._lock:
+            return self._stages.get(parent_run_id, "summarize")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, self._llm_stage(parent_run_id))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, self._llm_stage(parent_run_id))
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            self._streamed_tokens[run_id] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        stage, streamed = self._finish(run_id)
+        if stage is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            STAGE_TOKENS.inc(stage, "prompt", amount=usage.get("prompt_tokens", 0))
+            STAGE_TOKENS.inc(stage, "completion", amount=usage.get("completion_tokens", 0))
+        elif streamed:
+            STAGE_TOKENS.inc(stage, "completion", amount=streamed)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+
+STAGE_HANDLER = StageCallbackHandler()
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.CreateModel(
+            name='ArticleChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('article_id', models.BigIntegerField(db_index=True)),
+                ('article_hash', models.CharField(max_length=64)),
+                ('field', models.CharField(max_length=16)),
+                ('chunk_index', models.PositiveIntegerField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('vector_id', models.CharField(max_length=64, unique=True)),
+            ],
+            options={
+                'ordering': ['article_id', 'chunk_index'],
+            },
+        ),
+    ]
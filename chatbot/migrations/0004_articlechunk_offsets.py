@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0003_conversation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlechunk',
+            name='start',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='articlechunk',
+            name='length',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
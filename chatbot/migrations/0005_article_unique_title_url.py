@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+def remove_duplicate_articles(apps, schema_editor):
+    """
+    Keep the oldest row for each (title, url) so the unique constraint can be added.
+    """
+    Article = apps.get_model('chatbot', 'Article')
+    seen = set()
+    duplicates = []
+    for pk, title, url in Article.objects.order_by('id').values_list('id', 'title', 'url').iterator():
+        if (title, url) in seen:
+            duplicates.append(pk)
+        else:
+            seen.add((title, url))
+    Article.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0004_articlechunk_offsets'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_articles, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='article',
+            constraint=models.UniqueConstraint(fields=('title', 'url'), name='unique_article_title_url'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    # FTS5 is SQLite-only; other backends fall back to vector-only retrieval
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chatbot_chunk_fts "
+        "USING fts5(title, body, tokenize='porter unicode61')"
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS chatbot_chunk_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0005_article_unique_title_url'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
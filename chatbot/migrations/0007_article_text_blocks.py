@@ -0,0 +1,67 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+from chatbot.textstore import decode_blocks, encode_blocks
+
+BATCH_SIZE = 500
+
+
+def move_text_to_blocks(apps, schema_editor):
+    """
+    Compress every article body into ArticleText blocks.
+    """
+    Article = apps.get_model('chatbot', 'Article')
+    ArticleText = apps.get_model('chatbot', 'ArticleText')
+    blocks = []
+    for article_id, text in Article.objects.values_list('id', 'text').iterator(chunk_size=BATCH_SIZE):
+        blocks.extend(
+            ArticleText(article_id=article_id, start=start, length=length, codec=codec, data=data)
+            for start, length, codec, data in encode_blocks(text)
+        )
+        if len(blocks) >= BATCH_SIZE:
+            ArticleText.objects.bulk_create(blocks)
+            blocks = []
+    ArticleText.objects.bulk_create(blocks)
+
+
+def move_blocks_to_text(apps, schema_editor):
+    Article = apps.get_model('chatbot', 'Article')
+    ArticleText = apps.get_model('chatbot', 'ArticleText')
+    for article in Article.objects.iterator(chunk_size=BATCH_SIZE):
+        rows = ArticleText.objects.filter(article_id=article.id).order_by('start')
+        article.text = decode_blocks(rows.values_list('start', 'length', 'codec', 'data'))
+        article.save(update_fields=['text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0006_chunk_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleText',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.PositiveIntegerField()),
+                ('length', models.PositiveIntegerField()),
+                ('codec', models.CharField(max_length=8)),
+                ('data', models.BinaryField()),
+                ('article', models.ForeignKey(
+                    on_delete=django.db.models.deletion.CASCADE, related_name='text_blocks', to='chatbot.article'
+                )),
+            ],
+            options={
+                'ordering': ['article_id', 'start'],
+                'constraints': [
+                    models.UniqueConstraint(fields=('article', 'start'), name='unique_article_text_start'),
+                ],
+            },
+        ),
+        migrations.RunPython(move_text_to_blocks, move_blocks_to_text),
+        migrations.RemoveField(
+            model_name='article',
+            name='text',
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0007_article_text_blocks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlechunk',
+            name='minhash',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
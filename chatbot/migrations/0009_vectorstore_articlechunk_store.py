@@ -0,0 +1,46 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Chunk rows written before stores were keyed belong to the one store that existed;
+# ingestion hands this key to the first unkeyed store directory it refreshes.
+UNKEYED_STORE_KEY = 'default'
+
+
+def assign_unkeyed_chunks(apps, schema_editor):
+    VectorStore = apps.get_model('chatbot', 'VectorStore')
+    ArticleChunk = apps.get_model('chatbot', 'ArticleChunk')
+    if ArticleChunk.objects.exists():
+        store = VectorStore.objects.create(key=UNKEYED_STORE_KEY)
+        ArticleChunk.objects.update(store=store)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0008_articlechunk_minhash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VectorStore',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='articlechunk',
+            name='store',
+            field=models.ForeignKey(
+                null=True, on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='chatbot.vectorstore'
+            ),
+        ),
+        migrations.RunPython(assign_unkeyed_chunks, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='articlechunk',
+            name='store',
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='chatbot.vectorstore'
+            ),
+        ),
+    ]
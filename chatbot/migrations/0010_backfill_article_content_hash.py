@@ -0,0 +1,34 @@
+from django.db import migrations
+
+from chatbot.hashing import content_hash
+from chatbot.textstore import decode_blocks
+
+BATCH_SIZE = 500
+
+
+def backfill_content_hash(apps, schema_editor):
+    """
+    Hash articles saved before 0002 added the column, so ingestion can skip unchanged ones in SQL.
+    """
+    Article = apps.get_model('chatbot', 'Article')
+    ArticleText = apps.get_model('chatbot', 'ArticleText')
+    # Ids are read up front: SQLite gives no isolation between a cursor and writes to the same table
+    ids = list(Article.objects.filter(content_hash='').values_list('id', flat=True))
+    for start in range(0, len(ids), BATCH_SIZE):
+        articles = list(Article.objects.filter(id__in=ids[start:start + BATCH_SIZE]))
+        for article in articles:
+            blocks = ArticleText.objects.filter(article_id=article.id).order_by('start')
+            text = decode_blocks(blocks.values_list('start', 'length', 'codec', 'data'))
+            article.content_hash = content_hash(article.title, article.url, text)
+        Article.objects.bulk_update(articles, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0009_vectorstore_articlechunk_store'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def make_fts_contentless(apps, schema_editor):
+    # The chunk text lives in the article text blocks; the index only needs its terms, not a second copy
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("ALTER TABLE chatbot_chunk_fts RENAME TO chatbot_chunk_fts_old")
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE chatbot_chunk_fts "
+        "USING fts5(title, body, content='', tokenize='porter unicode61')"
+    )
+    schema_editor.execute(
+        "INSERT INTO chatbot_chunk_fts (rowid, title, body) "
+        "SELECT rowid, title, body FROM chatbot_chunk_fts_old WHERE rowid IN (SELECT id FROM chatbot_articlechunk)"
+    )
+    schema_editor.execute("DROP TABLE chatbot_chunk_fts_old")
+
+
+def restore_fts_content(apps, schema_editor):
+    # A contentless index cannot give its text back; run ingest_embeddings --rebuild-fts afterwards
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS chatbot_chunk_fts")
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE chatbot_chunk_fts "
+        "USING fts5(title, body, tokenize='porter unicode61')"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0011_vectorstore_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(make_fts_contentless, restore_fts_content),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0012_contentless_chunk_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlechunk',
+            name='duplicate_of',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatbot', '0014_article_title_lower'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='articlechunk',
+            name='retired_in',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+    ]
@@ -1,10 +1,137 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Lower
+
+from .hashing import content_hash
+from .textstore import decode_blocks, encode_blocks, write_blocks
 
 
 class Article(models.Model):
+    """
+    A Wikipedia article.
+
+    The body is not a column: ``text`` is read from compressed ``ArticleText``
+    blocks on first access, so listing and iterating articles never loads it.
+    Use ``prefetch_related("text_blocks")`` to load bodies for a whole queryset.
+    """
     title = models.CharField(max_length=255)
     url = models.URLField()
-    text = models.TextField()  # Ensure the field name matches the dataset
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)
+
+    _text = None
+    _text_changed = False
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["title", "url"], name="unique_article_title_url"),
+        ]
+        # Title questions look articles up case-insensitively
+        indexes = [models.Index(Lower("title"), name="chatbot_article_title_lower")]
 
     def __str__(self):
         return self.title
+
+    @property
+    def text(self):
+        if self._text is None:
+            blocks = self.text_blocks.all() if self.pk is not None else []
+            self._text = decode_blocks((block.start, block.length, block.codec, block.data) for block in blocks)
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text, self._text_changed = value, True
+
+    def compute_content_hash(self):
+        return content_hash(self.title, self.url, self.text)
+
+    def save(self, *args, **kwargs):
+        self.content_hash = self.compute_content_hash()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if self._text_changed:
+                write_blocks({self.pk: encode_blocks(self._text)})
+                self._text_changed = False
+
+
+class ArticleText(models.Model):
+    """
+    One compressed block of an article's text.
+
+    ``start`` and ``length`` are character offsets into the text, so a chunk is
+    read by decompressing only the blocks it overlaps.
+    """
+    article = models.ForeignKey(Article, on_delete=models.CASCADE, related_name="text_blocks")
+    start = models.PositiveIntegerField()
+    length = models.PositiveIntegerField()
+    codec = models.CharField(max_length=8)
+    data = models.BinaryField()
+
+    class Meta:
+        ordering = ["article_id", "start"]
+        constraints = [
+            models.UniqueConstraint(fields=["article", "start"], name="unique_article_text_start"),
+        ]
+
+    def __str__(self):
+        return f"{self.article_id}@{self.start}"
+
+
+class VectorStore(models.Model):
+    """
+    A vector store directory whose chunk mapping is kept in ``ArticleChunk``.
+
+    ``key`` is also written into the store directory, so the mapping follows the
+    directory when it is moved and two stores never share chunk rows. ``version``
+    is the published store version the rows were last brought up to date with.
+    """
+    key = models.CharField(max_length=32, unique=True)
+    version = models.CharField(max_length=64, blank=True)
+
+    def __str__(self):
+        return self.key
+
+
+class ArticleChunk(models.Model):
+    """
+    One embedded chunk of an article and the id of its vector in the FAISS store.
+
+    The chunk text is not stored: it is ``length`` characters of the article's
+    ``field`` starting at ``start``. ``article_id`` is a plain column rather than a foreign key so that rows for
+    deleted articles survive long enough for ingestion to remove their vectors. A chunk dropped as a near-duplicate
+    keeps a row pointing at the chunk it duplicates, so it can be embedded again once that chunk goes away.
+    Rows are never deleted when a version drops them, only marked retired, because servers still answering
+    from an older version resolve its vector ids through them.
+    """
+    store = models.ForeignKey(VectorStore, on_delete=models.CASCADE, related_name="chunks")
+    article_id = models.BigIntegerField(db_index=True)
+    article_hash = models.CharField(max_length=64)
+    field = models.CharField(max_length=16)
+    chunk_index = models.PositiveIntegerField()
+    start = models.PositiveIntegerField(default=0)
+    length = models.PositiveIntegerField(default=0)
+    content_hash = models.CharField(max_length=64)
+    vector_id = models.CharField(max_length=64, unique=True)
+    minhash = models.BinaryField(null=True, blank=True)  # MinHash signature used for near-duplicate detection
+    # Vector id of the chunk this one was dropped as a near-duplicate of; such rows have no vector of their own
+    duplicate_of = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    # Version that dropped this chunk; the row stays for servers on older versions until none is kept on disk
+    retired_in = models.CharField(max_length=64, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ["article_id", "chunk_index"]
+
+    def __str__(self):
+        return f"{self.article_id}:{self.chunk_index}"
+
+
+class Conversation(models.Model):
+    """
+    Persisted conversation memory for one chat session.
+    """
+    session_key = models.CharField(max_length=64, unique=True)
+    summary = models.TextField(blank=True)
+    messages = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.session_key
@@ -0,0 +1,80 @@
+import asyncio
+import random
+import time
+
+
+class RateLimiter:
+    """
+    Async token buckets for requests and tokens per minute, shared by a pool of workers.
+
+    A limit of 0 disables that bucket. ``pause`` holds every worker back, which is
+    how a 429 from the provider slows the whole pool down rather than one worker.
+    """
+
+    def __init__(self, rpm=0, tpm=0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def _wait_time(self, tokens):
+        wait = 0.0
+        if self.rpm and self._requests < 1:
+            wait = (1 - self._requests) * 60 / self.rpm
+        if self.tpm and self._tokens < tokens:
+            wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+        return wait
+
+    async def acquire(self, tokens=0):
+        """
+        Wait until one request and ``tokens`` tokens are available, then take them.
+        """
+        if self.tpm:
+            tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    self._requests -= 1 if self.rpm else 0
+                    self._tokens -= tokens if self.tpm else 0
+                    return
+                await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """
+    Exponential backoff with full jitter for retry ``attempt`` (starting at 0).
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def retry_after(error):
+    """
+    Return the provider's Retry-After delay in seconds for a rate-limit error, or None otherwise.
+    """
+    if getattr(error, "status_code", None) != 429:
+        return None
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
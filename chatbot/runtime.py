@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+
+import numpy as np
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+from .answer_cache import AnswerCache, vectorstore_version
+from . import metrics
+from .context import CONTEXT_ASSEMBLY, CONTEXT_FETCH_K, ContextAssemblingRetriever
+from .embedding_cache import CachedEmbeddings, get_embeddings
+from .fakes import FakeChatModel, fake_backends_enabled
+from .lexical import HybridRetriever, build_retriever
+from .sessions import SessionMemoryStore
+from .topics import TopicIndex
+from .vectorstore import load_vectorstore, local_indexes, touch_pages
+from .versions import published_version, read_store_key, resolve_store_path
+
+load_dotenv()
+
+# OpenAI API key and model
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MODEL_NAME = os.getenv("OPENAI_API_MODEL", "gpt-4")
+VECTORSTORE_PATH = os.getenv("VECTORSTORE_PATH", "./wiki_embeddings")
+CHATBOT_WARMUP = os.getenv("CHATBOT_WARMUP", "true").lower() in ("1", "true", "yes")
+# How often to check for a newly published store version (0 disables hot-swapping)
+VECTORSTORE_WATCH_SECONDS = float(os.getenv("VECTORSTORE_WATCH_SECONDS", "5"))
+
+_lock = threading.RLock()
+_components = {}
+# One lock per component, so a slow index build does not hold up requests for other components
+_build_locks = {}
+_status = {"ready": False, "error": None, "warmup_seconds": None, "version": None, "swapped_at": None}
+_watcher = None
+
+
+def _get(name, factory):
+    """
+    Build a shared component on first use; concurrent first callers wait for one build.
+
+    The build runs under that component's own lock, not the runtime lock, so
+    ``reset``, ``refresh`` and probes reading ``status`` never wait on it.
+    """
+    component = _components.get(name)
+    if component is None:
+        with _lock:
+            build_lock = _build_locks.setdefault(name, threading.Lock())
+        with build_lock:
+            component = _components.get(name)
+            if component is None:
+                component = _components[name] = factory()
+    return component
+
+
+def _build_retriever(vectorstore):
+    try:
+        store = read_store_key(VECTORSTORE_PATH)
+        if not CONTEXT_ASSEMBLY:
+            return build_retriever(vectorstore, store=store)
+        return ContextAssemblingRetriever(retriever=build_retriever(vectorstore, k=CONTEXT_FETCH_K, store=store))
+    except Exception as e:
+        raise RuntimeError(f"Error loading retriever: {e}")
+
+
+def load_retriever():
+    return _build_retriever(get_vectorstore())
+
+
+def _load_vectorstore():
+    version, path = published_version(VECTORSTORE_PATH)
+    _status["version"] = version
+    return load_vectorstore(path, get_embeddings(VECTORSTORE_PATH))
+
+
+def get_vectorstore():
+    return _get("vectorstore", _load_vectorstore)
+
+
+def get_retriever():
+    return _get("retriever", load_retriever)
+
+
+def title_pks(question):
+    """
+    Return the chunk pks the retriever answers ``question`` with from an exact article title match, if any.
+
+    Such questions are answered without embedding them.
+    """
+    retriever = get_retriever()
+    retriever = getattr(retriever, "retriever", retriever)  # Unwrap a ContextAssemblingRetriever
+    return retriever.title_pks(question) if isinstance(retriever, HybridRetriever) else []
+
+
+def _chat_model(**kwargs):
+    # Attached to the model so summary-memory calls, which run outside the request's callbacks, are timed too
+    callbacks = [metrics.STAGE_HANDLER]
+    if fake_backends_enabled():
+        return FakeChatModel(
+            latency=float(os.getenv("FAKE_LLM_LATENCY", "0")), tags=kwargs.get("tags"), callbacks=callbacks
+        )
+    return ChatOpenAI(
+        model_name=MODEL_NAME, temperature=0, openai_api_key=OPENAI_API_KEY, callbacks=callbacks, **kwargs
+    )
+
+
+def get_llm():
+    return _get("llm", _chat_model)
+
+
+def get_answer_llm():
+    # Tagged so the streaming view can tell answer tokens from question-condensing tokens
+    return _get("answer_llm", lambda: _chat_model(streaming=True, tags=["answer"]))
+
+
+def get_sessions():
+    return _get("sessions", lambda: SessionMemoryStore(get_llm()))
+
+
+def get_answer_cache():
+    return _get("answer_cache", lambda: AnswerCache(
+        get_embeddings(VECTORSTORE_PATH), version_fn=lambda: vectorstore_version(VECTORSTORE_PATH)
+    ))
+
+
+def get_topics():
+    return _get("topics", lambda: TopicIndex.load(VECTORSTORE_PATH))
+
+
+def reset(vectorstore_path=None):
+    """
+    Drop every shared component so the next request rebuilds them, optionally from another store.
+    """
+    global VECTORSTORE_PATH
+    with _lock:
+        if vectorstore_path is not None:
+            VECTORSTORE_PATH = vectorstore_path
+        _components.clear()
+        _status.update(ready=False, error=None, warmup_seconds=None, version=None, swapped_at=None)
+
+
+def is_loaded():
+    return "vectorstore" in _components
+
+
+def is_ready():
+    """
+    True once warmup has finished or a request has loaded the index.
+
+    With warmup off the index only loads on the first request, so the process
+    reports ready straight away instead of waiting for traffic it is not sent.
+    """
+    return _status["ready"] or is_loaded() or (not CHATBOT_WARMUP and _status["error"] is None)
+
+
+def status():
+    return {**_status, "index_loaded": is_loaded(), "ready": is_ready()}
+
+
+def _warm(vectorstore):
+    """
+    Fault in index pages and run a dummy search so the first real query is not slow.
+    """
+    dimension = None
+    for index in local_indexes(vectorstore):
+        touch_pages(index)
+        dimension = index.d
+    if dimension is None:
+        dimension = len(get_embeddings(VECTORSTORE_PATH).embed_query("warmup"))
+    vectorstore.similarity_search_with_score_by_vector(np.zeros(dimension, dtype=np.float32), k=1)
+
+
+def warmup():
+    """
+    Load the index and chat components, fault in index pages and run a dummy search.
+    """
+    started = time.monotonic()
+    try:
+        vectorstore = get_vectorstore()
+        get_retriever()
+        get_llm()
+        get_answer_llm()
+        get_sessions()
+        get_answer_cache()
+        get_topics()
+        _warm(vectorstore)
+    except Exception as e:
+        _status["error"] = str(e)
+        raise
+    _status.update(ready=True, error=None, warmup_seconds=round(time.monotonic() - started, 3))
+
+
+def refresh():
+    """
+    Swap in a newly published store version, if there is one; return True if it swapped.
+
+    The new version is loaded and warmed while requests keep using the old one,
+    then its components replace the old ones in a single step. Requests already
+    running hold their own references to the old retriever, so the old version
+    is only freed once the last of them finishes.
+    """
+    version, path = published_version(VECTORSTORE_PATH)
+    if version is None or version == _status["version"] or not is_loaded():
+        return False
+    vectorstore = load_vectorstore(path, get_embeddings(VECTORSTORE_PATH))
+    _warm(vectorstore)
+    components = {
+        "vectorstore": vectorstore,
+        "retriever": _build_retriever(vectorstore),
+        "topics": TopicIndex.load(path),
+    }
+    with _lock:
+        _components.update(components)
+        _status.update(version=version, swapped_at=time.time())
+    return True
+
+
+def _watch():
+    while True:
+        time.sleep(VECTORSTORE_WATCH_SECONDS)
+        try:
+            refresh()
+        except Exception as e:
+            _status["error"] = f"Refreshing the vector store failed: {e}"  # Keep serving the old version
+
+
+def start_watcher():
+    """
+    Poll for newly published store versions on a background thread.
+    """
+    global _watcher
+    if not VECTORSTORE_WATCH_SECONDS or _watcher is not None:
+        return _watcher
+    _watcher = threading.Thread(target=_watch, name="chatbot-vectorstore-watcher", daemon=True)
+    _watcher.start()
+    return _watcher
+
+
+def start_warmup():
+    """
+    Run ``warmup`` in a background thread so the server can start answering health checks.
+
+    Also starts the watcher that hot-swaps newly published store versions.
+    """
+    start_watcher()
+    if not CHATBOT_WARMUP:
+        return None
+    thread = threading.Thread(target=_warmup_quietly, name="chatbot-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _warmup_quietly():
+    try:
+        warmup()
+    except Exception:
+        pass  # Reported through status() and /readyz
+
+
+def _index_vectors():
+    vectorstore = _components.get("vectorstore")
+    if vectorstore is None:
+        return None
+    return sum(index.ntotal for index in local_indexes(vectorstore))
+
+
+def _index_bytes():
+    path = resolve_store_path(VECTORSTORE_PATH)
+    if not path.exists():
+        return None
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def _answer_cache_hit_rate():
+    answer_cache = _components.get("answer_cache")
+    return None if answer_cache is None else answer_cache.stats()["hit_rate"]
+
+
+def _embedding_cache_hit_rate():
+    hits = misses = 0
+    for cache in list(CachedEmbeddings.instances):
+        stats = cache.stats()
+        hits += stats["hits"]
+        misses += stats["misses"]
+    return hits / (hits + misses) if hits + misses else None
+
+
+def _active_sessions():
+    sessions = _components.get("sessions")
+    return None if sessions is None else len(sessions)
+
+
+metrics.register_gauge("chatbot_index_vectors", "Vectors in the loaded index.", _index_vectors)
+metrics.register_gauge("chatbot_index_bytes", "Size of the vector store on disk.", _index_bytes)
+metrics.register_gauge("chatbot_answer_cache_hit_rate", "Answer cache hit rate.", _answer_cache_hit_rate)
+metrics.register_gauge("chatbot_embedding_cache_hit_rate", "Embedding cache hit rate.", _embedding_cache_hit_rate)
+metrics.register_gauge("chatbot_active_sessions", "Conversation memories held in this process.", _active_sessions)
+metrics.register_gauge("chatbot_ready", "1 once the process can serve requests.", lambda: int(is_ready()))
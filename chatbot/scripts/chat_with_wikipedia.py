@@ -1,12 +1,23 @@
 import os
-from dotenv import load_dotenv
-from langchain.chains import ConversationalRetrievalChain
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from rich.console import Console
-from rich.prompt import Prompt
+import sys
+from pathlib import Path
+
+import django
+
+# Runnable as ``python chatbot/scripts/<script>.py``: put the project on the path and
+# configure Django the way manage.py does before the chatbot app is imported
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wiki_chatbot.settings")
+django.setup()
+
+from dotenv import load_dotenv  # noqa: E402
+from langchain.chains import ConversationalRetrievalChain  # noqa: E402
+from langchain_openai import ChatOpenAI  # noqa: E402
+from chatbot.embedding_cache import get_embeddings  # noqa: E402
+from chatbot.memory import DeferredSummaryBufferMemory  # noqa: E402
+from chatbot.vectorstore import load_vectorstore  # noqa: E402
+from rich.console import Console  # noqa: E402
+from rich.prompt import Prompt  # noqa: E402
 
 load_dotenv()
 
@@ -20,8 +31,8 @@ VECTORSTORE_PATH = "./wiki_embeddings"
 def load_retriever():
     """Load the FAISS retriever from the stored vector database."""
     try:
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-        vectorstore = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
+        embeddings = get_embeddings(VECTORSTORE_PATH)
+        vectorstore = load_vectorstore(VECTORSTORE_PATH, embeddings)
         return vectorstore.as_retriever()
     except FileNotFoundError:
         print(f"Vector database not found at {VECTORSTORE_PATH}. Run the embedding ingestion step first.")
@@ -36,7 +47,7 @@ def get_qa_chain():
     llm = ChatOpenAI(model_name=model_name, temperature=0, openai_api_key=OPENAI_API_KEY)
 
     retriever = load_retriever()
-    memory = ConversationSummaryBufferMemory(llm=llm, memory_key="chat_history", return_messages=True)
+    memory = DeferredSummaryBufferMemory(llm=llm, memory_key="chat_history", return_messages=True)
     return ConversationalRetrievalChain.from_llm(llm=llm, retriever=retriever, memory=memory)
 
 
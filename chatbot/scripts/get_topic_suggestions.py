@@ -1,12 +1,21 @@
 import os
-from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+import sys
+from pathlib import Path
 
-load_dotenv()
+import django
+
+# Runnable as ``python chatbot/scripts/<script>.py``: put the project on the path and
+# configure Django the way manage.py does before the chatbot app is imported
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "wiki_chatbot.settings")
+django.setup()
+
+from dotenv import load_dotenv  # noqa: E402
+from chatbot.embedding_cache import get_embeddings  # noqa: E402
+from chatbot.topics import TopicIndex  # noqa: E402
+from chatbot.vectorstore import load_vectorstore  # noqa: E402
 
-# OpenAI API key and model
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+load_dotenv()
 
 VECTORSTORE_PATH = "./wiki_embeddings"
 
@@ -36,8 +45,8 @@ def suggest_questions_from_vectorstore(query="Topics to explore", k=10):
     Returns:
         tuple: A tuple containing raw topics and cleaned topics.
     """
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    vectorstore = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
+    embeddings = get_embeddings(VECTORSTORE_PATH)
+    vectorstore = load_vectorstore(VECTORSTORE_PATH, embeddings)
     results = vectorstore.similarity_search(query, k=k)
 
     # Raw topics
@@ -53,6 +62,17 @@ def suggest_questions_from_vectorstore(query="Topics to explore", k=10):
     return raw_topics, cleaned_topics, missing_cleaned_topics
 
 
+def suggest_topics_from_index(k=10):
+    """
+    Suggests topics from the precomputed cluster index (see the build_topics command).
+    Args:
+        k (int): Number of topics to return.
+    Returns:
+        list: Representative article titles, or an empty list if no topic index was built.
+    """
+    return [topic["title"] for topic in TopicIndex.load(VECTORSTORE_PATH).suggest(k)]
+
+
 def generate_questions_from_topics(topics, max_templates=2):
     """
     Generates unique questions based on topics using predefined templates.
@@ -81,6 +101,15 @@ def main():
     """
     Main function to generate and display questions.
     """
+    indexed_topics = suggest_topics_from_index()
+    if indexed_topics:
+        print("\nTopics from the cluster index:")
+        for topic in indexed_topics:
+            print(f"- {topic}")
+        questions = generate_questions_from_topics(indexed_topics)
+        save_questions_to_file(questions)
+        return
+
     query = input("Enter a query to explore topics (default: 'Key topics in the articles'): ").strip()
     if not query:
         query = "Key topics in the articles"
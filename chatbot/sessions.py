@@ -0,0 +1,148 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import connection
+from dotenv import load_dotenv
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+from .memory import DeferredSummaryBufferMemory
+from .models import Conversation
+
+load_dotenv()
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_TOKEN_LIMIT = int(os.getenv("SESSION_TOKEN_LIMIT", "2000"))
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+SESSION_PERSIST = os.getenv("SESSION_PERSIST", "false").lower() in ("1", "true", "yes")
+
+
+class _Session:
+    def __init__(self, memory):
+        self.memory = memory
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+
+
+class SessionMemoryStore:
+    """
+    Bounded in-process store of conversation memories keyed by session id.
+
+    Each session gets its own ``DeferredSummaryBufferMemory`` capped at
+    ``token_limit`` tokens and summarized in the background. Sessions idle for
+    longer than ``idle_seconds`` expire and the least recently used ones are
+    evicted past ``max_sessions``. With ``persist`` enabled, memories are written
+    to the ``Conversation`` table after every turn and reloaded from it when a
+    session is no longer in memory.
+    """
+
+    def __init__(
+        self,
+        llm,
+        max_sessions=SESSION_MAX_SESSIONS,
+        token_limit=SESSION_TOKEN_LIMIT,
+        idle_seconds=SESSION_IDLE_SECONDS,
+        persist=SESSION_PERSIST,
+    ):
+        self.llm = llm
+        self.max_sessions = max_sessions
+        self.token_limit = token_limit
+        self.idle_seconds = idle_seconds
+        self.persist = persist
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _new_memory(self, session_id):
+        memory = DeferredSummaryBufferMemory(
+            llm=self.llm, memory_key="chat_history", return_messages=True, max_token_limit=self.token_limit,
+            on_summarized=(lambda memory: self._save_summary(session_id, memory)) if self.persist else None,
+        )
+        if self.persist:
+            conversation = Conversation.objects.filter(session_key=session_id).first()
+            if conversation is not None:
+                memory.moving_summary_buffer = conversation.summary
+                memory.chat_memory.messages = messages_from_dict(conversation.messages)
+        return memory
+
+    def _expire(self):
+        deadline = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_seen >= deadline and len(self._sessions) <= self.max_sessions:
+                break
+            del self._sessions[session_id]
+
+    def _get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                session.last_seen = time.monotonic()
+                return session
+        # Build outside the store lock; a persisted session needs a database read
+        session = _Session(self._new_memory(session_id))
+        with self._lock:
+            session = self._sessions.setdefault(session_id, session)
+            self._sessions.move_to_end(session_id)
+            self._expire()
+        return session
+
+    def _save(self, session_id, memory):
+        summary, messages = memory.snapshot()
+        Conversation.objects.update_or_create(
+            session_key=session_id,
+            defaults={"summary": summary, "messages": messages_to_dict(messages)},
+        )
+
+    def _save_summary(self, session_id, memory):
+        """
+        Persist a memory after its background summary lands; runs on a summary worker thread.
+        """
+        try:
+            self._save(session_id, memory)
+        finally:
+            connection.close()
+
+    @contextmanager
+    def checkout(self, session_id):
+        """
+        Yield the memory for ``session_id``, serializing turns within the same session.
+        """
+        session = self._get(session_id)
+        with session.lock:
+            yield session.memory
+            session.last_seen = time.monotonic()
+            if self.persist:
+                self._save(session_id, session.memory)
+
+    @asynccontextmanager
+    async def acheckout(self, session_id):
+        """
+        Async variant of ``checkout`` that waits for the session lock off the event loop.
+
+        The lock is shared with ``checkout``, so it is a thread lock acquired on a
+        worker thread. That thread cannot be interrupted: if the caller is
+        cancelled while waiting (a streaming client disconnects), the acquire
+        still completes and the lock is released as soon as it does.
+        """
+        session = await sync_to_async(self._get, thread_sensitive=False)(session_id)
+        acquire = asyncio.ensure_future(asyncio.to_thread(session.lock.acquire))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            acquire.add_done_callback(lambda _: session.lock.release())
+            raise
+        try:
+            yield session.memory
+            session.last_seen = time.monotonic()
+            if self.persist:
+                await sync_to_async(self._save)(session_id, session.memory)
+        finally:
+            session.lock.release()
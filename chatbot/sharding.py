@@ -0,0 +1,144 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import requests
+from django.db.models.functions import Mod
+from langchain.schema import Document
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.retrievers import BaseRetriever
+
+MANIFEST_FILENAME = "manifest.json"
+PARTITIONS = ("hash", "range")
+
+# Comma-separated shard-server URLs; when set, queries go to these instead of local shard directories
+VECTORSTORE_SHARD_URLS = [url for url in os.getenv("VECTORSTORE_SHARD_URLS", "").split(",") if url]
+
+
+def shard_path(path, shard):
+    return Path(path) / f"shard-{shard:03d}"
+
+
+def read_manifest(path):
+    manifest_path = Path(path) / MANIFEST_FILENAME
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    """
+    Atomically replace the manifest; serving processes use its mtime as the store version.
+    """
+    manifest_path = Path(path) / MANIFEST_FILENAME
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def create_manifest(shards, partition, min_id, max_id):
+    """
+    Describe how article ids map to ``shards`` shards.
+
+    Range partitioning splits the current id span evenly; ids outside it fall
+    into the first or last shard.
+    """
+    manifest = {"shards": shards, "partition": partition}
+    if partition == "range":
+        step = -(-(max_id - min_id + 1) // shards)
+        manifest["boundaries"] = [min_id + step * shard for shard in range(1, shards)]
+    return manifest
+
+
+def filter_shard(queryset, field, manifest, shard):
+    """
+    Restrict ``queryset`` to rows whose article id ``field`` belongs to ``shard``.
+    """
+    if manifest["partition"] == "hash":
+        return queryset.alias(_shard=Mod(field, manifest["shards"])).filter(_shard=shard)
+    boundaries = manifest["boundaries"]
+    if shard > 0:
+        queryset = queryset.filter(**{f"{field}__gte": boundaries[shard - 1]})
+    if shard < len(boundaries):
+        queryset = queryset.filter(**{f"{field}__lt": boundaries[shard]})
+    return queryset
+
+
+class LocalShard:
+    def __init__(self, vectorstore):
+        self.vectorstore = vectorstore
+
+    def search(self, vector, k):
+        return self.vectorstore.similarity_search_with_score_by_vector(vector, k=k)
+
+
+class RemoteShard:
+    """
+    Client for a ``serve_shard`` process.
+    """
+
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip("/")
+        self.session = requests.Session()
+        self.timeout = timeout
+
+    def search(self, vector, k):
+        response = self.session.post(
+            f"{self.url}/search", json={"vector": np.asarray(vector).tolist(), "k": k}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return [
+            (Document(page_content=hit["page_content"], metadata=hit["metadata"]), hit["score"])
+            for hit in response.json()["results"]
+        ]
+
+
+class ShardedVectorStore:
+    """
+    Scatter a query over all shards in parallel and gather the global top-k by L2 distance.
+    """
+
+    def __init__(self, shards, embeddings):
+        self.shards = shards
+        self.embeddings = embeddings
+        self._executor = ThreadPoolExecutor(max_workers=len(shards), thread_name_prefix="shard")
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, **kwargs):
+        vector = np.asarray(embedding, dtype=np.float32)
+        futures = [self._executor.submit(shard.search, vector, k) for shard in self.shards]
+        hits = [hit for future in futures for hit in future.result()]
+        return sorted(hits, key=lambda hit: hit[1])[:k]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embeddings.embed_query(query), k=k)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [document for document, _ in self.similarity_search_with_score(query, k=k)]
+
+    def as_retriever(self, **kwargs):
+        search_kwargs = kwargs.get("search_kwargs", {})
+        return ShardedRetriever(vectorstore=self, k=search_kwargs.get("k", 4))
+
+
+class ShardedRetriever(BaseRetriever):
+    vectorstore: Any
+    k: int = 4
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun):
+        return self.vectorstore.similarity_search(query, k=self.k)
+
+
+def load_sharded_vectorstore(path, embeddings, load_shard):
+    """
+    Open every shard listed in the manifest at ``path``, or the configured shard servers.
+    """
+    if VECTORSTORE_SHARD_URLS:
+        return ShardedVectorStore([RemoteShard(url) for url in VECTORSTORE_SHARD_URLS], embeddings)
+    manifest = read_manifest(path)
+    shards = [LocalShard(load_shard(shard_path(path, shard))) for shard in range(manifest["shards"])]
+    return ShardedVectorStore(shards, embeddings)
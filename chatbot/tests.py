@@ -1,3 +1,1064 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Value
+from django.db.models.functions import Concat
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from langchain_core.documents import Document
+
+from . import metrics, runtime
+from .answer_cache import AnswerCache
+from .batching import BatchingEmbeddings
+from .chunking import SPLITTERS, chunk_text, iter_chunk_spans, make_splitter, split_spans
+from .context import ContextAssemblingRetriever, assemble_context, count_tokens, pack_documents
+from .embedding_cache import get_embeddings
+from .faiss_index import build_index, index_params
+from .fakes import FakeChatModel, FakeEmbeddings
+from .lexical import FTS_TABLE, HybridRetriever, build_retriever, search, title_matches
+from .management.commands.ingest_embeddings import Command
+from .memory import DeferredSummaryBufferMemory
+from .models import Article, ArticleChunk, VectorStore
+from .ratelimit import RateLimiter, backoff_delay, retry_after
+from .sessions import SessionMemoryStore
+from .textstore import free_fraction, reclaim_space
+from .vectorstore import (
+    COMPACT_DTYPES, VECTORS_FILENAME, CompactFlatIndex, MmapFlatIndex, load_vectorstore, write_compact_vectors,
+)
+from .versions import published_version, read_store_key, staging_version
+
+
+def _paragraphs(title, count=3):
+    """
+    Return ``count`` blank-line separated paragraphs that share no words with other titles.
+    """
+    return "\n\n".join(
+        " ".join(f"{title.lower()}{paragraph}w{word}" for word in range(40)) for paragraph in range(count)
+    )
+
+
+class IngestTestCase(TestCase):
+    """
+    Runs ``ingest_embeddings`` against fake embeddings in a scratch directory.
+    """
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        env = mock.patch.dict(os.environ, {
+            "CHATBOT_FAKE_BACKENDS": "1",
+            "FAKE_EMBEDDING_DIMENSION": "32",
+            "EMBEDDING_CACHE_PATH": os.path.join(self.tmp, "embedding_cache.sqlite3"),
+        })
+        env.start()
+        self.addCleanup(env.stop)
+
+    def store_path(self, name="store"):
+        return os.path.join(self.tmp, name)
+
+    def add_article(self, title, text=None):
+        article = Article(title=title, url=f"https://simple.wikipedia.org/wiki/{title}")
+        article.text = _paragraphs(title) if text is None else text
+        article.save()
+        return article
+
+    def ingest(self, path=None, **options):
+        stdout = StringIO()
+        options = {"limit": 1000, "chunk_workers": 0, **options}
+        call_command("ingest_embeddings", path=path or self.store_path(), stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def index_ids(self, path=None):
+        """
+        Return the vector ids in the published index at ``path``.
+        """
+        vectorstore = load_vectorstore(
+            published_version(path or self.store_path())[1], FakeEmbeddings(dimension=32), mode="pickle"
+        )
+        return set(vectorstore.index_to_docstore_id.values())
+
+    def chunk_ids(self, path=None):
+        key = read_store_key(path or self.store_path())
+        return set(ArticleChunk.objects.filter(store__key=key, retired_in="").values_list("vector_id", flat=True))
+
+
+class IncrementalIngestTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.articles = [self.add_article(title) for title in ("August", "Moon", "River")]
+
+    def test_unchanged_articles_are_skipped(self):
+        self.ingest()
+        output = self.ingest()
+        self.assertIn("skipped 3 unchanged articles", output)
+        self.assertIn("Nothing changed", output)
+
+    def test_edited_article_is_reembedded(self):
+        self.ingest()
+        before = self.chunk_ids()
+        article = self.articles[0]
+        article.text = _paragraphs("September")
+        article.save()
+
+        self.ingest()
+        after = self.chunk_ids()
+        self.assertEqual(after, self.index_ids())
+        self.assertTrue(before - after)
+        chunk = ArticleChunk.objects.filter(article_id=article.id).first()
+        self.assertEqual(chunk.article_hash, Article.objects.get(pk=article.pk).content_hash)
+
+    def test_deleted_article_is_removed(self):
+        self.ingest()
+        article_id = self.articles[1].id
+        self.articles[1].delete()
+        self.ingest()
+        # The rows stay, retired, for servers still on the previous version
+        chunks = ArticleChunk.objects.filter(article_id=article_id)
+        self.assertFalse(chunks.filter(retired_in="").exists())
+        self.assertEqual(set(chunks.values_list("retired_in", flat=True)), {published_version(self.store_path())[0]})
+        self.assertEqual(self.chunk_ids(), self.index_ids())
+
+    def test_stores_keep_separate_chunk_rows(self):
+        first, second = self.store_path("first"), self.store_path("second")
+        self.ingest(first)
+        self.ingest(second)
+        self.assertNotEqual(read_store_key(first), read_store_key(second))
+        self.assertEqual(self.chunk_ids(first), self.index_ids(first))
+        self.assertEqual(self.chunk_ids(second), self.index_ids(second))
+
+        with mock.patch("builtins.input", return_value="yes"):
+            self.ingest(second, delete=True)
+        self.assertFalse(os.path.exists(second))
+        self.assertEqual(VectorStore.objects.count(), 1)
+        self.assertEqual(self.chunk_ids(first), self.index_ids(first))
+
+    def test_unkeyed_store_adopts_migrated_rows(self):
+        self.ingest()
+        store = VectorStore.objects.get()
+        store.key = "default"
+        store.save()
+        os.remove(os.path.join(self.store_path(), "store_key"))
+
+        output = self.ingest()
+        self.assertIn("Nothing changed", output)
+        self.assertEqual(VectorStore.objects.get().key, read_store_key(self.store_path()))
+
+
+class NearDuplicateTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.original = self.add_article("Original", _paragraphs("Shared"))
+        self.copy = self.add_article("Copy", _paragraphs("Shared"))
+
+    def copy_chunks(self):
+        return ArticleChunk.objects.filter(article_id=self.copy.id, field="text", retired_in="")
+
+    def assert_copy_readmitted(self):
+        self.assertFalse(self.copy_chunks().filter(duplicate_of__isnull=False).exists())
+        self.assertLessEqual(set(self.copy_chunks().values_list("vector_id", flat=True)), self.index_ids())
+        self.assertEqual(self.chunk_ids(), self.index_ids())
+
+    def test_duplicates_are_recorded_against_their_representative(self):
+        self.ingest(dedup=True)
+        representatives = set(
+            ArticleChunk.objects.filter(article_id=self.original.id).values_list("vector_id", flat=True)
+        )
+        duplicate_of = set(self.copy_chunks().values_list("duplicate_of", flat=True))
+        self.assertTrue(duplicate_of)
+        self.assertLessEqual(duplicate_of, representatives)
+        self.assertFalse(set(self.copy_chunks().values_list("vector_id", flat=True)) & self.index_ids())
+        self.assertIn("skipped 2 unchanged articles", self.ingest(dedup=True))
+
+    def test_deleted_representative_readmits_duplicates(self):
+        self.ingest(dedup=True)
+        self.original.delete()
+        self.ingest(dedup=True)
+        self.assert_copy_readmitted()
+
+    def test_edited_representative_readmits_duplicates(self):
+        self.ingest(dedup=True)
+        duplicates = self.copy_chunks().count()
+        self.original.text = _paragraphs("Rewritten")
+        self.original.save()
+        output = self.ingest(dedup=True)
+        self.assertIn(f"re-embedded {duplicates} whose near-duplicate was removed", output)
+        self.assert_copy_readmitted()
+
+
+class AppendOnlyIndexTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.articles = [self.add_article(title) for title in ("August", "Moon")]
+        self.ingest(index_type="hnsw")
+
+    def test_new_articles_are_appended(self):
+        self.add_article("River")
+        self.ingest()
+        self.assertEqual(self.chunk_ids(), self.index_ids())
+
+    def test_deleted_article_fails_before_embedding(self):
+        published, version = self.chunk_ids(), published_version(self.store_path())[0]
+        self.add_article("River")
+        self.articles[0].delete()
+        with mock.patch.object(Command, "_embed_batch") as embed_batch:
+            with self.assertRaisesMessage(CommandError, "use --delete to rebuild it"):
+                self.ingest()
+        embed_batch.assert_not_called()
+        self.assertEqual(published_version(self.store_path())[0], version)
+        self.assertEqual(self.chunk_ids(), published)
+
+
+class IndexParamsTests(SimpleTestCase):
+    def test_ivf_probes_a_sixteenth_of_its_lists(self):
+        params = index_params("ivf-flat", n_train=39 * 1024, nlist=1024)
+        self.assertEqual(params["nprobe"], 64)
+        self.assertEqual(build_index("ivf-flat", 32, params).nprobe, 64)
+        self.assertEqual(index_params("ivf-pq", n_train=39 * 4, nlist=1024)["nprobe"], 4)
+        self.assertEqual(index_params("ivf-flat", n_train=39 * 1024, nprobe=2)["nprobe"], 2)
+
+
+class ShardServerTests(IngestTestCase):
+    def test_shard_server_loads_its_local_store(self):
+        self.add_article("August")
+        self.ingest()
+        with mock.patch("chatbot.sharding.VECTORSTORE_SHARD_URLS", ["http://127.0.0.1:8101"]):
+            vectorstore = load_vectorstore(
+                self.store_path(), FakeEmbeddings(dimension=32), mode="pickle", sharded=False
+            )
+        self.assertEqual(set(vectorstore.index_to_docstore_id.values()), self.chunk_ids())
+
+
+class LexicalSearchTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.articles = [self.add_article(title) for title in ("August", "Moon", "River")]
+        self.ingest()
+        self.embeddings = FakeEmbeddings(dimension=32)
+        vectorstore = load_vectorstore(published_version(self.store_path())[1], self.embeddings, mode="pickle")
+        self.retriever = build_retriever(vectorstore, store=read_store_key(self.store_path()))
+
+    def test_index_holds_no_copy_of_the_text(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT title, body FROM {FTS_TABLE}")
+            rows = cursor.fetchall()
+        self.assertTrue(rows)
+        self.assertEqual(set(rows), {(None, None)})
+
+    def test_deleted_chunks_stop_matching(self):
+        self.assertTrue(search("moon0w1"))
+        self.articles[1].delete()
+        self.ingest()
+        self.assertEqual(search("moon0w1"), [])
+
+    def test_chunks_without_rows_are_dropped(self):
+        # An ingest run dropped Moon's rows after this index was loaded
+        ArticleChunk.objects.filter(article_id=self.articles[1].id).delete()
+        vectorstore = self.retriever.vectorstore
+        with mock.patch("chatbot.lexical.RETRIEVER_MODE", "vector"):
+            retrievers = [self.retriever, build_retriever(vectorstore, k=20)]
+        for retriever in retrievers:
+            documents = retriever.invoke("moon0w1")
+            self.assertTrue(documents)
+            self.assertTrue(all(document.page_content for document in documents))
+            self.assertNotIn("Moon", {document.metadata["title"] for document in documents})
+
+    def test_title_question_is_answered_without_embedding(self):
+        self.assertIsInstance(self.retriever, HybridRetriever)
+        self.assertIs(self.retriever.docstore, self.retriever.vectorstore.docstore)
+        documents = self.retriever.invoke("What is August?")
+        self.assertTrue(documents)
+        self.assertEqual({document.metadata["title"] for document in documents}, {"August"})
+        self.assertEqual(self.embeddings.calls, 0)
+
+    def test_title_matches_its_own_article_among_many_sharing_its_words(self):
+        for i in range(5):
+            self.add_article(f"August {i}", _paragraphs("August"))
+        self.ingest()
+        documents = self.retriever.invoke("Tell me about AUGUST")
+        self.assertTrue(documents)
+        self.assertEqual({document.metadata["title"] for document in documents}, {"August"})
+
+    def test_title_is_looked_up_once_per_request(self):
+        chain = mock.Mock()
+        chain.invoke.return_value = {"answer": "A month."}
+        with mock.patch.object(runtime, "get_retriever", return_value=self.retriever), \
+                mock.patch.object(runtime, "get_answer_cache", return_value=AnswerCache(self.embeddings)), \
+                mock.patch.object(runtime, "get_sessions", return_value=SessionMemoryStore(FakeChatModel())), \
+                mock.patch.object(runtime, "get_llm"), \
+                mock.patch("chatbot.views.ConversationalRetrievalChain.from_llm", return_value=chain), \
+                mock.patch("chatbot.lexical.title_matches", wraps=title_matches) as lookup:
+            self.client.post("/chatbot/", {"question": "What is August?"})
+            config = chain.invoke.call_args.kwargs["config"]
+            documents = self.retriever.invoke("What is August?", config=config)
+        self.assertEqual(lookup.call_count, 1)
+        self.assertEqual({document.metadata["title"] for document in documents}, {"August"})
+
+    def test_title_question_skips_the_semantic_answer_cache(self):
+        cache = AnswerCache(self.embeddings)
+        chain = mock.Mock()
+        chain.invoke.return_value = {"answer": "A month."}
+        with mock.patch.object(runtime, "get_retriever", return_value=self.retriever), \
+                mock.patch.object(runtime, "get_answer_cache", return_value=cache), \
+                mock.patch.object(runtime, "get_sessions", return_value=SessionMemoryStore(FakeChatModel())), \
+                mock.patch.object(runtime, "get_llm"), \
+                mock.patch("chatbot.views.ConversationalRetrievalChain.from_llm", return_value=chain):
+            response = self.client.post("/chatbot/", {"question": "What is August?"})
+        self.assertEqual(response.json()["answer"], "A month.")
+        self.assertEqual(self.embeddings.calls, 0)
+        self.assertEqual(cache.get("what is august"), "A month.")
+
+
+class ChunkingTests(SimpleTestCase):
+    def test_spans_read_back_overlapping_and_repeated_chunks(self):
+        text = "\n\n".join(["The same paragraph repeats here."] * 3 + [_paragraphs("August", count=6)])
+        for name, size, overlap in (("character", 120, 20), ("paragraph", 120, 20), ("token", 30, 5)):
+            splitter = make_splitter(name, chunk_size=size, chunk_overlap=overlap)
+            spans = split_spans(splitter, text)
+            self.assertEqual(
+                [text[start:start + length] for start, length in spans],
+                [chunk.strip() for chunk in splitter.split_text(text) if chunk.strip()],
+            )
+
+    def test_irregular_blank_lines_round_trip(self):
+        paragraphs = _paragraphs("August", count=8).split("\n\n")
+        separators = ["\n\n\n", " \n\n", "\n\n\n\n", "\n\n ", "\n \n\n", "\n\n", "\n\n\n"]
+        text = "\n\n" + paragraphs[0] + "".join(sep + p for sep, p in zip(separators, paragraphs[1:])) + "\n\n\n"
+        for name in SPLITTERS:
+            splitter = make_splitter(name, chunk_size=SPLITTERS[name][0] // 3, chunk_overlap=SPLITTERS[name][1] // 3)
+            spans = split_spans(splitter, text)
+            chunks = [text[start:start + length] for start, length in spans]
+            self.assertEqual(chunks, [chunk.strip() for chunk in splitter.split_text(text) if chunk.strip()], name)
+            self.assertTrue(all(chunk and chunk == chunk.strip() for chunk in chunks), name)
+            # Every word of the article lands in some chunk
+            self.assertEqual(set(" ".join(chunks).split()), set(text.split()), name)
+
+    def test_small_windows_are_chunked_in_process(self):
+        article = mock.Mock(title="August", text=_paragraphs("August"))
+        with mock.patch("chatbot.chunking.ProcessPoolExecutor") as executor:
+            results = list(iter_chunk_spans([article] * 3, workers=4, min_parallel_chars=10 ** 6))
+        executor.assert_not_called()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(chunk_text(article, *results[0][1][0]), "August")
+
+
+def _chunk(article_id, start, text, vector_id, field="text"):
+    return Document(
+        page_content=text,
+        metadata={"article_id": article_id, "field": field, "start": start, "vector_id": vector_id, "title": "T"},
+    )
+
+
+class ContextAssemblyTests(SimpleTestCase):
+    def setUp(self):
+        # Count word and punctuation tokens rather than loading a tokenizer
+        patcher = mock.patch("chatbot.context._encoding", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def words(self, prefix, count):
+        return " ".join(f"{prefix}{i}" for i in range(count))
+
+    def test_adjacent_chunks_merge_and_duplicates_drop(self):
+        first, second = self.words("a", 20), self.words("b", 20)
+        documents = [
+            _chunk(1, len(first) + 2, second, "v2"),
+            _chunk(2, 0, f"{first}\n\n{second}", "v3"),  # The same text in another article
+            Document(page_content="", metadata={"vector_id": "v4", "missing": True}),
+            _chunk(1, 0, first, "v1"),
+            _chunk(1, 0, "Title", "v5", field="title"),
+            _chunk(3, 0, self.words("c", 20), "v6"),
+        ]
+        context = assemble_context(documents, token_budget=1000)
+        self.assertEqual([document.metadata["vector_ids"] for document in context], [["v1", "v2"], ["v6"]])
+        self.assertEqual(context[0].page_content, f"{first}\n\n{second}")
+
+    def test_context_is_packed_into_the_token_budget(self):
+        documents = [_chunk(i, 0, self.words(f"w{i}x", 100), f"v{i}") for i in range(4)]
+        retriever = ContextAssemblingRetriever(retriever=mock.Mock(), token_budget=280, duplicate_threshold=1.1)
+        retriever.retriever.invoke.return_value = documents
+        context = retriever.invoke("question")
+        self.assertEqual([document.metadata["article_id"] for document in context], [0, 1, 2])
+        self.assertEqual([count_tokens(document.page_content) for document in context], [100, 100, 80])
+        self.assertTrue(context[2].metadata["truncated"])
+        # Too little room left to be worth truncating into
+        self.assertEqual(len(pack_documents(documents, token_budget=250)[0]), 2)
+
+
+class CompactVectorTests(IngestTestCase):
+    def test_compact_dtype_needs_mmap_mode(self):
+        self.add_article("August")
+        with self.assertRaisesMessage(CommandError, "needs --store-mode mmap"):
+            self.ingest(vector_dtype="int8", store_mode="pickle")
+        self.ingest(vector_dtype="int8", store_mode="mmap")
+        path = published_version(self.store_path())[1]
+        self.assertTrue((path / VECTORS_FILENAME).exists())
+        with mock.patch("chatbot.vectorstore.VECTORSTORE_DTYPE", "int8"):
+            with self.assertRaisesMessage(ValueError, "needs VECTORSTORE_MODE=mmap"):
+                load_vectorstore(path, FakeEmbeddings(dimension=32), mode="pickle")
+            vectorstore = load_vectorstore(path, FakeEmbeddings(dimension=32), mode="mmap")
+        self.assertIsInstance(vectorstore.index, CompactFlatIndex)
+        self.assertTrue(vectorstore.index.rerank)
+
+    def test_pickle_store_has_no_vector_copies(self):
+        self.add_article("August")
+        self.ingest(store_mode="mmap")
+        self.add_article("April")
+        self.ingest(store_mode="pickle")
+        path = published_version(self.store_path())[1]
+        self.assertFalse((path / VECTORS_FILENAME).exists())
+        self.assertFalse([name for name in os.listdir(path) if name.startswith("vectors_")])
+        vectorstore = load_vectorstore(path, FakeEmbeddings(dimension=32), mode="mmap")
+        self.assertEqual(vectorstore.index.ntotal, len(self.index_ids()))
+
+    def test_compact_search_matches_exact_search(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((500, 32)).astype(np.float32)
+        np.save(os.path.join(self.tmp, VECTORS_FILENAME), vectors)
+        queries = vectors[:10] + 0.01
+        _, expected = MmapFlatIndex(os.path.join(self.tmp, VECTORS_FILENAME)).search(queries, 5)
+        for dtype in COMPACT_DTYPES:
+            write_compact_vectors(self.tmp, vectors, dtype)
+            index = CompactFlatIndex(self.tmp, dtype)
+            self.assertEqual(index.codes.code_size, {"float16": 64, "int8": 32}[dtype])
+            _, ids = index.search(queries, 5)
+            np.testing.assert_array_equal(ids, expected)
+
+
+class TextCompactionTests(TransactionTestCase):
+    def test_delete_reclaims_text_blocks(self):
+        rng = np.random.default_rng(0)
+        for i in range(20):
+            article = Article(title=f"Article {i}", url=f"https://simple.wikipedia.org/wiki/{i}")
+            # Random letters barely compress, so the blocks take real pages
+            article.text = "".join(rng.choice(list("abcdefghij "), size=50000))
+            article.save()
+        self.assertEqual(free_fraction(), 0)
+
+        stdout = StringIO()
+        call_command("load_wikipedia_articles", delete=True, stdout=stdout)
+        self.assertIn("Reclaimed", stdout.getvalue())
+        self.assertEqual(free_fraction(), 0)
+        self.assertEqual(reclaim_space(), 0)
+
+
+class LoadArticlesTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def load(self, rows):
+        with open(os.path.join(self.path, "train.jsonl"), "w") as file:
+            for row in rows:
+                file.write(json.dumps(row) + "\n")
+        stdout = StringIO()
+        call_command("load_wikipedia_articles", dataset_path=self.path, limit=0, workers=1, stdout=stdout)
+        return stdout.getvalue()
+
+    def row(self, title, text):
+        return {"id": title, "title": title, "url": f"https://simple.wikipedia.org/wiki/{title}", "text": text}
+
+    def test_reload_upserts_in_place(self):
+        self.load([self.row("August", "August is the eighth month."), self.row("April", "April is the fourth month.")])
+        ids = dict(Article.objects.values_list("title", "id"))
+        hashes = dict(Article.objects.values_list("title", "content_hash"))
+
+        self.load([self.row("August", "August has 31 days."), self.row("April", "April is the fourth month.")])
+        self.assertEqual(dict(Article.objects.values_list("title", "id")), ids)
+        self.assertEqual(Article.objects.get(title="August").text, "August has 31 days.")
+        self.assertNotEqual(Article.objects.get(title="August").content_hash, hashes["August"])
+        self.assertEqual(Article.objects.get(title="April").content_hash, hashes["April"])
+
+    def test_malformed_rows_are_skipped_and_counted(self):
+        output = self.load([
+            self.row("August", "August is the eighth month."),
+            {"id": "2", "title": None, "url": "https://simple.wikipedia.org/wiki/2", "text": "No title."},
+            {"id": "3", "title": "No text", "url": "https://simple.wikipedia.org/wiki/3", "text": None},
+            self.row("April", "April is the fourth month."),
+        ])
+        self.assertEqual(sorted(Article.objects.values_list("title", flat=True)), ["April", "August"])
+        self.assertIn("Successfully saved 2 articles.", output)
+        self.assertIn("Skipped 2 rows missing a title or text.", output)
+
+
+class ContentHashBackfillTests(TestCase):
+    def test_backfills_missing_hashes(self):
+        article = Article(title="August", url="https://simple.wikipedia.org/wiki/August")
+        article.text = "August is the eighth month."
+        article.save()
+        Article.objects.filter(pk=article.pk).update(content_hash="")
+
+        migration = importlib.import_module("chatbot.migrations.0010_backfill_article_content_hash")
+        migration.backfill_content_hash(apps, None)
+        self.assertEqual(Article.objects.get(pk=article.pk).content_hash, article.compute_content_hash())
+
+
+class VersionedIngestTests(IngestTestCase):
+    def setUp(self):
+        super().setUp()
+        self.articles = [self.add_article(title) for title in ("August", "Moon", "River", "Snow")]
+        self.ingest()
+
+    def edit(self, article, title):
+        article.text = _paragraphs(title)
+        article.save()
+
+    def assert_mapping_matches_index(self):
+        self.assertEqual(self.chunk_ids(), self.index_ids())
+
+    def test_failed_run_leaves_published_mapping(self):
+        published = self.chunk_ids()
+        self.edit(self.articles[0], "September")
+        with mock.patch(
+            "chatbot.management.commands.ingest_embeddings.Command._apply_segment", side_effect=RuntimeError("crash")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.ingest()
+        self.assertEqual(self.chunk_ids(), published)
+        self.assert_mapping_matches_index()
+
+        self.ingest()
+        self.assert_mapping_matches_index()
+        self.assertNotEqual(self.chunk_ids(), published)
+        chunks = ArticleChunk.objects.filter(article_id=self.articles[0].id, retired_in="")
+        hashes = set(chunks.values_list("article_hash", flat=True))
+        self.assertEqual(hashes, {Article.objects.get(pk=self.articles[0].pk).content_hash})
+
+    def test_rows_are_recorded_before_publishing_and_retired_after(self):
+        published = self.index_ids()
+        self.edit(self.articles[0], "September")
+        with mock.patch(
+            "chatbot.management.commands.ingest_embeddings.publish_version", side_effect=RuntimeError("crash")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.ingest()
+        staged = staging_version(self.store_path())
+        # Servers on the published version still resolve every vector, and the new one's rows are in place
+        rows = set(ArticleChunk.objects.values_list("vector_id", flat=True))
+        self.assertLessEqual(published, rows)
+        self.assertLessEqual(self.chunk_ids(), rows)
+        self.assertEqual(VectorStore.objects.get().version, staged.name)
+
+        output = self.ingest()
+        self.assertIn(f"Publishing version {staged.name}", output)
+        self.assertEqual(published_version(self.store_path())[0], staged.name)
+        self.assert_mapping_matches_index()
+        retired = ArticleChunk.objects.exclude(retired_in="")
+        self.assertEqual(set(retired.values_list("retired_in", flat=True)), {staged.name})
+        self.assertEqual(set(retired.values_list("vector_id", flat=True)), published - self.index_ids())
+
+        for title in ("October", "November", "December"):
+            self.edit(self.articles[0], title)
+            self.ingest(keep_versions=2)
+        # Only versions no older than the one that retired a row can still read it
+        oldest = sorted(os.listdir(os.path.join(self.store_path(), "versions")))[0]
+        self.assertFalse(ArticleChunk.objects.exclude(retired_in="").filter(retired_in__lte=oldest).exists())
+        self.assertTrue(ArticleChunk.objects.exclude(retired_in="").exists())
+
+    def test_journal_of_published_version_is_applied_by_next_run(self):
+        # Runs from before mappings were recorded ahead of publishing could stop right after publishing
+        self.edit(self.articles[1], "Star")
+        with mock.patch("chatbot.management.commands.ingest_embeddings.Command._apply_journal"):
+            self.ingest()
+
+        output = self.ingest()
+        self.assertIn("Applying the chunk mapping", output)
+        self.assertIn("Nothing changed", output)
+        self.assert_mapping_matches_index()
+        self.assertEqual(VectorStore.objects.get().version, published_version(self.store_path())[0])
+
+    def test_resume_after_failed_batch(self):
+        for article, title in zip(self.articles, ("Sun", "Rain", "Wind", "Cloud")):
+            self.edit(article, title)
+        embed_batch = Command._embed_batch
+        calls = []
+
+        def flaky_embed_batch(command, batch, vectorstore):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise CommandError("api down")
+            return embed_batch(command, batch, vectorstore)
+
+        with mock.patch.object(Command, "_embed_batch", flaky_embed_batch):
+            with self.assertRaises(CommandError):
+                self.ingest(batch_size=2, checkpoint_every=1)
+        self.assert_mapping_matches_index()
+
+        output = self.ingest(batch_size=2, checkpoint_every=1, resume=True)
+        self.assertIn("Resuming after article id", output)
+        self.assert_mapping_matches_index()
+        self.assertEqual(
+            set(ArticleChunk.objects.filter(retired_in="").values_list("article_hash", flat=True)),
+            set(Article.objects.values_list("content_hash", flat=True)),
+        )
+
+    def test_topics_are_published_as_a_new_version(self):
+        version, path = published_version(self.store_path())
+        self.edit(self.articles[0], "September")
+        with mock.patch(
+            "chatbot.management.commands.ingest_embeddings.Command._apply_journal", side_effect=RuntimeError("crash")
+        ):
+            with self.assertRaises(RuntimeError):
+                self.ingest()
+        staging = staging_version(self.store_path())
+
+        call_command("build_topics", path=self.store_path(), clusters=2, stdout=StringIO())
+        topics_version, topics_path = published_version(self.store_path())
+        self.assertNotEqual(topics_version, version)
+        self.assertFalse((path / "topics.json").exists())
+        self.assertTrue((topics_path / "topics.json").exists())
+        self.assertEqual(VectorStore.objects.get().version, topics_version)
+        self.assertEqual(staging_version(self.store_path()), staging)
+        self.assertTrue((staging / "topics.json").exists())
+
+        self.ingest(resume=True)
+        self.assert_mapping_matches_index()
+        self.assertTrue((published_version(self.store_path())[1] / "topics.json").exists())
+
+    def test_rows_without_vectors_are_reembedded(self):
+        ArticleChunk.objects.filter(article_id=self.articles[2].id).update(vector_id=Concat("vector_id", Value("-lost")))
+        self.ingest()
+        self.assert_mapping_matches_index()
+        self.assertTrue(ArticleChunk.objects.filter(article_id=self.articles[2].id).exists())
+
+
+class BarrierEmbeddings(FakeEmbeddings):
+    """
+    Fake embeddings whose calls block until ``parties`` of them are in flight at once.
+    """
+
+    def __init__(self, parties):
+        super().__init__(dimension=32)
+        self.barrier = None
+        self.parties = parties
+
+    def embed_documents(self, texts):
+        if self.barrier is not None:
+            self.barrier.wait()
+        return super().embed_documents(texts)
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    """
+    Fake embeddings that record the texts of every ``embed_documents`` call and can be made to fail.
+    """
+
+    def __init__(self, error=None):
+        super().__init__(dimension=32)
+        self.batches = []
+        self.error = error
+
+    def embed_documents(self, texts):
+        self.batches.append(list(texts))
+        if self.error is not None:
+            raise self.error
+        return super().embed_documents(texts)
+
+
+class BatchingEmbeddingsTests(SimpleTestCase):
+    def embed_concurrently(self, embedder, texts):
+        results, errors = {}, {}
+
+        def embed(text):
+            try:
+                results[text] = embedder.embed_query(text)
+            except Exception as e:
+                errors[text] = e
+
+        threads = [threading.Thread(target=embed, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        return results, errors
+
+    def test_concurrent_queries_are_split_into_batches(self):
+        endpoint = RecordingEmbeddings()
+        embedder = BatchingEmbeddings(endpoint, window=0.2, max_batch=2)
+        self.addCleanup(embedder.close)
+        texts = [f"question {i}" for i in range(5)] + ["question 0"]
+        results, errors = self.embed_concurrently(embedder, texts)
+        self.assertEqual(errors, {})
+        self.assertEqual(results, {text: FakeEmbeddings(dimension=32).embed_query(text) for text in texts})
+        self.assertTrue(all(len(batch) <= 2 for batch in endpoint.batches))
+        self.assertEqual({text for batch in endpoint.batches for text in batch}, set(texts))
+        self.assertLess(len(endpoint.batches), len(texts))
+
+    def test_failed_batch_fails_every_waiter(self):
+        endpoint = RecordingEmbeddings(error=ConnectionError("api down"))
+        embedder = BatchingEmbeddings(endpoint, window=0.2)
+        self.addCleanup(embedder.close)
+        results, errors = self.embed_concurrently(embedder, [f"question {i}" for i in range(4)])
+        self.assertEqual(results, {})
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(all(isinstance(error, ConnectionError) for error in errors.values()))
+
+    def test_close_sends_queued_queries_and_rejects_later_ones(self):
+        endpoint = RecordingEmbeddings()
+        embedder = BatchingEmbeddings(endpoint, window=5)
+        waiter = threading.Thread(target=embedder.embed_query, args=("queued",))
+        waiter.start()
+        time.sleep(0.1)  # Let the dispatcher pick the query up and start waiting out its window
+        embedder.close()
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(endpoint.batches, [["queued"]])
+        self.assertFalse(embedder._dispatcher.is_alive())
+        with self.assertRaises(RuntimeError):
+            embedder.embed_query("late")
+
+    def test_batching_is_opt_in(self):
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {"CHATBOT_FAKE_BACKENDS": "1"}):
+            embeddings = get_embeddings(os.path.join(tmp, "store"))
+        self.assertNotIsInstance(embeddings.embedder, BatchingEmbeddings)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def test_exact_and_similar_questions_hit(self):
+        cache = AnswerCache(FakeEmbeddings(dimension=32), similarity_threshold=0.8)
+        cache.set("What is August?", "A month.")
+        self.assertEqual(cache.get("what is august"), "A month.")
+        self.assertEqual(cache.get("What is August, exactly?"), "A month.")
+        self.assertIsNone(cache.get("Who was Napoleon?"))
+        self.assertEqual(cache.stats()["hits"], 2)
+
+    def test_new_store_version_clears_cache(self):
+        version = ["a"]
+        cache = AnswerCache(FakeEmbeddings(dimension=32), version_fn=lambda: version[0])
+        cache.set("What is August?", "A month.")
+        version[0] = "b"
+        self.assertIsNone(cache.get("What is August?"))
+
+    def test_concurrent_misses_embed_outside_the_lock(self):
+        embeddings = BarrierEmbeddings(parties=4)
+        cache = AnswerCache(embeddings)
+        cache.set("What is August?", "A month.")
+        embeddings.barrier = threading.Barrier(4, timeout=5)
+        errors = []
+
+        def ask(question):
+            try:
+                cache.get(question)
+            except threading.BrokenBarrierError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=ask, args=(f"Question {i}?",)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(cache.stats()["misses"], 4)
+
+
+class ChatViewCacheTests(TestCase):
+    def setUp(self):
+        self.answer_cache = mock.Mock()
+        self.answer_cache.get.return_value = "Cached answer."
+        chain = mock.Mock()
+        chain.invoke.return_value = {"answer": "Fresh answer."}
+        sessions = SessionMemoryStore(FakeChatModel())
+        for patcher in (
+            mock.patch.object(runtime, "get_answer_cache", return_value=self.answer_cache),
+            mock.patch.object(runtime, "get_sessions", return_value=sessions),
+            mock.patch.object(runtime, "get_llm"),
+            mock.patch.object(runtime, "get_retriever"),
+            mock.patch("chatbot.views.ConversationalRetrievalChain.from_llm", return_value=chain),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def ask(self, question):
+        return self.client.post("/chatbot/", {"question": question}).json()["answer"]
+
+    def test_follow_up_questions_bypass_the_cache(self):
+        self.assertEqual(self.ask("What is August?"), "Cached answer.")
+        self.assertEqual(self.ask("Why is it called that?"), "Fresh answer.")
+        self.answer_cache.get.assert_called_once_with("What is August?", semantic=True)
+        self.answer_cache.set.assert_not_called()
+
+    def test_first_question_of_a_session_is_cached(self):
+        self.answer_cache.get.return_value = None
+        self.assertEqual(self.ask("What is August?"), "Fresh answer.")
+        self.answer_cache.set.assert_called_once_with("What is August?", "Fresh answer.", semantic=True)
+
+
+class RuntimeReadinessTests(SimpleTestCase):
+    def setUp(self):
+        runtime.reset()
+        self.addCleanup(runtime.reset)
+
+    def test_ready_without_warmup(self):
+        with mock.patch.object(runtime, "CHATBOT_WARMUP", False):
+            self.assertEqual(self.client.get("/readyz").status_code, 200)
+        with mock.patch.object(runtime, "CHATBOT_WARMUP", True):
+            self.assertEqual(self.client.get("/readyz").status_code, 503)
+            with mock.patch.dict(runtime._components, {"vectorstore": object()}):
+                self.assertEqual(self.client.get("/readyz").status_code, 200)
+
+    def test_component_build_does_not_block_the_runtime(self):
+        building, release = threading.Event(), threading.Event()
+
+        def slow_build():
+            building.set()
+            release.wait(5)
+            return "index"
+
+        thread = threading.Thread(target=runtime._get, args=("slow", slow_build))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        self.assertTrue(building.wait(5))
+        self.assertEqual(runtime._get("other", lambda: "other"), "other")
+        self.assertEqual(self.client.get("/metrics").status_code, 200)
+        self.assertTrue(runtime._lock.acquire(timeout=1))
+        runtime._lock.release()
+
+
+class MetricsTests(SimpleTestCase):
+    def scrape(self):
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        return response.content.decode().splitlines()
+
+    def test_stage_histogram_is_exposed(self):
+        metrics.observe_stage("test_retrieval", 0.02)
+        metrics.observe_stage("test_retrieval", 0.3)
+        lines = self.scrape()
+        self.assertIn("# HELP chatbot_stage_seconds Time spent in each question-answering stage.", lines)
+        self.assertIn("# TYPE chatbot_stage_seconds histogram", lines)
+        # Buckets are cumulative and end in +Inf, which equals the count
+        self.assertIn('chatbot_stage_seconds_bucket{stage="test_retrieval",le="0.01"} 0', lines)
+        self.assertIn('chatbot_stage_seconds_bucket{stage="test_retrieval",le="0.025"} 1', lines)
+        self.assertIn('chatbot_stage_seconds_bucket{stage="test_retrieval",le="0.25"} 1', lines)
+        self.assertIn('chatbot_stage_seconds_bucket{stage="test_retrieval",le="0.5"} 2', lines)
+        self.assertIn('chatbot_stage_seconds_bucket{stage="test_retrieval",le="+Inf"} 2', lines)
+        self.assertIn('chatbot_stage_seconds_count{stage="test_retrieval"} 2', lines)
+        [total] = [line for line in lines if line.startswith('chatbot_stage_seconds_sum{stage="test_retrieval"}')]
+        self.assertAlmostEqual(float(total.split()[-1]), 0.32)
+
+    def test_request_timings_collect_their_stages(self):
+        with metrics.track_request("test_view") as timings:
+            with metrics.timed_stage("test_answer"):
+                pass
+            metrics.observe_stage("test_answer", 0.5)
+        self.assertEqual(list(timings), ["test_answer"])
+        self.assertGreaterEqual(timings["test_answer"], 0.5)
+        self.assertRegex(metrics.server_timing(timings), r"^test_answer;dur=5\d\d\.\d$")
+        lines = self.scrape()
+        self.assertIn('chatbot_stage_seconds_count{stage="test_answer"} 2', lines)
+        self.assertIn('chatbot_request_seconds_count{view="test_view"} 1', lines)
+
+    def test_counters_and_gauges(self):
+        metrics.STAGE_TOKENS.inc("test_stage", "prompt", amount=12)
+        metrics.STAGE_TOKENS.inc("test_stage", "prompt", amount=3)
+        gauge = metrics.Gauge("chatbot_test_gauge", "Test gauge.", callback=lambda: 7)
+        failing = metrics.Gauge("chatbot_test_failing_gauge", "Test gauge.", callback=lambda: 1 / 0)
+        self.addCleanup(metrics.REGISTRY.remove, gauge)
+        self.addCleanup(metrics.REGISTRY.remove, failing)
+        lines = self.scrape()
+        self.assertIn("# TYPE chatbot_stage_tokens_total counter", lines)
+        self.assertIn('chatbot_stage_tokens_total{stage="test_stage",kind="prompt"} 15.0', lines)
+        self.assertIn("# TYPE chatbot_test_gauge gauge", lines)
+        self.assertIn("chatbot_test_gauge 7", lines)
+        # A gauge whose callback fails is left out rather than breaking the scrape
+        self.assertFalse([line for line in lines if "chatbot_test_failing_gauge" in line])
+
+
+class FakeClock:
+    """
+    Stands in for ``time.monotonic`` and ``asyncio.sleep`` so rate-limit waits take no real time.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+        self._sleep = asyncio.sleep
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+        self.slept += seconds
+        await self._sleep(0)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (
+            mock.patch("chatbot.ratelimit.time.monotonic", self.clock.monotonic),
+            mock.patch("chatbot.ratelimit.asyncio.sleep", self.clock.sleep),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def acquire(self, limiter, *tokens):
+        async def run():
+            for count in tokens:
+                await limiter.acquire(count)
+        asyncio.run(run())
+
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(rpm=2)
+        self.acquire(limiter, 0, 0)
+        self.assertEqual(self.clock.slept, 0)
+        self.acquire(limiter, 0)
+        self.assertAlmostEqual(self.clock.slept, 30)
+
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter(tpm=100)
+        self.acquire(limiter, 80, 50)
+        self.assertAlmostEqual(self.clock.slept, 18)
+        # A request larger than the whole budget waits for a full bucket instead of forever
+        self.acquire(limiter, 500)
+        self.assertAlmostEqual(self.clock.slept, 78)
+
+    def test_pause_holds_back_concurrent_workers(self):
+        limiter = RateLimiter(rpm=60)
+        limiter.pause(5)
+
+        async def run():
+            await asyncio.gather(*(limiter.acquire() for _ in range(3)))
+        asyncio.run(run())
+        self.assertAlmostEqual(self.clock.slept, 5)
+
+    def test_retry_after(self):
+        response = mock.Mock(headers={"retry-after": "2.5"})
+        self.assertEqual(retry_after(mock.Mock(status_code=429, response=response)), 2.5)
+        self.assertEqual(retry_after(mock.Mock(status_code=429, response=None)), 0.0)
+        self.assertIsNone(retry_after(mock.Mock(status_code=500)))
+        self.assertIsNone(retry_after(ValueError("boom")))
+
+    def test_backoff_delay_is_capped(self):
+        for attempt in range(10):
+            self.assertLessEqual(backoff_delay(attempt, base=1.0, cap=8.0), min(8.0, 2 ** attempt))
+            self.assertGreaterEqual(backoff_delay(attempt), 0)
+
+
+class SessionCheckoutTests(SimpleTestCase):
+    def test_cancelled_async_checkout_releases_the_lock(self):
+        sessions = SessionMemoryStore(FakeChatModel())
+
+        async def scenario():
+            with sessions.checkout("session"):
+                waiter = asyncio.create_task(self._checkout(sessions))
+                await asyncio.sleep(0.05)
+                waiter.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await waiter
+            # The cancelled waiter's thread takes the lock once it is free and must hand it back
+            lock = sessions._get("session").lock
+            self.assertTrue(await asyncio.to_thread(lock.acquire, timeout=2))
+            lock.release()
+
+        asyncio.run(scenario())
+
+    async def _checkout(self, sessions):
+        async with sessions.acheckout("session"):
+            pass
+
+
+class SessionStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("chatbot.sessions.time.monotonic", self.clock.monotonic)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_least_recently_used_session_is_evicted_at_capacity(self):
+        sessions = SessionMemoryStore(FakeChatModel(), max_sessions=2)
+        with sessions.checkout("a") as first:
+            pass
+        with sessions.checkout("b"):
+            pass
+        with sessions.checkout("a") as again:
+            self.assertIs(again, first)
+        with sessions.checkout("c"):
+            pass
+        self.assertEqual(list(sessions._sessions), ["a", "c"])
+        with sessions.checkout("a") as again:
+            self.assertIs(again, first)
+
+    def test_idle_sessions_expire(self):
+        sessions = SessionMemoryStore(FakeChatModel(), idle_seconds=60)
+        with sessions.checkout("a") as first:
+            first.chat_memory.add_user_message("Hello")
+        self.clock.now += 30
+        with sessions.checkout("b"):
+            pass
+        self.clock.now += 45
+        with sessions.checkout("c"):
+            pass
+        self.assertEqual(list(sessions._sessions), ["b", "c"])
+        with sessions.checkout("a") as memory:
+            self.assertIsNot(memory, first)
+            self.assertEqual(memory.chat_memory.messages, [])
+
+
+class DeferredSummaryMemoryTests(SimpleTestCase):
+    def setUp(self):
+        self.summarized = []
+        self.memory = DeferredSummaryBufferMemory(
+            llm=FakeChatModel(), memory_key="chat_history", return_messages=True, max_token_limit=10,
+            on_summarized=self.summarized.append,
+        )
+        self.started, self.release = threading.Event(), threading.Event()
+
+        def predict_new_summary(messages, summary):
+            self.started.set()
+            self.release.wait(5)
+            return f"Summary of {len(messages)} messages."
+
+        patcher = mock.patch.object(type(self.memory), "predict_new_summary", side_effect=predict_new_summary)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.release.set)
+
+    def turn(self, number):
+        self.memory.save_context({"question": f"Question number {number}?"}, {"answer": f"Answer number {number}."})
+
+    def test_summary_is_deferred_then_folded_in(self):
+        self.turn(1)
+        self.assertFalse(self.started.is_set())
+        self.turn(2)
+        # The turn returns while the summary is still being written, keeping every raw turn
+        self.assertTrue(self.started.wait(5))
+        summary, messages = self.memory.snapshot()
+        self.assertEqual(summary, "")
+        self.assertEqual(len(messages), 4)
+        self.assertEqual(self.summarized, [])
+
+        self.release.set()
+        self.memory.wait(5)
+        summary, messages = self.memory.snapshot()
+        self.assertEqual(summary, "Summary of 2 messages.")
+        self.assertEqual([message.content for message in messages], ["Question number 2?", "Answer number 2."])
+        self.assertEqual(self.summarized, [self.memory])
+        history = self.memory.load_memory_variables({})["chat_history"]
+        self.assertEqual(history[0].content, "Summary of 2 messages.")
+        self.assertEqual(len(history), 3)
+
+    def test_summary_of_cleared_turns_is_dropped(self):
+        self.turn(1)
+        self.turn(2)
+        self.assertTrue(self.started.wait(5))
+        self.memory.chat_memory.messages.clear()
+        pending = self.memory._pending
+        self.release.set()
+        pending.result(5)
+        self.assertEqual(self.memory.snapshot(), ("", []))
+        self.assertEqual(self.summarized, [])
 
-# Create your tests here.
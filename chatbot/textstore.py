@@ -0,0 +1,151 @@
+import os
+import zlib
+
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional; zlib ships with Python
+    zstandard = None
+
+load_dotenv()
+
+# Article text is stored as independently compressed blocks of this many characters,
+# so reading a chunk only decompresses the blocks its offsets fall in
+ARTICLE_TEXT_BLOCK_CHARS = int(os.getenv("ARTICLE_TEXT_BLOCK_CHARS", "8192"))
+# "zstd" (needs the zstandard package), "zlib" or "none"; applies to newly written text
+ARTICLE_TEXT_CODEC = os.getenv("ARTICLE_TEXT_CODEC", "zstd" if zstandard else "zlib")
+ARTICLE_TEXT_LEVEL = int(os.getenv("ARTICLE_TEXT_LEVEL", "9"))
+# A load compacts the database once deleted and rewritten text blocks leave this fraction of its pages free
+ARTICLE_TEXT_VACUUM_FRACTION = float(os.getenv("ARTICLE_TEXT_VACUUM_FRACTION", "0.25"))
+
+CODECS = ("none", "zlib", "zstd")
+
+
+def compress(data, codec=ARTICLE_TEXT_CODEC, level=ARTICLE_TEXT_LEVEL):
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("The zstd codec needs the zstandard package; set ARTICLE_TEXT_CODEC=zlib.")
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "none":
+        return data
+    raise ValueError(f"Unknown text codec {codec!r}; expected one of {', '.join(CODECS)}.")
+
+
+def decompress(data, codec):
+    data = bytes(data)  # BinaryField values come back as memoryview on some backends
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Article text was stored with zstd; install the zstandard package to read it.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "none":
+        return data
+    raise ValueError(f"Unknown text codec {codec!r}.")
+
+
+def _encode_block(block, codec):
+    raw = block.encode("utf-8")
+    data = compress(raw, codec)
+    # Very short blocks can grow under compression; those are stored as-is
+    return (codec, data) if len(data) < len(raw) else ("none", raw)
+
+
+def encode_blocks(text, codec=ARTICLE_TEXT_CODEC, block_chars=ARTICLE_TEXT_BLOCK_CHARS):
+    """
+    Split text into (start, length, codec, data) blocks of at most ``block_chars`` characters.
+
+    Kept free of Django imports so it can run in worker processes.
+    """
+    blocks = []
+    for start in range(0, len(text), block_chars):
+        block = text[start:start + block_chars]
+        blocks.append((start, len(block), *_encode_block(block, codec)))
+    return blocks
+
+
+def decode_blocks(blocks):
+    """
+    Join (start, length, codec, data) blocks, in start order, back into text.
+    """
+    return "".join(decompress(data, codec).decode("utf-8") for _, _, codec, data in blocks)
+
+
+def read_span(article_id, start, length):
+    """
+    Return ``length`` characters of an article's text from ``start``, decompressing only the blocks they cover.
+    """
+    from django.db import connection
+    from .models import ArticleText
+
+    # Raw SQL: on the retrieval path the ORM costs several times the query itself
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT start, length, codec, data FROM {ArticleText._meta.db_table} "
+            "WHERE article_id = %s AND start < %s AND start + length > %s ORDER BY start",
+            [article_id, start + length, start],
+        )
+        blocks = cursor.fetchall()
+    if not blocks:
+        return ""
+    offset = start - blocks[0][0]
+    return decode_blocks(blocks)[offset:offset + length]
+
+
+def write_blocks(article_blocks):
+    """
+    Replace the stored text of each article in an {article id: blocks} mapping.
+    """
+    from .models import ArticleText
+
+    ArticleText.objects.filter(article_id__in=list(article_blocks)).delete()
+    ArticleText.objects.bulk_create(
+        ArticleText(article_id=article_id, start=start, length=length, codec=codec, data=data)
+        for article_id, blocks in article_blocks.items()
+        for start, length, codec, data in blocks
+    )
+
+
+def free_fraction():
+    """
+    Return the fraction of the SQLite database's pages left free by deleted rows, or None on other backends.
+    """
+    from django.db import connection
+
+    if connection.vendor != "sqlite":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA page_count")
+        pages = cursor.fetchone()[0]
+        cursor.execute("PRAGMA freelist_count")
+        free = cursor.fetchone()[0]
+    return free / pages if pages else 0.0
+
+
+def reclaim_space(min_free_fraction=0.0):
+    """
+    VACUUM the SQLite database if at least ``min_free_fraction`` of its pages are free; return the bytes reclaimed.
+
+    SQLite reuses the pages of deleted and rewritten text blocks but never gives
+    them back to the file system on its own. Other backends reclaim space
+    themselves, and None is returned for them. Must run outside a transaction.
+    """
+    from django.db import connection
+
+    fraction = free_fraction()
+    if fraction is None:
+        return None
+    if not fraction or fraction < min_free_fraction:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA page_size")
+        page_size = cursor.fetchone()[0]
+        cursor.execute("PRAGMA page_count")
+        before = cursor.fetchone()[0]
+        cursor.execute("VACUUM")
+        cursor.execute("PRAGMA page_count")
+        after = cursor.fetchone()[0]
+    return (before - after) * page_size
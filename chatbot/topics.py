@@ -0,0 +1,163 @@
+import json
+import os
+import random
+import time
+
+import faiss
+import numpy as np
+
+from .vectorstore import MmapFlatIndex, local_vectorstores
+from .versions import resolve_store_path
+
+TOPICS_FILENAME = "topics.json"
+
+# Vectors reconstructed from the index per pass
+_BATCH_SIZE = 65536
+# Nearest chunks inspected per cluster when picking distinct article titles
+_CANDIDATES_PER_TITLE = 10
+
+
+def _iter_vectors(index):
+    """
+    Yield (start, vectors) batches of every vector stored in ``index``.
+    """
+    if isinstance(index, MmapFlatIndex):
+        for start in range(0, index.ntotal, _BATCH_SIZE):
+            yield start, np.asarray(index.vectors[start:start + _BATCH_SIZE], dtype=np.float32)
+        return
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass  # Not an IVF index; it can reconstruct without a direct map
+    for start in range(0, index.ntotal, _BATCH_SIZE):
+        yield start, index.reconstruct_n(start, min(_BATCH_SIZE, index.ntotal - start))
+
+
+def _sample_vectors(indexes, sample_size, rng):
+    total = sum(index.ntotal for index in indexes)
+    wanted = np.sort(rng.choice(total, size=min(sample_size, total), replace=False))
+    samples, offset = [], 0
+    for index in indexes:
+        for start, vectors in _iter_vectors(index):
+            lo, hi = np.searchsorted(wanted, [offset + start, offset + start + len(vectors)])
+            samples.append(vectors[wanted[lo:hi] - offset - start])
+        offset += index.ntotal
+    return np.concatenate(samples)
+
+
+def _titles_for(vector_ids):
+    """
+    Map chunk vector ids to their article titles.
+    """
+    from .models import Article, ArticleChunk
+
+    article_ids = dict(ArticleChunk.objects.filter(vector_id__in=vector_ids).values_list("vector_id", "article_id"))
+    titles = dict(Article.objects.filter(id__in=set(article_ids.values())).values_list("id", "title"))
+    return {vector_id: titles.get(article_id) for vector_id, article_id in article_ids.items()}
+
+
+def build_topic_index(vectorstore, n_clusters=50, titles_per_cluster=5, sample_size=100000, niter=20, seed=0):
+    """
+    Cluster every locally stored vector with k-means and describe each cluster by article titles.
+
+    Titles are taken from the chunks nearest each centroid, one per article.
+    Clusters come back largest first.
+    """
+    stores = [store for store in local_vectorstores(vectorstore) if store.index.ntotal]
+    indexes = [store.index for store in stores]
+    total = sum(index.ntotal for index in indexes)
+    if not total:
+        return []
+    n_clusters = min(n_clusters, total)
+    training = _sample_vectors(indexes, sample_size, np.random.default_rng(seed))
+    kmeans = faiss.Kmeans(training.shape[1], n_clusters, niter=niter, seed=seed)
+    kmeans.train(training)
+
+    assignments = np.empty(total, dtype=np.int64)
+    distances = np.empty(total, dtype=np.float32)
+    offset = 0
+    for index in indexes:
+        for start, vectors in _iter_vectors(index):
+            D, I = kmeans.index.search(vectors, 1)
+            assignments[offset + start:offset + start + len(vectors)] = I[:, 0]
+            distances[offset + start:offset + start + len(vectors)] = D[:, 0]
+        offset += index.ntotal
+
+    # Global position -> (store, local position)
+    bounds = np.cumsum([0] + [index.ntotal for index in indexes])
+    nearest = {}
+    for cluster in range(n_clusters):
+        members = np.flatnonzero(assignments == cluster)
+        limit = titles_per_cluster * _CANDIDATES_PER_TITLE
+        if len(members) > limit:
+            members = members[np.argpartition(distances[members], limit)[:limit]]
+        nearest[cluster] = members[np.argsort(distances[members])]
+
+    vector_ids = {}
+    for members in nearest.values():
+        for position in members:
+            store = int(np.searchsorted(bounds, position, side="right")) - 1
+            vector_ids[position] = stores[store].index_to_docstore_id[int(position - bounds[store])]
+    titles = _titles_for(list(vector_ids.values()))
+
+    sizes = np.bincount(assignments, minlength=n_clusters)
+    clusters = []
+    for cluster, members in nearest.items():
+        cluster_titles = []
+        for position in members:
+            title = titles.get(vector_ids[position])
+            if title and title not in cluster_titles:
+                cluster_titles.append(title)
+            if len(cluster_titles) == titles_per_cluster:
+                break
+        if cluster_titles:
+            clusters.append({"id": cluster, "size": int(sizes[cluster]), "titles": cluster_titles})
+    clusters.sort(key=lambda cluster: cluster["size"], reverse=True)
+    return clusters
+
+
+def write_topic_index(path, clusters):
+    topics_path = resolve_store_path(path) / TOPICS_FILENAME
+    tmp_path = topics_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"created_at": time.time(), "clusters": clusters}, f, indent=2)
+    os.replace(tmp_path, topics_path)
+
+
+class TopicIndex:
+    """
+    In-memory topic suggestions loaded from ``topics.json``.
+
+    Suggestions take each cluster's most representative title first, largest
+    clusters first, then the runners-up, so any prefix covers as many clusters as possible.
+    """
+
+    def __init__(self, clusters=()):
+        self.clusters = list(clusters)
+        depth = max((len(cluster["titles"]) for cluster in self.clusters), default=0)
+        self.suggestions, seen = [], set()
+        for rank in range(depth):
+            for cluster in self.clusters:
+                if rank < len(cluster["titles"]) and cluster["titles"][rank] not in seen:
+                    seen.add(cluster["titles"][rank])
+                    self.suggestions.append(
+                        {"title": cluster["titles"][rank], "cluster": cluster["id"], "size": cluster["size"]}
+                    )
+
+    @classmethod
+    def load(cls, path):
+        topics_path = resolve_store_path(path) / TOPICS_FILENAME
+        if not topics_path.exists():
+            return cls()
+        with open(topics_path) as f:
+            return cls(json.load(f)["clusters"])
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def suggest(self, n=10, shuffle=False):
+        if shuffle:
+            # One title from each of n randomly chosen clusters
+            picks = random.sample(self.clusters, min(n, len(self.clusters)))
+            return [{"title": random.choice(c["titles"]), "cluster": c["id"], "size": c["size"]} for c in picks]
+        return self.suggestions[:n]
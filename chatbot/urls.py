@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import chat_view
+from .views import chat_view, stream_view, topics_view
 
 app_name = "chatbot"
 
 urlpatterns = [
     path("", chat_view, name="chat"),
+    path("stream/", stream_view, name="stream"),
+    path("topics/", topics_view, name="topics"),
 ]
@@ -0,0 +1,378 @@
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from pathlib import Path
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+from langchain.schema import Document
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+
+from .faiss_index import tune_index
+from .versions import resolve_store_path
+
+load_dotenv()
+
+# "pickle" loads index.faiss/index.pkl into private memory; "mmap" shares pages across workers
+VECTORSTORE_MODE = os.getenv("VECTORSTORE_MODE", "pickle")
+DOCSTORE_CACHE_SIZE = int(os.getenv("DOCSTORE_CACHE_SIZE", "4096"))
+
+# "float32" searches vectors.npy as is; "float16" and "int8" search a FAISS scalar-quantized copy of it
+# and re-rank the best k * VECTORSTORE_RERANK candidates exactly against the float32 vectors.
+# Compact search needs VECTORSTORE_MODE=mmap. Re-ranking stays on by default: int8 alone loses recall
+VECTORSTORE_DTYPE = os.getenv("VECTORSTORE_DTYPE", "float32")
+VECTORSTORE_RERANK = int(os.getenv("VECTORSTORE_RERANK", "4"))
+COMPACT_DTYPES = ("float16", "int8")
+
+INDEX_IDS_FILENAME = "index_ids.sqlite3"
+VECTORS_FILENAME = "vectors.npy"
+
+# Rows read from vectors.npy at a time when writing compact vectors
+_BLOCK_SIZE = 4096
+_QUANTIZERS = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+
+class ArticleDocstore(Docstore, AddableMixin):
+    """
+    Docstore that resolves vector ids to chunks of ``Article`` rows.
+
+    Only (article id, field, offset, length) is stored per vector, in the
+    ``ArticleChunk`` table; when a search returns a chunk, only the compressed
+    text blocks it overlaps are read and decompressed. Recently returned chunks are kept in a small LRU.
+    ``add`` and ``delete`` are no-ops because ingestion owns the chunk rows. A vector id without a row gets an
+    empty document marked ``missing``, which the retrievers drop.
+    """
+
+    def __init__(self, cache_size=DOCSTORE_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._init_cache()
+
+    def _init_cache(self):
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {"cache_size": self.cache_size}
+
+    def __setstate__(self, state):
+        self.cache_size = state["cache_size"]
+        self._init_cache()
+
+    def add(self, texts):
+        pass
+
+    def delete(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                self._cache.pop(doc_id, None)
+
+    def search(self, search):
+        with self._lock:
+            document = self._cache.get(search)
+            if document is not None:
+                self._cache.move_to_end(search)
+                return document
+
+        document = self._fetch(search)
+        if document.metadata.get("missing"):
+            # Not cached: the row may be committed by the time the chunk is asked for again
+            return document
+        with self._lock:
+            self._cache[search] = document
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return document
+
+    def _fetch(self, vector_id):
+        from .models import Article, ArticleChunk
+        from .textstore import read_span
+
+        chunk = ArticleChunk.objects.filter(vector_id=vector_id).values(
+            "article_id", "field", "chunk_index", "start", "length"
+        ).first()
+        if chunk is None:
+            # The chunk was re-indexed after this index was loaded; keep serving without it
+            return Document(page_content="", metadata={"vector_id": vector_id, "missing": True})
+
+        article = Article.objects.filter(id=chunk["article_id"]).values("title", "url").first()
+        if article is None:
+            return Document(page_content="", metadata={"vector_id": vector_id, "missing": True})
+        if chunk["field"] == "title":
+            text = article["title"][chunk["start"]:chunk["start"] + chunk["length"]]
+        else:
+            text = read_span(chunk["article_id"], chunk["start"], chunk["length"])
+        return Document(
+            page_content=text,
+            metadata={
+                "source": article["url"],
+                "title": article["title"],
+                "field": chunk["field"],
+                "article_id": chunk["article_id"],
+                "chunk_index": chunk["chunk_index"],
+                "start": chunk["start"],
+                "vector_id": vector_id,
+            },
+        )
+
+
+class MmapFlatIndex:
+    """
+    Read-only exact L2 index over a memory-mapped ``vectors.npy`` array.
+
+    FAISS copies flat indexes into anonymous memory even when asked to mmap them,
+    so flat stores are searched with ``faiss.knn`` directly over the mapped file.
+    """
+
+    def __init__(self, path):
+        self.vectors = np.load(path, mmap_mode="r")
+        self.ntotal, self.d = self.vectors.shape
+
+    @property
+    def search_vectors(self):
+        return self.vectors
+
+    def search(self, x, k):
+        return faiss.knn(np.ascontiguousarray(x, dtype=np.float32), self.vectors, min(k, self.ntotal))
+
+    def reconstruct(self, i):
+        return np.array(self.vectors[i])
+
+
+def compact_filename(dtype):
+    return f"vectors_{dtype}.faiss"
+
+
+def write_compact_vectors(path, vectors, dtype):
+    """
+    Write a float16 or int8 ``IndexScalarQuantizer`` copy of ``vectors`` next to ``vectors.npy``.
+
+    int8 codes are scaled per dimension between the minimum and maximum of the
+    vectors, which are computed block by block and used as the training set.
+    The index is written under a temporary name and renamed.
+    """
+    path = Path(path)
+    index = faiss.IndexScalarQuantizer(vectors.shape[1], _QUANTIZERS[dtype], faiss.METRIC_L2)
+    if dtype == "int8" and len(vectors):
+        low = np.full(vectors.shape[1], np.inf, dtype=np.float32)
+        high = np.full(vectors.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(vectors), _BLOCK_SIZE):
+            block = vectors[start:start + _BLOCK_SIZE]
+            low, high = np.minimum(low, block.min(axis=0)), np.maximum(high, block.max(axis=0))
+        index.train(np.stack([low, high]))
+    for start in range(0, len(vectors), _BLOCK_SIZE):
+        index.add(np.ascontiguousarray(vectors[start:start + _BLOCK_SIZE], dtype=np.float32))
+    codes_path = path / compact_filename(dtype)
+    tmp_path = codes_path.with_suffix(".tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, codes_path)
+
+
+class CompactFlatIndex(MmapFlatIndex):
+    """
+    Exact-after-re-ranking L2 index that searches float16 or int8 codes.
+
+    The codes are a FAISS ``IndexScalarQuantizer``, which computes distances on
+    them directly; it is read into memory, at a half or a quarter of the size of
+    the float32 vectors. The float32 rows of the best ``k * rerank`` candidates
+    are then paged in from ``vectors.npy`` and re-scored exactly. ``rerank`` of
+    0 returns the compact distances as is.
+    """
+
+    def __init__(self, path, dtype, rerank=VECTORSTORE_RERANK):
+        path = Path(path)
+        super().__init__(path / VECTORS_FILENAME)
+        self.dtype = dtype
+        self.rerank = rerank
+        self.codes = faiss.read_index(str(path / compact_filename(dtype)))
+
+    @property
+    def search_vectors(self):
+        # The codes are in memory already, and only re-ranked float32 rows are ever read
+        return None
+
+    def search(self, x, k):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        k = min(k, self.ntotal)
+        if not self.rerank:
+            return self.codes.search(x, k)
+        _, candidates = self.codes.search(x, min(self.ntotal, k * self.rerank))
+        distances = np.full((len(x), k), np.inf, dtype=np.float32)
+        ids = np.full((len(x), k), -1, dtype=np.int64)
+        for row, query in enumerate(x):
+            # Sorted positions read the float32 file front to back
+            positions = np.sort(candidates[row][candidates[row] >= 0])
+            exact = ((self.vectors[positions] - query) ** 2).sum(axis=1)
+            best = np.argsort(exact)[:k]
+            distances[row, :len(best)] = exact[best]
+            ids[row, :len(best)] = positions[best]
+        return distances, ids
+
+
+class SQLiteIndexMapping(Mapping):
+    """
+    Lazy ``index_to_docstore_id`` mapping read from ``index_ids.sqlite3``.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+
+    def __getitem__(self, position):
+        with self._lock:
+            row = self._conn.execute("SELECT doc_id FROM ids WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __iter__(self):
+        with self._lock:
+            positions = [row[0] for row in self._conn.execute("SELECT position FROM ids ORDER BY position")]
+        return iter(positions)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+
+def export_mmap_store(path, vectorstore, dtype=VECTORSTORE_DTYPE, mode=VECTORSTORE_MODE):
+    """
+    Write the memory-mappable side files next to ``index.faiss``.
+
+    ``index_ids.sqlite3`` maps index positions to vector ids. For ``mode`` "mmap",
+    flat indexes also get their raw vectors as ``vectors.npy``, plus a compact
+    copy when ``dtype`` is float16 or int8; pickle-mode stores read
+    ``index.faiss`` itself, so those copies are left out. Files are written under
+    temporary names and renamed, so readers never see partial files.
+    """
+    path = Path(path)
+    ids_path = path / INDEX_IDS_FILENAME
+    tmp_path = ids_path.with_suffix(".tmp")
+    tmp_path.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("CREATE TABLE ids (position INTEGER PRIMARY KEY, doc_id TEXT NOT NULL)")
+    conn.executemany("INSERT INTO ids VALUES (?, ?)", vectorstore.index_to_docstore_id.items())
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, ids_path)
+
+    vectors_path = path / VECTORS_FILENAME
+    index = vectorstore.index
+    flat = mode == "mmap" and isinstance(index, faiss.IndexFlat)
+    if flat:
+        vectors = faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+        tmp_path = vectors_path.with_suffix(".tmp.npy")
+        np.save(tmp_path, vectors)
+        os.replace(tmp_path, vectors_path)
+        if dtype in COMPACT_DTYPES:
+            write_compact_vectors(path, vectors, dtype)
+    else:
+        vectors_path.unlink(missing_ok=True)
+    # Compact copies of an older vectors.npy would no longer line up with it
+    for stale in COMPACT_DTYPES:
+        if stale != dtype or not flat:
+            (path / compact_filename(stale)).unlink(missing_ok=True)
+        # Copies written as numpy arrays before the codes were a FAISS index
+        (path / f"vectors_{stale}.npy").unlink(missing_ok=True)
+    (path / "vector_scales.npy").unlink(missing_ok=True)
+
+
+def load_mmap_vectorstore(path, embeddings):
+    """
+    Open a vector store read-only without deserializing it into private memory.
+    """
+    path = Path(path)
+    vectors_path = path / VECTORS_FILENAME
+    if VECTORSTORE_DTYPE in COMPACT_DTYPES and (path / compact_filename(VECTORSTORE_DTYPE)).exists():
+        index = CompactFlatIndex(path, VECTORSTORE_DTYPE)
+    elif vectors_path.exists():
+        index = MmapFlatIndex(vectors_path)
+    else:
+        index = faiss.read_index(str(path / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=ArticleDocstore(),
+        index_to_docstore_id=SQLiteIndexMapping(path / INDEX_IDS_FILENAME),
+    )
+
+
+def load_vectorstore(path, embeddings, mode=None, sharded=True):
+    """
+    Load the vector store at ``path`` in the configured storage mode and apply query-time tuning.
+
+    A directory with a shard manifest, or any path while ``VECTORSTORE_SHARD_URLS``
+    is set, is opened as a ``ShardedVectorStore``; ``sharded=False`` loads ``path``
+    itself as one local store, as a shard does.
+    """
+    from .sharding import MANIFEST_FILENAME, VECTORSTORE_SHARD_URLS, load_sharded_vectorstore
+
+    path = str(resolve_store_path(path))
+    if sharded and (VECTORSTORE_SHARD_URLS or (Path(path) / MANIFEST_FILENAME).exists()):
+        return load_sharded_vectorstore(
+            path, embeddings, lambda shard: load_vectorstore(shard, embeddings, mode, sharded=False)
+        )
+
+    mode = mode or VECTORSTORE_MODE
+    if mode != "mmap" and VECTORSTORE_DTYPE in COMPACT_DTYPES:
+        # The in-memory index is the float32 index.faiss; searching it would silently ignore the setting
+        raise ValueError(f"VECTORSTORE_DTYPE={VECTORSTORE_DTYPE} needs VECTORSTORE_MODE=mmap.")
+    if mode == "mmap":
+        vectorstore = load_mmap_vectorstore(path, embeddings)
+    else:
+        vectorstore = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    tune_index(vectorstore.index)
+    return vectorstore
+
+
+def touch_pages(index, page_size=4096):
+    """
+    Read one byte per page of a memory-mapped flat index so the first query does not fault them in.
+    """
+    if isinstance(index, MmapFlatIndex) and index.ntotal and index.search_vectors is not None:
+        flat = index.search_vectors.reshape(-1).view(np.uint8)
+        int(flat[::page_size].sum())
+
+
+def compact_recall(path, dtype, k=10, n_queries=100, rerank=VECTORSTORE_RERANK, seed=0):
+    """
+    Measure recall@k of compact search, with and without re-ranking, against exact float32 search.
+
+    Stored vectors are used as queries. Returns the recalls and bytes per vector.
+    """
+    from .faiss_index import recall_at_k
+
+    exact = MmapFlatIndex(Path(path) / VECTORS_FILENAME)
+    compact = CompactFlatIndex(path, dtype, rerank=rerank)
+    rng = np.random.default_rng(seed)
+    positions = np.sort(rng.choice(exact.ntotal, size=min(n_queries, exact.ntotal), replace=False))
+    queries = np.asarray(exact.vectors[positions])
+    reranked = recall_at_k(compact, exact, queries, k=k)
+    compact.rerank = 0
+    return {
+        "recall": reranked,
+        "recall_without_rerank": recall_at_k(compact, exact, queries, k=k),
+        "bytes_per_vector": compact.codes.code_size,
+        "float32_bytes_per_vector": 4 * exact.d,
+    }
+
+
+def local_vectorstores(vectorstore):
+    """
+    Return the FAISS vector stores held in this process, looking inside local shards.
+    """
+    from .sharding import LocalShard, ShardedVectorStore
+
+    if isinstance(vectorstore, ShardedVectorStore):
+        return [shard.vectorstore for shard in vectorstore.shards if isinstance(shard, LocalShard)]
+    return [vectorstore]
+
+
+def local_indexes(vectorstore):
+    """
+    Return the FAISS indexes held in this process, looking inside local shards.
+    """
+    return [store.index for store in local_vectorstores(vectorstore)]
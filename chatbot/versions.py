@@ -0,0 +1,168 @@
+import os
+import shutil
+import time
+from pathlib import Path
+
+from .faiss_index import INDEX_META_FILENAME
+
+CURRENT_LINK = "current"
+STAGING_LINK = "staging"
+VERSIONS_DIRNAME = "versions"
+# Names the store's chunk rows in the database; kept beside the versions, not in them
+STORE_KEY_FILENAME = "store_key"
+# Chunk-mapping changes staged with a version until it is published, one JSON segment per checkpoint
+JOURNAL_DIRNAME = "chunk_journal"
+
+# Files that FAISS and LangChain rewrite in place; every other store file is
+# replaced atomically, so versions can share them through hard links.
+_REWRITTEN_IN_PLACE = {"index.faiss", "index.pkl", INDEX_META_FILENAME}
+
+
+def _read_link(path, name):
+    link = Path(path) / name
+    if not link.is_symlink():
+        return None
+    target = link.resolve()
+    return target if target.is_dir() else None
+
+
+def published_version(path):
+    """
+    Return (version name, directory) of the published store; the name is None for an unversioned store.
+    """
+    target = _read_link(path, CURRENT_LINK)
+    return (None, Path(path)) if target is None else (target.name, target)
+
+
+def resolve_store_path(path):
+    """
+    Return the directory holding the published store: ``current``'s target, or ``path`` for unversioned stores.
+    """
+    return published_version(path)[1]
+
+
+def current_version(path):
+    return published_version(path)[0]
+
+
+def staging_version(path):
+    return _read_link(path, STAGING_LINK)
+
+
+def read_store_key(path):
+    """
+    Return the key of the store's chunk rows, or None for a store that has not been keyed yet.
+    """
+    try:
+        return (Path(path) / STORE_KEY_FILENAME).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_store_key(path, key):
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    tmp_path = path / f".{STORE_KEY_FILENAME}.tmp"
+    tmp_path.write_text(key)
+    os.replace(tmp_path, path / STORE_KEY_FILENAME)
+
+
+def _point(path, name, target):
+    """
+    Atomically repoint the ``name`` symlink in ``path`` at ``target``.
+    """
+    link = Path(path) / name
+    tmp_link = link.with_name(f".{name}.tmp")
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(Path(target).relative_to(Path(path).resolve()), tmp_link)
+    os.replace(tmp_link, link)
+
+
+def _link_or_copy(src, dst):
+    if Path(src).name in _REWRITTEN_IN_PLACE:
+        return shutil.copy2(src, dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def create_version(path, exclude=(), stage=True):
+    """
+    Start a new unpublished version seeded from the published store and point ``staging`` at it.
+
+    An unversioned store found directly in ``path`` is used as the seed, so the
+    first versioned run migrates it. Files named in ``exclude`` are not copied.
+    ``stage=False`` leaves ``staging`` alone, for a version that is published
+    straight away while an ingestion run may still own the staged one.
+    """
+    path = Path(path)
+    (path / VERSIONS_DIRNAME).mkdir(parents=True, exist_ok=True)
+    version = (path / VERSIONS_DIRNAME / time.strftime("%Y%m%d-%H%M%S")).resolve()
+    suffix = 1
+    while version.exists():
+        version = version.with_name(f"{version.name.split('.')[0]}.{suffix}")
+        suffix += 1
+
+    source = resolve_store_path(path)
+    ignore = shutil.ignore_patterns(
+        VERSIONS_DIRNAME, CURRENT_LINK, STAGING_LINK, f".{CURRENT_LINK}.tmp", STORE_KEY_FILENAME, *exclude
+    )
+    if source.exists():
+        shutil.copytree(source, version, ignore=ignore, copy_function=_link_or_copy)
+    else:
+        version.mkdir()
+    if stage:
+        _point(path, STAGING_LINK, version)
+    return version
+
+
+def discard_staging(path):
+    staging = staging_version(path)
+    if staging is not None:
+        shutil.rmtree(staging)
+    (Path(path) / STAGING_LINK).unlink(missing_ok=True)
+
+
+def publish_version(path, version):
+    """
+    Atomically make ``version`` the store that servers load.
+
+    ``staging`` is cleared only if it points at ``version``; another staged version keeps its link.
+    """
+    staged = staging_version(path) == Path(version).resolve()
+    _point(path, CURRENT_LINK, version)
+    if staged:
+        (Path(path) / STAGING_LINK).unlink(missing_ok=True)
+
+
+def version_names(path):
+    """
+    Return the names of the versions on disk, oldest first.
+    """
+    versions_dir = Path(path) / VERSIONS_DIRNAME
+    if not versions_dir.is_dir():
+        return []
+    return sorted(v.name for v in versions_dir.iterdir() if v.is_dir())
+
+
+def prune_versions(path, keep=3):
+    """
+    Delete all but the newest ``keep`` versions, never the published one.
+
+    Servers that still have an old version open keep reading it: mapped files
+    stay valid until they are closed, and pickled stores are already in memory.
+    """
+    versions_dir = Path(path) / VERSIONS_DIRNAME
+    if not versions_dir.is_dir():
+        return []
+    protected = {resolve_store_path(path), staging_version(path)}
+    # Names are creation timestamps; copytree copies the seed's mtime, so it can't be used here
+    versions = sorted(v for v in versions_dir.iterdir() if v.is_dir())
+    removed = []
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version.resolve() not in protected:
+            shutil.rmtree(version)
+            removed.append(version.name)
+    return removed
@@ -1,37 +1,31 @@
-import os
+import json
+import time
+from asgiref.sync import sync_to_async
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
-from dotenv import load_dotenv
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from langchain.chains import ConversationalRetrievalChain
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationSummaryBufferMemory
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from .scripts.chat_with_wikipedia import get_qa_chain
+from . import metrics, runtime
 
-# Load environment variables
-load_dotenv()
+# Passed with every chain call so stage spans are attributed to this request
+_CHAIN_CONFIG = {"callbacks": [metrics.STAGE_HANDLER]}
 
-# OpenAI API key and model
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-MODEL_NAME = os.getenv("OPENAI_API_MODEL", "gpt-4")
-VECTORSTORE_PATH = "./wiki_embeddings"
 
-
-# Global retriever and QA chain
-def load_retriever():
-    try:
-        embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-        vectorstore = FAISS.load_local(VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
-        return vectorstore.as_retriever()
-    except Exception as e:
-        raise RuntimeError(f"Error loading retriever: {e}")
+def _chain_config(question, title_pks):
+    """
+    Return the chain's run config, handing the retriever the title match already looked up for ``question``.
+    """
+    if title_pks is None:
+        return _CHAIN_CONFIG
+    return {**_CHAIN_CONFIG, "metadata": {"title_query": question, "title_pks": title_pks}}
 
 
-retriever = load_retriever()
-llm = ChatOpenAI(model_name=MODEL_NAME, temperature=0, openai_api_key=OPENAI_API_KEY)
-memory = ConversationSummaryBufferMemory(llm=llm, memory_key="chat_history", return_messages=True)
-qa_chain = ConversationalRetrievalChain.from_llm(llm=llm, retriever=retriever, memory=memory)
+def _session_id(request):
+    """
+    Return the Django session key for the request, creating a session if needed.
+    """
+    if request.session.session_key is None:
+        request.session.save()
+    return request.session.session_key
 
 
 @csrf_exempt
@@ -47,9 +41,168 @@ def chat_view(request):
         if not question:
             return JsonResponse({"error": "No question provided."}, status=400)
 
-        result = qa_chain.invoke({"question": question})
-        answer = result.get("answer", "Sorry, I couldn't find an answer.")
-        return JsonResponse({"answer": answer})
+        with metrics.track_request("chat") as timings:
+            response = _answer(request, question)
+        metrics.REQUESTS.inc("chat", str(response.status_code))
+        if metrics.METRICS_SERVER_TIMING and timings:
+            response["Server-Timing"] = metrics.server_timing(timings)
+        return response
 
     return JsonResponse({"error": "Invalid request method."}, status=405)
 
+
+def _cacheable(memory):
+    """
+    True when the session has no history yet, so ``question`` means the same as in any other session.
+
+    Follow-ups ("and its capital?") depend on the conversation, so they are
+    neither answered from nor written to the shared answer cache.
+    """
+    summary, messages = memory.snapshot()
+    return not summary and not messages
+
+
+def _answer(request, question):
+    """
+    Answer ``question`` from the cache or the retrieval chain, within the session's memory.
+    """
+    answer_cache = runtime.get_answer_cache()
+    with runtime.get_sessions().checkout(_session_id(request)) as memory:
+        cacheable = _cacheable(memory)
+        answer, title_pks = None, None
+        if cacheable:
+            # Title questions skip embedding in the retriever, so the cache must not embed them either
+            title_pks = runtime.title_pks(question)
+            semantic = not title_pks
+            with metrics.timed_stage("answer_cache"):
+                answer = answer_cache.get(question, semantic=semantic)
+        if answer is not None:
+            # Keep the conversation history consistent with what the user saw
+            memory.save_context({"question": question}, {"answer": answer})
+            return JsonResponse({"answer": answer})
+
+        qa_chain = ConversationalRetrievalChain.from_llm(
+            llm=runtime.get_llm(), retriever=runtime.get_retriever(), memory=memory
+        )
+        result = qa_chain.invoke({"question": question}, config=_chain_config(question, title_pks))
+        answer = result.get("answer", "Sorry, I couldn't find an answer.")
+        if "answer" in result and cacheable:
+            answer_cache.set(question, answer, semantic=semantic)
+    return JsonResponse({"answer": answer})
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_answer(session_id, question):
+    """
+    Run the retrieval chain asynchronously and yield answer tokens as server-sent events.
+    """
+    answer_cache = await sync_to_async(runtime.get_answer_cache, thread_sensitive=False)()
+    sessions = await sync_to_async(runtime.get_sessions, thread_sensitive=False)()
+    async with sessions.acheckout(session_id) as memory:
+        cacheable = _cacheable(memory)
+        answer, title_pks = None, None
+        if cacheable:
+            title_pks = await sync_to_async(runtime.title_pks, thread_sensitive=False)(question)
+            semantic = not title_pks
+            answer = await sync_to_async(answer_cache.get, thread_sensitive=False)(question, semantic=semantic)
+        if answer is not None:
+            await sync_to_async(memory.save_context, thread_sensitive=False)(
+                {"question": question}, {"answer": answer}
+            )
+            yield _sse("done", {"answer": answer})
+            return
+
+        tokens = []
+        try:
+            retriever = await sync_to_async(runtime.get_retriever, thread_sensitive=False)()
+            qa_chain = ConversationalRetrievalChain.from_llm(
+                llm=runtime.get_answer_llm(), condense_question_llm=runtime.get_llm(), retriever=retriever,
+                memory=memory,
+            )
+            config = _chain_config(question, title_pks)
+            async for event in qa_chain.astream_events({"question": question}, config=config, version="v2"):
+                if event["event"] == "on_chat_model_stream" and "answer" in event.get("tags", []):
+                    token = event["data"]["chunk"].content
+                    if token:
+                        tokens.append(token)
+                        yield _sse("token", {"token": token})
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+            return
+
+        answer = "".join(tokens)
+        if answer and cacheable:
+            await sync_to_async(answer_cache.set, thread_sensitive=False)(question, answer, semantic=semantic)
+        yield _sse("done", {"answer": answer or "Sorry, I couldn't find an answer."})
+
+
+async def _tracked_stream(session_id, question):
+    """
+    Count the stream as in flight until its last event has been sent.
+    """
+    metrics.INFLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        async for event in _stream_answer(session_id, question):
+            yield event
+    finally:
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, "stream")
+        metrics.REQUESTS.inc("stream", "200")
+        metrics.INFLIGHT.dec()
+
+
+@csrf_exempt
+async def stream_view(request):
+    """
+    Stream the answer to ``question`` (GET or POST) as ``text/event-stream``.
+    """
+    if request.method not in ("GET", "POST"):
+        return JsonResponse({"error": "Invalid request method."}, status=405)
+
+    question = request.GET.get("question") or request.POST.get("question")
+    if not question:
+        return JsonResponse({"error": "No question provided."}, status=400)
+
+    session_id = await sync_to_async(_session_id)(request)
+    response = StreamingHttpResponse(_tracked_stream(session_id, question), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def topics_view(request):
+    """
+    Return topic suggestions from the precomputed cluster index; ``?n=`` and ``?shuffle=1`` are optional.
+    """
+    try:
+        n = min(int(request.GET.get("n", 10)), 100)
+    except ValueError:
+        return JsonResponse({"error": "n must be an integer."}, status=400)
+    topics = runtime.get_topics()
+    shuffle = request.GET.get("shuffle") in ("1", "true", "yes")
+    return JsonResponse({"topics": topics.suggest(n, shuffle=shuffle), "clusters": len(topics)})
+
+
+def healthz_view(request):
+    """
+    Liveness probe: the process is up and serving requests.
+    """
+    return JsonResponse({"status": "ok"})
+
+
+def readyz_view(request):
+    """
+    Readiness probe: 200 once the index is loaded (or at once with warmup off), 503 before that.
+    """
+    status = runtime.status()
+    return JsonResponse(status, status=200 if status["ready"] else 503)
+
+
+def metrics_view(request):
+    """
+    Expose stage latencies, token counts and runtime gauges in the Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wiki_chatbot.settings')
 
 application = get_asgi_application()
+
+# Load the vector index in the background; /readyz reports when it is warm
+from chatbot.runtime import start_warmup  # noqa: E402
+
+start_warmup()
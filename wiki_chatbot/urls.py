@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
+from chatbot.views import healthz_view, metrics_view, readyz_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("chatbot/", include("chatbot.urls", namespace="chatbot")),
+    path("healthz", healthz_view, name="healthz"),
+    path("readyz", readyz_view, name="readyz"),
+    path("metrics", metrics_view, name="metrics"),
 ]